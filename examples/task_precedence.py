@@ -10,6 +10,9 @@ from yaku.scheduler \
 from yaku.task \
     import \
         task_factory
+from yaku.utils \
+    import \
+        copy_file
 
 import yaku.tools
 import yaku.errors
@@ -24,7 +27,7 @@ def copy_func(self):
         raise AssertionError("precendence test failed")
     source, target = self.inputs[0], self.outputs[0]
     pprint('BLUE', "%-16s%s" % (self.name.upper(), self.inputs[0].srcpath()))
-    target.write(source.read())
+    copy_file(source.abspath(), target.abspath())
 
 def convert_func(self):
     global __RUN_CONVERT
@@ -0,0 +1,95 @@
+#! /usr/bin/env python
+"""
+%prog [NTASKS...]
+
+Benchmark for the task ordering (yaku.task_manager.TaskManager).
+
+Each project is made of cython -> cc -> link chains: one extension every 20
+sources, with a class-level before constraint between two copy task
+classes, as used by the 2to3 builder. The time to build the graph and to
+walk it with next_set should grow linearly with the number of tasks.
+"""
+from optparse import OptionParser
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from yaku.node \
+    import \
+        Node
+from yaku.task \
+    import \
+        task_factory
+from yaku.task_manager \
+    import \
+        TaskManager
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+def make_tasks(ntasks):
+    root = Node("", None).make_node("project")
+    cython_tf = task_factory("cython")
+    cc_tf = task_factory("cc")
+    link_tf = task_factory("pylink")
+    copy_tf = task_factory("bench_copy")
+    convert_tf = task_factory("bench_convert")
+    if not copy_tf.__name__ in convert_tf.before:
+        convert_tf.before.append(copy_tf.__name__)
+
+    tasks = []
+    objects = []
+    i = 0
+    while len(tasks) < ntasks:
+        d = "ext%d" % (i // 20)
+        pyx = root.make_node([d, "src%d.pyx" % i])
+        c = root.make_node([d, "src%d.c" % i])
+        o = root.make_node([d, "src%d.o" % i])
+        tasks.append(cython_tf(inputs=[pyx], outputs=[c]))
+        tasks.append(cc_tf(inputs=[c], outputs=[o]))
+        objects.append(o)
+        if len(objects) == 20:
+            so = root.make_node([d, "ext.so"])
+            tasks.append(link_tf(inputs=objects, outputs=[so]))
+            objects = []
+
+        py = root.make_node([d, "mod%d.py" % i])
+        tmp = root.make_node(["tmp", d, "mod%d.py" % i])
+        py3k = root.make_node(["py3k", d, "mod%d.py" % i])
+        tasks.append(copy_tf(inputs=[py], outputs=[tmp]))
+        tasks.append(convert_tf(inputs=[tmp], outputs=[py3k]))
+        i += 1
+    return tasks
+
+def bench(ntasks):
+    tasks = make_tasks(ntasks)
+
+    t0 = time.time()
+    manager = TaskManager(tasks)
+    t1 = time.time()
+    n = 0
+    grp = manager.next_set()
+    while grp:
+        n += len(grp)
+        grp = manager.next_set()
+    t2 = time.time()
+    assert n == len(tasks)
+    return len(tasks), t1 - t0, t2 - t1
+
+def main():
+    p = OptionParser(usage=__doc__.strip())
+    options, args = p.parse_args()
+    if args:
+        sizes = [int(a) for a in args]
+    else:
+        sizes = DEFAULT_SIZES
+
+    print("%10s %12s %12s %14s" % ("tasks", "graph (s)", "walk (s)", "us / task"))
+    for size in sizes:
+        ntasks, tgraph, twalk = bench(size)
+        print("%10d %12.3f %12.3f %14.2f" % (ntasks, tgraph, twalk,
+              (tgraph + twalk) * 1e6 / ntasks))
+
+if __name__ == "__main__":
+    main()
@@ -17,5 +17,19 @@ HOOK_DUMP = ".hooks.pck"
 
 CONFIG_CACHE = ".config.pck"
 BUILD_CACHE = ".build.pck"
+HASH_CACHE = ".hashes.pck"
+
+# Environment variables to enable the shared artifact cache: directory, and
+# maximum size in bytes
+ARTIFACT_CACHE_DIR_VAR = "YAKU_CACHE_DIR"
+ARTIFACT_CACHE_SIZE_VAR = "YAKU_CACHE_SIZE"
+# URL of the remote artifact cache (see yaku.remote_cache). Without
+# YAKU_CACHE_DIR, the local cache is ARTIFACT_CACHE in the build directory
+REMOTE_CACHE_VAR = "YAKU_REMOTE_CACHE"
+ARTIFACT_CACHE = ".artifacts"
+# Set to 1 to restore outputs from the local cache as hardlinks when the
+# filesystem has no reflinks. Only safe if no command modifies its outputs in
+# place
+ARTIFACT_CACHE_HARDLINKS_VAR = "YAKU_CACHE_HARDLINKS"
 
 _OUTPUT = sys.stdout
@@ -0,0 +1,115 @@
+"""asyncio based runner (python >= 3.5 only)."""
+import time
+import asyncio
+import traceback
+
+from yaku.task_manager \
+    import \
+        TaskManager, task_needs_run, task_ran
+from yaku.jobserver \
+    import \
+        get_current as get_jobserver
+import yaku.errors
+
+async def _exec_command(task, cmd, cwd, env):
+    cwd, done = task.pre_exec_command(cmd, cwd)
+    if done:
+        return
+    kw = {}
+    if env is not None:
+        kw["env"] = env
+    jobserver = get_jobserver()
+    if jobserver is not None:
+        kw.update(jobserver.child_kw(env))
+    try:
+        p = await asyncio.create_subprocess_exec(*cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT, cwd=cwd, **kw)
+    except OSError as e:
+        raise yaku.errors.TaskRunFailure(cmd, str(e))
+    task.process = p
+    try:
+        output = (await p.communicate())[0]
+    finally:
+        task.process = None
+    task.post_exec_command(cmd, p.returncode, output)
+
+async def _run_task(ctx, task, semaphore, stop):
+    if not task_needs_run(ctx, task):
+        return
+    async with semaphore:
+        if stop.is_set() or task.cancelled:
+            # Another task failed while this one was waiting
+            return
+        try:
+            start = time.time()
+            expand = getattr(task.func, "expand", None)
+            if expand is None:
+                # Python task function: run it in a thread, as it may block
+                loop = asyncio.get_event_loop()
+                await loop.run_in_executor(None, task.run)
+            else:
+                task.executed_commands = []
+                task.restored_deps = None
+                task.peak_rss = None
+                cmd, cwd, env = task.expand_command()
+                await _exec_command(task, cmd, cwd, env)
+            task.duration = time.time() - start
+        except BaseException:
+            # Set before the semaphore is released, so that the waiting
+            # tasks do not start
+            stop.set()
+            raise
+    task_ran(ctx, task)
+
+async def run_tasks_async(ctx, tasks=None, maxjobs=1):
+    """Run tasks from the running event loop, with at most maxjobs of them
+    running at the same time.
+
+    Commands of compiled task functions are launched as asyncio
+    subprocesses, waiting on them costs no thread. Other task functions run
+    in the default executor of the loop.
+
+    Only maxjobs limits the concurrency: this runner does not take tokens
+    from an inherited make jobserver (use run_tasks_parallel for that). The
+    jobserver of a running ParallelRunner is still passed to the commands."""
+    if tasks is None:
+        tasks = ctx.tasks
+    task_manager = TaskManager(tasks, getattr(ctx, "durations", None))
+    semaphore = asyncio.Semaphore(maxjobs)
+    stop = asyncio.Event()
+
+    running = {}
+    def _start(task):
+        future = asyncio.ensure_future(_run_task(ctx, task, semaphore, stop))
+        running[future] = task
+
+    for task in task_manager.ready_tasks():
+        _start(task)
+
+    # When a task fails, the commands of the running tasks are terminated,
+    # and nothing new is started
+    failure = None
+    while running:
+        done, pending = await asyncio.wait(list(running.keys()),
+                return_when=asyncio.FIRST_COMPLETED)
+        for future in done:
+            task = running.pop(future)
+            e = future.exception()
+            if e is not None:
+                if failure is None:
+                    if isinstance(e, yaku.errors.TaskRunFailure):
+                        failure = e
+                    else:
+                        lines = traceback.format_exception(type(e), e,
+                                                           e.__traceback__)
+                        failure = yaku.errors.TaskRunFailure([],
+                                                             "".join(lines))
+                    for t in running.values():
+                        t.terminate()
+            elif failure is None:
+                for t in task_manager.task_done(task):
+                    _start(t)
+
+    if failure is not None:
+        raise failure
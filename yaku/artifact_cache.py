@@ -0,0 +1,332 @@
+"""Content addressed cache of task outputs, shared between builds.
+
+A task command is identified by its content signature (inputs, deps and
+function) and its expanded command line, where the source and build
+directories are replaced by placeholders: the same entry is used by trees
+checked out at different places. When the same command has been run
+before, in this build directory or another one, its outputs are restored
+from the cache instead of running it again. Outputs are restored as they
+were built: those embedding absolute paths (debug information, __FILE__)
+still refer to the tree which stored them.
+
+As with ccache manifests, a key holds one entry per state of the implicit
+dependencies (headers) the outputs were built with, so that builds using
+different versions of a header (e.g. two branches) do not evict each
+other. Layout of the cache directory, <variant> being the md5 of the deps
+file of the entry::
+
+    <key[:2]>/<key>/<variant>/0, 1, ...   outputs of the task, in order
+    <key[:2]>/<key>/<variant>/stdout      output of the command
+    <key[:2]>/<key>/<variant>/modes       permission bits of the outputs,
+                                          in octal
+    <key[:2]>/<key>/<variant>/deps        implicit dependencies at the time
+                                          the entry was stored, one
+                                          "<md5> <path>" per line (paths
+                                          relative to the source and build
+                                          directories use the same
+                                          placeholders)
+
+A remote cache (see yaku.remote_cache) may be used as a second level: local
+misses are looked up there, and stored entries are uploaded to it. The
+remote cache only keeps the last entry stored for a key.
+"""
+import os
+import shutil
+import tempfile
+import binascii
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+from yaku.hash_cache \
+    import \
+        node_hash
+from yaku.remote_cache \
+    import \
+        pack, unpack
+from yaku.utils \
+    import \
+        copy_file
+
+# Default maximum size of the cache, in bytes
+DEFAULT_MAX_SIZE = 5 * 2 ** 30
+
+def _read_file(filename):
+    fid = open(filename, "rb")
+    try:
+        return fid.read()
+    finally:
+        fid.close()
+
+def _write_file(filename, data):
+    fid = open(filename, "wb")
+    try:
+        fid.write(data)
+    finally:
+        fid.close()
+
+def _encode_deps(deps):
+    lines = ["%s %s\n" % (binascii.hexlify(digest).decode("ascii"), path)
+             for path, digest in deps]
+    return "".join(lines).encode("utf-8")
+
+def _decode_deps(data):
+    deps = []
+    for line in data.decode("utf-8").splitlines():
+        digest, path = line.split(" ", 1)
+        deps.append((path, binascii.unhexlify(digest.encode("ascii"))))
+    return deps
+
+def _roots(task):
+    ctx = task.outputs[0].ctx
+    # The build directory first, as it is usually inside the source one
+    return [(ctx.bldnode.abspath(), "${BLDDIR}"),
+            (ctx.srcnode.abspath(), "${SRCDIR}")]
+
+def _relocatable(s, roots):
+    """Replace the roots in s by their placeholder."""
+    for root, name in roots:
+        if s == root:
+            return name
+        s = s.replace(root + os.sep, name + "/")
+    return s
+
+def _absolute(s, roots):
+    for root, name in roots:
+        if s == name:
+            return root
+        if s.startswith(name + "/"):
+            return os.path.join(root, *s[len(name)+1:].split("/"))
+    return s
+
+class ArtifactCache(object):
+    def __init__(self, path, max_size=DEFAULT_MAX_SIZE, allow_hardlinks=False,
+                 remote=None):
+        self.path = os.path.abspath(path)
+        self.max_size = max_size
+        self.allow_hardlinks = allow_hardlinks
+        self.remote = remote
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+    def key(self, task, cmd):
+        roots = _roots(task)
+        m = md5()
+        m.update(task.content_signature())
+        # The command line covers the env variables used by the task
+        cmd = [_relocatable(str(c), roots) for c in cmd]
+        m.update("\0".join(cmd).encode("utf-8"))
+        return m.hexdigest()
+
+    def _entry(self, key, variant=None):
+        if variant is None:
+            return os.path.join(self.path, key[:2], key)
+        return os.path.join(self.path, key[:2], key, variant)
+
+    def _variants(self, key):
+        """Return the entries of key, most recently used first."""
+        entries = []
+        d = self._entry(key)
+        try:
+            for variant in os.listdir(d):
+                entry = os.path.join(d, variant)
+                entries.append((os.path.getmtime(entry), entry))
+        except OSError:
+            return []
+        entries.sort(reverse=True)
+        return [e[1] for e in entries]
+
+    def _matching_deps(self, task, entry):
+        """Return the absolute paths of the implicit dependencies of entry,
+        or None if one of them changed since the entry was stored."""
+        try:
+            deps = _decode_deps(_read_file(os.path.join(entry, "deps")))
+        except (IOError, OSError, ValueError):
+            return None
+        roots = _roots(task)
+        root = task.outputs[0]
+        while root.parent:
+            root = root.parent
+        paths = []
+        for path, digest in deps:
+            path = _absolute(path, roots)
+            node = root.find_node(path)
+            if node is None or node_hash(node) != digest:
+                return None
+            paths.append(path)
+        return paths
+
+    def _lookup(self, task, key):
+        # The implicit dependencies (headers) of the cached run must be
+        # unchanged for the outputs to be valid
+        for entry in self._variants(key):
+            paths = self._matching_deps(task, entry)
+            if paths is not None:
+                return entry, paths
+        return None, None
+
+    def restore(self, task, cmd):
+        """Restore the outputs of task from the cache. Return the stdout of
+        the cached command, or None if there is no usable entry."""
+        key = self.key(task, cmd)
+        entry, paths = self._lookup(task, key)
+        if entry is None and self.remote is not None:
+            self._fetch(key)
+            entry, paths = self._lookup(task, key)
+        if entry is None:
+            return None
+
+        try:
+            for i, o in enumerate(task.outputs):
+                copy_file(os.path.join(entry, str(i)), o.abspath(),
+                            self.allow_hardlinks)
+            stdout = _read_file(os.path.join(entry, "stdout")).decode("utf-8")
+            # Used for LRU eviction
+            os.utime(entry, None)
+        except (IOError, OSError):
+            return None
+        # The restored depfile may refer to the tree which stored the entry
+        task.restored_deps = paths
+        return stdout
+
+    def store(self, task, cmd, stdout, implicit_deps=None):
+        """Store the outputs and stdout of task, which has just run cmd.
+        implicit_deps is the list of nodes the outputs depend on, besides the
+        task explicit dependencies."""
+        for o in task.outputs:
+            if not os.path.exists(o.abspath()):
+                return
+        if implicit_deps is None:
+            implicit_deps = []
+
+        key = self.key(task, cmd)
+        tmp = self._mkdtemp(key)
+        try:
+            for i, o in enumerate(task.outputs):
+                copy_file(o.abspath(), os.path.join(tmp, str(i)),
+                            self.allow_hardlinks)
+            _write_file(os.path.join(tmp, "stdout"), stdout.encode("utf-8"))
+            modes = ["%o" % (os.stat(o.abspath()).st_mode & 0x1ff) \
+                     for o in task.outputs]
+            _write_file(os.path.join(tmp, "modes"),
+                        " ".join(modes).encode("ascii"))
+            roots = _roots(task)
+            deps = [(_relocatable(n.abspath(), roots), node_hash(n)) \
+                    for n in implicit_deps]
+            deps = _encode_deps(deps)
+            _write_file(os.path.join(tmp, "deps"), deps)
+
+            if self.remote is not None:
+                members = [(name, _read_file(os.path.join(tmp, name))) \
+                           for name in sorted(os.listdir(tmp))]
+                self.remote.put(key, pack(members))
+            self._commit(key, md5(deps).hexdigest(), tmp)
+        finally:
+            if os.path.exists(tmp):
+                shutil.rmtree(tmp, True)
+
+    def _mkdtemp(self, key):
+        parent = os.path.dirname(self._entry(key))
+        if not os.path.exists(parent):
+            try:
+                os.makedirs(parent)
+            except OSError:
+                pass
+        return tempfile.mkdtemp(prefix=".tmp-", dir=parent)
+
+    def _commit(self, key, variant, tmp):
+        # mkdtemp creates the directory with mode 0700: make the entry
+        # readable by the other users of a shared cache
+        os.chmod(tmp, int("755", 8))
+        d = self._entry(key)
+        if not os.path.exists(d):
+            try:
+                os.mkdir(d)
+            except OSError:
+                pass
+        entry = self._entry(key, variant)
+        if os.path.exists(entry):
+            # Same implicit dependencies: replaced by the newer outputs
+            shutil.rmtree(entry, True)
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # Stored concurrently by another build
+            pass
+
+    def _fetch(self, key):
+        """Unpack the entry stored under key in the remote cache, if any, in
+        the local cache."""
+        blob = self.remote.get(key)
+        if blob is None:
+            return
+        try:
+            members = unpack(blob)
+        except ValueError:
+            return
+        tmp = self._mkdtemp(key)
+        try:
+            for name, data in members:
+                # Never trust the remote with paths
+                if os.path.basename(name) != name or name.startswith("."):
+                    return
+                _write_file(os.path.join(tmp, name), data)
+            modes = _read_file(os.path.join(tmp, "modes")).split()
+            for i, mode in enumerate(modes):
+                os.chmod(os.path.join(tmp, str(i)), int(mode, 8))
+            variant = md5(_read_file(os.path.join(tmp, "deps"))).hexdigest()
+            self._commit(key, variant, tmp)
+        except (IOError, OSError, ValueError):
+            return
+        finally:
+            if os.path.exists(tmp):
+                shutil.rmtree(tmp, True)
+
+    def flush(self):
+        """Wait for the pending uploads to the remote cache."""
+        if self.remote is not None:
+            self.remote.flush()
+
+    def trim(self):
+        """Remove the least recently used entries until the cache is smaller
+        than max_size."""
+        entries = []
+        total = 0
+        for d in os.listdir(self.path):
+            d = os.path.join(self.path, d)
+            if not os.path.isdir(d):
+                continue
+            for k in os.listdir(d):
+                if k.startswith(".tmp-"):
+                    continue
+                k = os.path.join(d, k)
+                try:
+                    variants = os.listdir(k)
+                except OSError:
+                    continue
+                if "deps" in variants:
+                    # Entry stored without variants, never used anymore
+                    shutil.rmtree(k, True)
+                    continue
+                for e in variants:
+                    e = os.path.join(k, e)
+                    try:
+                        size = sum([os.path.getsize(os.path.join(e, f)) \
+                                    for f in os.listdir(e)])
+                        entries.append((os.path.getmtime(e), size, e))
+                    except OSError:
+                        continue
+                    total += size
+
+        entries.sort()
+        for mtime, size, e in entries:
+            if total <= self.max_size:
+                break
+            shutil.rmtree(e, True)
+            total -= size
+            try:
+                # Last entry of its key
+                os.rmdir(os.path.dirname(e))
+            except OSError:
+                pass
@@ -0,0 +1,294 @@
+"""Compile several sources with a single compiler invocation.
+
+For packages made of many tiny C files, starting the compiler driver once
+per file costs as much as the compilation itself. Compile tasks with a
+batch_func (set by the C tools when the compiler supports it, see
+CC_BATCH_F) can be grouped: tasks whose batch command (the command of
+batch_func without the sources) and working directory are the same are
+compiled by one "gcc -c a.c b.c ..." invocation.
+
+The compiler writes the objects (and dependency files) of a batch in the
+working directory, named after the sources (a.o, a.d), and they are then
+moved to the task outputs. Sources with the same name are thus never
+batched together, nor compiled by two batches at the same time. As the
+working directory and source paths are the ones of the single command, the
+objects are identical to the ones of unbatched tasks.
+
+Each task keeps its own signature and outputs. When a batch fails, it is
+split in two halves which are run again, down to single tasks run as
+usual, so that the error is attributed to the right source.
+"""
+import os
+import sys
+import time
+import threading
+import subprocess
+
+from yaku.task_manager \
+    import \
+        run_task, task_needs_run, task_ran
+from yaku.throttle \
+    import \
+        wait_process
+from yaku.jobserver \
+    import \
+        get_current as get_jobserver
+from yaku.pprint \
+    import \
+        pprint
+from yaku.utils \
+    import \
+        get_exception, rename
+from yaku.errors \
+    import \
+        TaskRunFailure, WindowsError
+
+# (cwd, source stem) of the objects being written by running batches
+_RESERVED = set()
+_RESERVED_LOCK = threading.Lock()
+
+class _Batch(object):
+    """What a batch function sees: the sources of the batched tasks."""
+    def __init__(self, tasks):
+        task = tasks[0]
+        self.env = task.env
+        self.gen = task.gen
+        self.inputs = [t.inputs[0] for t in tasks]
+        cwd = getattr(task, "cwd", None)
+        if cwd is not None:
+            self.cwd = cwd
+
+def _stem(task):
+    return os.path.splitext(task.inputs[0].name)[0]
+
+def batch_key(task):
+    """Return the key of the batches task can be part of, or None if it
+    cannot be batched."""
+    func = getattr(task, "batch_func", None)
+    if func is None or len(task.inputs) != 1:
+        return None
+    # The command without any source
+    batch = _Batch([task])
+    batch.inputs = []
+    cmd, cwd, env = func.expand(batch)
+    if env:
+        env = tuple(sorted(env.items()))
+    return (func, tuple(cmd), cwd, env)
+
+def make_batches(tasks, max_size):
+    """Split tasks into batches of at most max_size tasks. Return a list of
+    items, each one being a task which is not batched, or a list of at least
+    2 tasks to run with run_batch. Items are in the order of their first
+    task in tasks."""
+    items = []
+    batches = {}
+    if max_size < 2:
+        return list(tasks)
+    for task in tasks:
+        key = batch_key(task)
+        if key is None:
+            items.append(task)
+            continue
+        batch = batches.get(key, None)
+        if batch is None or len(batch) >= max_size \
+                or _stem(task) in [_stem(t) for t in batch]:
+            batch = batches[key] = []
+            items.append(batch)
+        batch.append(task)
+
+    ret = []
+    for item in items:
+        if isinstance(item, list) and len(item) == 1:
+            ret.append(item[0])
+        else:
+            ret.append(item)
+    return ret
+
+def run_batch(ctx, tasks, jobserver=None, results=None):
+    """Run the given tasks, made by make_batches. Return the list of
+    (task, failure), failure being the TaskRunFailure of the task, or None
+    if it succeeded.
+
+    The (task, failure) are appended to results as soon as known, if given,
+    so that the caller knows which tasks were done if an unexpected
+    exception is raised."""
+    if results is None:
+        results = []
+    todo = []
+    for task in tasks:
+        if not task_needs_run(ctx, task):
+            results.append((task, None))
+        elif _restore(ctx, task):
+            results.append((task, None))
+        else:
+            todo.append(task)
+
+    if jobserver is not None:
+        token = jobserver.acquire()
+    try:
+        todo = _reserve(ctx, todo, results)
+        try:
+            _compile(ctx, todo, results)
+        finally:
+            _release(todo)
+    finally:
+        if jobserver is not None:
+            jobserver.release(token)
+    return results
+
+def _restore(ctx, task):
+    """Restore the outputs of task from the artifact cache, if there."""
+    artifact_cache = getattr(task.gen.bld, "artifact_cache", None)
+    expand = getattr(task.func, "expand", None)
+    if artifact_cache is None or expand is None:
+        return False
+    task.executed_commands = []
+    task.restored_deps = None
+    cmd = task.expand_command()[0]
+    stdout = artifact_cache.restore(task, cmd)
+    if stdout is None:
+        return False
+    task._write_stdout(stdout)
+    task.duration = None
+    task_ran(ctx, task)
+    return True
+
+def _reserve(ctx, tasks, results):
+    """Reserve the object names of tasks, and return the tasks to batch.
+    Tasks whose object is being written by another batch are run alone."""
+    ret = []
+    busy = []
+    _RESERVED_LOCK.acquire()
+    try:
+        for task in tasks:
+            key = (getattr(task, "cwd", None), _stem(task))
+            if key in _RESERVED:
+                busy.append(task)
+            else:
+                _RESERVED.add(key)
+                ret.append(task)
+    finally:
+        _RESERVED_LOCK.release()
+    for task in busy:
+        _run_single(ctx, task, results)
+    return ret
+
+def _release(tasks):
+    _RESERVED_LOCK.acquire()
+    try:
+        for task in tasks:
+            _RESERVED.discard((getattr(task, "cwd", None), _stem(task)))
+    finally:
+        _RESERVED_LOCK.release()
+
+def _run_single(ctx, task, results):
+    # The jobserver token is already held for the batch
+    try:
+        run_task(ctx, task)
+        results.append((task, None))
+    except TaskRunFailure:
+        results.append((task, get_exception()))
+
+def _compile(ctx, tasks, results):
+    if not tasks:
+        return
+    if len(tasks) == 1:
+        _run_single(ctx, tasks[0], results)
+        return
+
+    start = time.time()
+    try:
+        stdout = _exec_batch(tasks)
+    except TaskRunFailure:
+        for t in tasks:
+            if t.cancelled:
+                raise
+        # Bisect, to find out which sources fail
+        half = len(tasks) // 2
+        _compile(ctx, tasks[:half], results)
+        _compile(ctx, tasks[half:], results)
+        return
+    duration = (time.time() - start) / len(tasks)
+
+    for task in tasks:
+        task.restored_deps = None
+        # The outputs can be stored in the artifact cache under the single
+        # command of the task, unless the batch printed something: it could
+        # not be attributed to one task
+        expand = getattr(task.func, "expand", None)
+        if stdout or expand is None:
+            task.executed_commands = []
+        else:
+            task.executed_commands = [(task.expand_command()[0], "")]
+        task.duration = duration
+        task_ran(ctx, task)
+        results.append((task, None))
+
+def _exec_batch(tasks):
+    """Run the batch command of tasks, and move the objects to the task
+    outputs. Return the output of the command."""
+    batch = _Batch(tasks)
+    cmd, cwd, env = tasks[0].batch_func.expand(batch)
+    if cwd is None:
+        cwd = batch.gen.bld.bld_root.abspath()
+    for t in tasks:
+        if t.cancelled:
+            raise TaskRunFailure(cmd, "Cancelled")
+
+    task = tasks[0]
+    if not task.disable_output:
+        if task.env["VERBOSE"]:
+            pprint('GREEN', " ".join([str(c) for c in cmd]))
+        else:
+            pprint('GREEN', "%-16s%s" % (task.name.upper(),
+                   " ".join([i.bldpath() for i in batch.inputs])))
+
+    kw = {}
+    if env is not None:
+        kw["env"] = env
+    jobserver = get_jobserver()
+    if jobserver is not None:
+        kw.update(jobserver.child_kw(env))
+    try:
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT, cwd=cwd, **kw)
+        # Terminating any task of the batch kills the compiler
+        for t in tasks:
+            t.process = p
+        try:
+            for t in tasks:
+                if t.cancelled:
+                    p.terminate()
+            output, returncode, peak_rss = wait_process(p)
+        finally:
+            for t in tasks:
+                t.process = None
+    except OSError:
+        e = get_exception()
+        raise TaskRunFailure(cmd, str(e))
+    except WindowsError:
+        e = get_exception()
+        raise TaskRunFailure(cmd, str(e))
+
+    stdout = output.decode("utf-8")
+    if returncode:
+        for t in tasks:
+            _remove_objects(t, cwd)
+        raise TaskRunFailure(cmd, stdout)
+    if sys.version_info < (3,):
+        stdout = stdout.encode("utf-8")
+    task._write_stdout(stdout)
+
+    for t in tasks:
+        t.peak_rss = peak_rss
+        stem = os.path.join(cwd, _stem(t))
+        rename(stem + ".o", t.outputs[0].abspath())
+        if t.depfile is not None:
+            rename(stem + ".d", t.depfile.abspath())
+    return stdout
+
+def _remove_objects(task, cwd):
+    stem = os.path.join(cwd, _stem(task))
+    for ext in (".o", ".d"):
+        if os.path.exists(stem + ext):
+            os.remove(stem + ext)
@@ -1,6 +1,7 @@
 import os
 import re
 import sys
+import shlex
 
 from yaku.environment \
     import \
@@ -16,7 +17,18 @@ def f(task):
     return task.exec_command(cmd, cwd=wd, env=env['ENV'])
 '''
 
+# The command is expanded once per task by task.expand_command (see
+# COMPILE_TEMPLATE_NOSHELL_EXPAND), and the same expansion is used for the
+# task signature, the artifact cache and the execution
 COMPILE_TEMPLATE_NOSHELL = '''
+def f(task):
+	lst, wd, env = task.expand_command()
+	return task.exec_command(lst, cwd=wd, env=env)
+'''
+
+# Returns the command of the task instead of running it, for
+# task.expand_command and runners which execute it themselves
+COMPILE_TEMPLATE_NOSHELL_EXPAND = '''
 def f(task):
 	env = task.env
 	bld_root = task.gen.bld.bld_root
@@ -27,7 +39,7 @@ def f(task):
 	lst = []
 	%s
 	lst = [x for x in lst if x]
-	return task.exec_command(lst, cwd=wd, env=env['ENV'])
+	return lst, wd, env['ENV']
 '''
 
 
@@ -120,11 +132,19 @@ def compile_fun_noshell(name, line):
     if params[-1]:
         app("lst.extend(%r)" % shlex.split(params[-1]))
 
-    fun = COMPILE_TEMPLATE_NOSHELL % "\n\t".join(buf)
-    return (funex(fun), dvars)
+    fun = funex(COMPILE_TEMPLATE_NOSHELL)
+    # fun.expand(task) returns (cmd, cwd, env) instead of running cmd
+    fun.expand = funex(COMPILE_TEMPLATE_NOSHELL_EXPAND % "\n\t".join(buf))
+    return (fun, dvars)
+
+# (line, shell) -> (function, variables)
+_COMPILED = {}
 
 def compile_fun(name, line, shell=None):
-    "commands can be launched by the shell or not"
+    """commands can be launched by the shell or not
+
+    The function is compiled once per command line: tools may call this for
+    every task."""
     if line.find('<') > 0 or line.find('>') > 0 or line.find('&&') > 0:
         shell = True
 
@@ -134,7 +154,14 @@ def compile_fun(name, line, shell=None):
         else:
             shell = True
 
+    key = (line, shell)
+    try:
+        return _COMPILED[key]
+    except KeyError:
+        pass
     if shell:
-        return compile_fun_shell(name, line)
+        ret = compile_fun_shell(name, line)
     else:
-        return compile_fun_noshell(name, line)
+        ret = compile_fun_noshell(name, line)
+    _COMPILED[key] = ret
+    return ret
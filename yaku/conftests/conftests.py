@@ -233,7 +233,7 @@ int main (void)
         msg = "Checking for function %s" % func
     conf.start_message(msg)
 
-    old_lib = copy.deepcopy(conf.env["LIBS"])
+    old_lib = copy.copy(conf.env["LIBS"])
     try:
         for lib in libs[::-1]:
             conf.env["LIBS"].insert(0, lib)
@@ -271,7 +271,7 @@ int main (void)
     conf.start_message("Checking for function %s in %s" % \
                        (func, " ".join([conf.env["LIB_FMT"] % lib for lib in libs])))
 
-    old_lib = copy.deepcopy(conf.env["LIBS"])
+    old_lib = copy.copy(conf.env["LIBS"])
     try:
         for i in range(len(libs)):
             conf.env["LIBS"].insert(i, libs[i])
@@ -326,7 +326,7 @@ int main (void)
 """ % {"tmp": tmp, "include": "", "header": header}
 
     conf.start_message("Checking for functions %s" % ", ".join(funcs))
-    old_lib = copy.deepcopy(conf.env["LIBS"])
+    old_lib = copy.copy(conf.env["LIBS"])
     try:
         for lib in libs[::-1]:
             conf.env["LIBS"].insert(0, lib)
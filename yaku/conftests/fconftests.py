@@ -42,7 +42,7 @@ def check_fortran_verbose_flag(conf):
         conf.env[FC_VERBOSE_FLAG] = []
         return True
     for flag in ["-v", "--verbose", "-V", "-verbose"]:
-        old = copy.deepcopy(conf.env["F77_LINKFLAGS"])
+        old = copy.copy(conf.env["F77_LINKFLAGS"])
         try:
             conf.env["F77_LINKFLAGS"].append(flag)
             ret = conf.builders["fortran"].try_program("check_fc_verbose", code)
@@ -87,7 +87,7 @@ flags (or to define the %s variable)""" % FC_VERBOSE_FLAG)
 
     conf.start_message("Checking for fortran runtime flags")
 
-    old = copy.deepcopy(conf.env["F77_LINKFLAGS"])
+    old = copy.copy(conf.env["F77_LINKFLAGS"])
     try:
         conf.env["F77_LINKFLAGS"].append(conf.env["FC_VERBOSE_FLAG"])
         ret = conf.builders["fortran"].try_program("check_fc", code)
@@ -122,7 +122,7 @@ int main()
 
     conf.start_message("Checking whether fortran needs dummy main")
 
-    old = copy.deepcopy(conf.env["F77_LINKFLAGS"])
+    old = copy.copy(conf.env["F77_LINKFLAGS"])
     try:
         conf.env["F77_LINKFLAGS"].extend(conf.env[FC_RUNTIME_LDFLAGS])
         ret = conf.builders["ctasks"].try_program("check_fc_dummy_main",
@@ -162,7 +162,7 @@ def check_fortran_mangling(conf):
     conf.start_message("Checking fortran mangling scheme")
     old = {}
     for k in ["F77_LINKFLAGS", "LIBS", "LIBDIR"]:
-        old[k] = copy.deepcopy(conf.env[k])
+        old[k] = copy.copy(conf.env[k])
     try:
         mangling_lib = "check_fc_mangling_lib"
         ret = conf.builders["fortran"].try_static_library(mangling_lib, subr)
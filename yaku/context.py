@@ -13,6 +13,8 @@ else:
 from yaku._config \
     import \
         DEFAULT_ENV, BUILD_CONFIG, BUILD_CACHE, CONFIG_CACHE, HOOK_DUMP, \
+        HASH_CACHE, ARTIFACT_CACHE_DIR_VAR, ARTIFACT_CACHE_SIZE_VAR, \
+        REMOTE_CACHE_VAR, ARTIFACT_CACHE, ARTIFACT_CACHE_HARDLINKS_VAR, \
         _OUTPUT
 from yaku.environment \
     import \
@@ -22,10 +24,19 @@ from yaku.tools \
         import_tools
 from yaku.utils \
     import \
-        ensure_dir, rename, join_bytes
+        ensure_dir, rename, join_bytes, IncludeScanner
 from yaku.errors \
     import \
         UnknownTask, ConfigurationFailure
+from yaku.hash_cache \
+    import \
+        FileHashCache
+from yaku.artifact_cache \
+    import \
+        ArtifactCache
+from yaku.remote_cache \
+    import \
+        RemoteCache
 import yaku.node
 import yaku.task_manager
 
@@ -44,6 +55,7 @@ def create_top_nodes(start_dir, build_dir):
     yaku.node.Node.ctx = _FakeContext()
     yaku.node.Node.ctx.srcnode = srcnode
     yaku.node.Node.ctx.bldnode = bldnode
+    yaku.node.Node.ctx.hash_cache = FileHashCache()
 
     return srcnode, bldnode
 
@@ -63,6 +75,20 @@ def _hook_path_to_hook_id(src_root, hook_dict):
     return dict([(src_root.find_resource(k), v) for \
                  k, v in hook_dict.items()])
 
+def _paths_to_nodes(top, paths):
+    # Return the nodes for the given absolute paths, or None if one of them
+    # does not exist anymore
+    root = top
+    while root.parent:
+        root = root.parent
+    nodes = []
+    for p in paths:
+        node = root.find_node(p)
+        if node is None:
+            return None
+        nodes.append(node)
+    return nodes
+
 class ConfigureContext(object):
     def __init__(self):
         self.env = Environment()
@@ -74,6 +100,8 @@ class ConfigureContext(object):
         self._configured = {}
         self._stdout_cache = {}
         self._cmd_cache = {}
+        self._implicit_deps = {}
+        self.include_scanner = IncludeScanner()
 
         self.src_root = None
         self.bld_root = None
@@ -159,6 +187,16 @@ class ConfigureContext(object):
         except KeyError:
             raise UnknownTask
 
+    def set_implicit_deps(self, task, paths):
+        self._implicit_deps[task.get_uid()] = paths
+
+    def get_implicit_deps(self, task):
+        nodes = _paths_to_nodes(self.src_root,
+                                self._implicit_deps.get(task.get_uid(), []))
+        if nodes is None:
+            return []
+        return nodes
+
 def load_tools(self, fid):
     tools = eval(fid.read())
     for t in tools:
@@ -180,6 +218,17 @@ class BuildContext(object):
         self.cache = {}
         self.builders = {}
         self.tasks = []
+        self.hash_cache = None
+        self.include_scanner = None
+        # task uid -> absolute paths of the dependencies found by the
+        # compiler (depfiles) during the last run of the task
+        self.implicit_deps = {}
+        # Shared store of task outputs (see yaku.artifact_cache)
+        self.artifact_cache = None
+        # task uid -> duration of its last run, for scheduling
+        self.durations = {}
+        # task uid -> peak RSS of its last run (see yaku.throttle)
+        self.peak_rss = {}
 
     def load(self, src_path=None, build_path="build"):
         if src_path is None:
@@ -217,10 +266,39 @@ class BuildContext(object):
             fid = open(build_cache.abspath(), "rb")
             try:
                 self.cache = load(fid)
+                try:
+                    self.implicit_deps = load(fid)
+                    self.durations = load(fid)
+                    self.peak_rss = load(fid)
+                except EOFError:
+                    pass
             finally:
                 fid.close()
         else:
             self.cache = {}
+            self.implicit_deps = {}
+            self.durations = {}
+            self.peak_rss = {}
+
+        self.hash_cache = srcnode.ctx.hash_cache
+        hash_cache = bldnode.find_node(HASH_CACHE)
+        if hash_cache is not None:
+            self.hash_cache.load(hash_cache.abspath())
+        self.include_scanner = IncludeScanner(self.hash_cache.get)
+
+        cache_dir = os.environ.get(ARTIFACT_CACHE_DIR_VAR, None)
+        remote_url = os.environ.get(REMOTE_CACHE_VAR, None)
+        if remote_url and not cache_dir:
+            cache_dir = os.path.join(bldnode.abspath(), ARTIFACT_CACHE)
+        if cache_dir:
+            self.artifact_cache = ArtifactCache(cache_dir)
+            max_size = os.environ.get(ARTIFACT_CACHE_SIZE_VAR, None)
+            if max_size:
+                self.artifact_cache.max_size = int(max_size)
+            if os.environ.get(ARTIFACT_CACHE_HARDLINKS_VAR, "0") == "1":
+                self.artifact_cache.allow_hardlinks = True
+            if remote_url:
+                self.artifact_cache.remote = RemoteCache(remote_url)
 
         hook_dump = bldnode.find_node(HOOK_DUMP)
         fid = open(hook_dump.abspath(), "rb")
@@ -236,16 +314,39 @@ class BuildContext(object):
         tmp_fid = open(build_cache.abspath() + ".tmp", "wb")
         try:
             dump(self.cache, tmp_fid)
+            dump(self.implicit_deps, tmp_fid)
+            dump(self.durations, tmp_fid)
+            dump(self.peak_rss, tmp_fid)
         finally:
             tmp_fid.close()
         rename(build_cache.abspath() + ".tmp", build_cache.abspath())
 
+        hash_cache = self.bld_root.make_node(HASH_CACHE)
+        self.hash_cache.store(hash_cache.abspath())
+
+        if self.artifact_cache is not None:
+            self.artifact_cache.flush()
+            self.artifact_cache.trim()
+
     def set_stdout_cache(self, task, stdout):
         pass
 
     def set_cmd_cache(self, task, stdout):
         pass
 
+    def set_implicit_deps(self, task, paths):
+        self.implicit_deps[task.get_uid()] = paths
+
+    def get_implicit_deps(self, task):
+        tid = task.get_uid()
+        nodes = _paths_to_nodes(self.src_root, self.implicit_deps.get(tid, []))
+        if nodes is None:
+            # A dependency is gone: the task must be rerun to find out
+            # what it depends on now
+            self.cache.pop(tid, None)
+            return []
+        return nodes
+
 def myopen(filename, mode="r"):
     if "w" in mode:
         ensure_dir(filename)
@@ -1,5 +1,6 @@
 import re
 import os
+import copy
 
 from yaku.utils \
     import \
@@ -7,7 +8,214 @@ from yaku.utils \
 
 re_imp = re.compile('^(#)*?([^#=]*?)\ =\ (.*?)$', re.M)
 
+# Maximum length of the chain of parents of an environment, beyond which
+# derive flattens it
+MAX_DEPTH = 8
+
 class Environment(dict):
+    """Dictionary of build variables, copied on write.
+
+    copy.copy, copy.deepcopy and derive return a new environment in
+    O(number of variables set since the previous copy) instead of copying
+    every variable: the copy looks up the variables it does not set itself
+    in a parent shared with the original, which is never modified anymore
+    (the variables the original set are moved to it). Lists and dicts found
+    in the parent are copied into the environment the first time they are
+    looked up, so that modifying them in place (env["LIBS"].append(...))
+    never affects other environments. References to such values taken
+    before a copy must not be modified after it.
+
+    Digests computed from the variables (see memoized_digest) are kept
+    until a variable is set, deleted, or modified through the methods below,
+    or until one of the variables they depend on is modified in place
+    (env["LIBS"].append(...)).
+    """
+    def __init__(self, *args, **kw):
+        dict.__init__(self, *args, **kw)
+        self._parent = None
+        # Variables of the parents deleted from this environment
+        self._deleted = set()
+        self._depth = 0
+        self._digests = {}
+
+    def _modified(self):
+        if self._digests:
+            self._digests = {}
+
+    def memoized_digest(self, key, names, compute):
+        """Return compute(), a digest of the variables names, computed once
+        for the given key until this environment is modified. The values
+        are compared with a copy taken when computing the digest, so that
+        modifying them in place is seen as well."""
+        values = [self._lookup(k) for k in names]
+        try:
+            snapshot, digest = self._digests[key]
+            if snapshot == values:
+                return digest
+        except KeyError:
+            pass
+        digest = compute()
+        self._digests[key] = (copy.deepcopy(values), digest)
+        return digest
+
+    def _lookup(self, key):
+        """Return the value of key without copying it from a parent."""
+        env = self
+        while env is not None:
+            try:
+                return dict.__getitem__(env, key)
+            except KeyError:
+                if key in env._deleted:
+                    break
+                env = env._parent
+        raise KeyError(key)
+
+    def _flat(self):
+        """Return a dict of every variable, without copying from parents."""
+        if self._parent is None:
+            ret = {}
+        else:
+            ret = self._parent._flat()
+        for k in self._deleted:
+            ret.pop(k, None)
+        ret.update(dict.items(self))
+        return ret
+
+    def derive(self):
+        """Return a copy-on-write copy of this environment."""
+        if dict.__len__(self) > 0 or self._deleted:
+            # Move the variables set here into a new parent shared with the
+            # copy
+            base = Environment()
+            if self._depth >= MAX_DEPTH:
+                dict.update(base, self._flat())
+            else:
+                dict.update(base, dict.items(self))
+                base._parent = self._parent
+                base._deleted = self._deleted
+                base._depth = self._depth
+            dict.clear(self)
+            self._parent = base
+            self._deleted = set()
+            self._depth = base._depth + 1
+        child = Environment()
+        child._parent = self._parent
+        child._depth = self._depth
+        return child
+
+    def __copy__(self):
+        return self.derive()
+
+    def __deepcopy__(self, memo):
+        return self.derive()
+
+    def copy(self):
+        return self.derive()
+
+    def __reduce__(self):
+        return (Environment, (self._flat(),))
+
+    def __getitem__(self, key):
+        try:
+            return dict.__getitem__(self, key)
+        except KeyError:
+            pass
+        if key in self._deleted or self._parent is None:
+            raise KeyError(key)
+        value = self._parent._lookup(key)
+        if isinstance(value, (list, dict)):
+            value = copy.copy(value)
+            dict.__setitem__(self, key, value)
+        return value
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self._deleted.discard(key)
+        self._modified()
+
+    def __delitem__(self, key):
+        self._modified()
+        if dict.__contains__(self, key):
+            dict.__delitem__(self, key)
+            if self._parent is not None and key in self._parent:
+                self._deleted.add(key)
+        elif key in self:
+            self._deleted.add(key)
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        try:
+            self._lookup(key)
+            return True
+        except KeyError:
+            return False
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def setdefault(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            self[key] = default
+            return default
+
+    def pop(self, key, *default):
+        try:
+            value = self[key]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        del self[key]
+        return value
+
+    def popitem(self):
+        for key in self.keys():
+            return key, self.pop(key)
+        raise KeyError("popitem(): environment is empty")
+
+    def update(self, *args, **kw):
+        for k, v in dict(*args, **kw).items():
+            self[k] = v
+
+    def clear(self):
+        dict.clear(self)
+        self._modified()
+        self._parent = None
+        self._deleted = set()
+        self._depth = 0
+
+    def keys(self):
+        return list(self._flat().keys())
+
+    def values(self):
+        return [self[k] for k in self.keys()]
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self._flat())
+
+    def __eq__(self, other):
+        if isinstance(other, Environment):
+            other = other._flat()
+        return self._flat() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(self._flat())
+
     def get_flat(self, k):
         s = self[k]
         if isinstance(s, str):
@@ -39,6 +247,7 @@ class Environment(dict):
         else:
             cur = self[var]
         cur.append(value)
+        self._modified()
 
     def append_unique(self, var, value, create=False):
         """Append a single item to the variable var if not already there. Does
@@ -50,6 +259,7 @@ class Environment(dict):
             cur = self[var]
         if not value in cur:
             cur.append(value)
+            self._modified()
 
     def extend(self, var, values, create=False):
         if create:
@@ -58,6 +268,7 @@ class Environment(dict):
         else:
             cur = self[var]
         cur.extend(values)
+        self._modified()
 
     def prepend(self, var, value, create=False):
         """Prepend a single item to the list."""
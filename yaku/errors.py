@@ -30,6 +30,39 @@ class TaskRunFailure(YakuError):
         else:
             return ret
 
+class TaskRunFailures(TaskRunFailure):
+    """Failures of several tasks, raised at the end of a keep going build.
+
+    failures is the list of (cmd, explain) of every failed task, and skipped
+    the number of tasks not run because they depend on a failed one. cmd
+    and explain are the ones of the first failure."""
+    def __init__(self, failures, skipped=0):
+        TaskRunFailure.__init__(self, failures[0][0], failures[0][1])
+        self.failures = failures
+        self.skipped = skipped
+
+    def __str__(self):
+        msg = []
+        for cmd, explain in self.failures:
+            msg.append(TaskRunFailure(cmd, explain).__str__())
+        if sys.version_info < (3,):
+            msg = [m.decode("utf-8") for m in msg]
+        msg.append("%d task(s) failed, %d task(s) not run because of them" \
+                   % (len(self.failures), self.skipped))
+        ret = "\n\n".join(msg)
+        if sys.version_info < (3,):
+            return ret.encode("utf-8")
+        else:
+            return ret
+
+class CyclicDependency(YakuError):
+    def __init__(self, cycle):
+        self.cycle = cycle
+
+    def __str__(self):
+        return "Dependency cycle detected between tasks:\n\t%s" % \
+                "\n\t-> ".join([repr(t) for t in self.cycle + self.cycle[:1]])
+
 class ConfigurationFailure(YakuError):
     pass
 
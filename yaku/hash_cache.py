@@ -0,0 +1,184 @@
+"""Persistent cache of file content hashes.
+
+Hashing every input and dependency of every task is the main cost of a
+no-op build. The cache remembers the md5 of each file together with its
+(inode, size, mtime) at the time it was hashed, so that files which did not
+change are never read again.
+"""
+import os
+import sys
+import time
+import threading
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+if sys.version_info[0] < 3:
+    from cPickle \
+        import \
+            load, dump
+else:
+    from pickle \
+        import \
+            load, dump
+
+from yaku.utils \
+    import \
+        rename, ensure_dir
+
+# Files modified less than this many seconds before being hashed are not
+# stored in the persistent cache: a later modification within the mtime
+# granularity of the filesystem could not be detected
+RACY_DELAY = 2
+
+def _stat_key(st):
+    try:
+        mtime = st.st_mtime_ns
+    except AttributeError:
+        mtime = int(st.st_mtime * 1e9)
+    return (st.st_ino, st.st_size, mtime)
+
+def hash_file(filename, bufsize=2 ** 16):
+    m = md5()
+    fid = open(filename, "rb")
+    try:
+        data = fid.read(bufsize)
+        while data:
+            m.update(data)
+            data = fid.read(bufsize)
+    finally:
+        fid.close()
+    return m.digest()
+
+class FileHashCache(object):
+    """Map file paths to the md5 digest of their content.
+
+    Entries are keyed by (inode, size, mtime_ns): as long as those do not
+    change, the file is not read. Within one build (i.e. for the lifetime of
+    the instance), a file is stat-ed and hashed at most once, even when
+    several threads ask for it concurrently. Files rewritten during the
+    build (task outputs) must be invalidated to be looked at again."""
+    def __init__(self):
+        # path -> (stat key, digest), persistent
+        self.entries = {}
+        # path -> digest, valid for the current build only
+        self._current = {}
+        # path -> event set once the path has been hashed
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def load(self, filename):
+        fid = open(filename, "rb")
+        try:
+            self.entries = load(fid)
+        finally:
+            fid.close()
+
+    def store(self, filename):
+        ensure_dir(filename)
+        tmp = filename + ".tmp"
+        fid = open(tmp, "wb")
+        try:
+            dump(self.entries, fid)
+        finally:
+            fid.close()
+        rename(tmp, filename)
+
+    def get(self, path):
+        """Return the md5 digest of the content of the given file."""
+        try:
+            return self._current[path]
+        except KeyError:
+            pass
+
+        self._lock.acquire()
+        try:
+            if path in self._current:
+                return self._current[path]
+            event = self._pending.get(path, None)
+            owner = event is None
+            if owner:
+                event = self._pending[path] = threading.Event()
+        finally:
+            self._lock.release()
+
+        if not owner:
+            event.wait()
+            return self.get(path)
+
+        try:
+            digest = self._compute(path)
+            self._current[path] = digest
+            return digest
+        finally:
+            self._lock.acquire()
+            try:
+                del self._pending[path]
+            finally:
+                self._lock.release()
+            event.set()
+
+    def _compute(self, path):
+        st = os.stat(path)
+        key = _stat_key(st)
+        entry = self.entries.get(path, None)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+
+        digest = hash_file(path)
+        if st.st_mtime < time.time() - RACY_DELAY:
+            self.entries[path] = (key, digest)
+        else:
+            self.entries.pop(path, None)
+        return digest
+
+    def update(self, path):
+        """Hash the given file, which has just been written by a task, and
+        return its digest.
+
+        Unlike get, the digest is stored in the persistent cache even though
+        the file is recent: the build wrote it, and nothing else is expected
+        to modify it within the mtime granularity. Otherwise, every output
+        would be hashed again on the next build."""
+        st = os.stat(path)
+        digest = hash_file(path)
+        self._lock.acquire()
+        try:
+            self.entries[path] = (_stat_key(st), digest)
+            self._current[path] = digest
+        finally:
+            self._lock.release()
+        return digest
+
+    def invalidate(self, path):
+        """Forget the digest of the given file for the current build, e.g.
+        because it has just been regenerated."""
+        self._current.pop(path, None)
+
+def node_hash(node):
+    """Return the md5 digest of the given node content, using the hash cache
+    of the node context when there is one."""
+    try:
+        cache = node.ctx.hash_cache
+    except AttributeError:
+        return md5(node.read(flags="rb")).digest()
+    return cache.get(node.abspath())
+
+def update_nodes(nodes):
+    """Record the digests of the given nodes, just written by a task."""
+    for node in nodes:
+        try:
+            cache = node.ctx.hash_cache
+        except AttributeError:
+            return
+        if os.path.exists(node.abspath()):
+            cache.update(node.abspath())
+
+def invalidate_nodes(nodes):
+    for node in nodes:
+        try:
+            cache = node.ctx.hash_cache
+        except AttributeError:
+            return
+        cache.invalidate(node.abspath())
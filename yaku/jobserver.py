@@ -0,0 +1,188 @@
+"""GNU make jobserver support.
+
+The jobserver shares a single concurrency limit between make, yaku and the
+commands run by yaku (sub-makes, gcc -flto=jobserver, ...). It is a pipe
+holding one byte (token) per job slot, besides the implicit slot every
+process owns: a process reads a token before starting a job, and writes it
+back when the job is done.
+
+When yaku is run from make (MAKEFLAGS contains --jobserver-auth), it uses
+the tokens of make. Otherwise, it creates its own jobserver with maxjobs
+slots, so that its commands can share them. In both cases, MAKEFLAGS and
+the pipe file descriptors are passed to the commands.
+"""
+import os
+import re
+import sys
+import errno
+import select
+import threading
+
+from yaku.utils \
+    import \
+        get_exception
+
+_AUTH_RE = re.compile(r"--jobserver-(?:auth|fds)=(\S+)")
+
+class JobServer(object):
+    def __init__(self, read_fd, write_fd, makeflags=None, owner=False):
+        self.read_fd = read_fd
+        self.write_fd = write_fd
+        # MAKEFLAGS to give to child processes (None: keep the inherited
+        # one)
+        self.makeflags = makeflags
+        # True if the pipe was created by us
+        self.owner = owner
+
+        self._lock = threading.Lock()
+        self._implicit_free = True
+        # Number of threads waiting for a token in the pipe
+        self._waiting = 0
+        # Number of tokens written in the pipe on behalf of the implicit
+        # slot (see release)
+        self._lent = 0
+
+    def acquire(self):
+        """Wait for a job slot, and return the token to give back to
+        release."""
+        self._lock.acquire()
+        try:
+            if self._implicit_free:
+                self._implicit_free = False
+                return None
+            self._waiting += 1
+        finally:
+            self._lock.release()
+        try:
+            return self.acquire_token()
+        finally:
+            self._lock.acquire()
+            try:
+                self._waiting -= 1
+            finally:
+                self._lock.release()
+
+    def try_acquire(self):
+        """Return (True, token) if a job slot is free, and (False, None)
+        otherwise. Does not wait, unless another process takes the token
+        of the pipe first."""
+        self._lock.acquire()
+        try:
+            if self._implicit_free:
+                self._implicit_free = False
+                return True, None
+        finally:
+            self._lock.release()
+        if not select.select([self.read_fd], [], [], 0)[0]:
+            return False, None
+        return True, self.acquire_token()
+
+    def acquire_token(self):
+        """Read a token from the pipe."""
+        while True:
+            try:
+                return os.read(self.read_fd, 1)
+            except OSError:
+                e = get_exception()
+                if e.errno != errno.EINTR:
+                    raise
+
+    def release(self, token):
+        self._lock.acquire()
+        try:
+            if token is None:
+                if self._waiting > 0:
+                    # Threads blocked on the pipe would never see the
+                    # implicit slot: lend it to them through the pipe
+                    self._lent += 1
+                    token = b"+"
+                else:
+                    self._implicit_free = True
+                    return
+            elif self._lent > 0 and self._waiting == 0:
+                # Nobody is blocked on the pipe anymore: take the implicit
+                # slot back instead of returning the token
+                self._lent -= 1
+                self._implicit_free = True
+                return
+        finally:
+            self._lock.release()
+        os.write(self.write_fd, token)
+
+    def fds(self):
+        if self.read_fd == self.write_fd:
+            return (self.read_fd,)
+        return (self.read_fd, self.write_fd)
+
+    def child_kw(self, env):
+        """Return the extra Popen keyword arguments for a child process
+        whose environment is env (None for the current one)."""
+        kw = {}
+        if self.makeflags is not None:
+            if env is None:
+                env = dict(os.environ)
+            else:
+                env = dict(env)
+            env["MAKEFLAGS"] = self.makeflags
+            kw["env"] = env
+        if sys.version_info >= (3, 2):
+            kw["pass_fds"] = self.fds()
+        return kw
+
+    def close(self):
+        # Take back the implicit slot if it is still lent, so that the
+        # number of tokens in the pipe is what it was
+        while self._lent > 0 and not self.owner:
+            self.acquire_token()
+            self._lent -= 1
+        if self.owner:
+            for fd in self.fds():
+                os.close(fd)
+
+def _valid_fd(fd):
+    try:
+        os.fstat(fd)
+        return True
+    except OSError:
+        return False
+
+def from_environ(environ=None):
+    """Return the jobserver described in MAKEFLAGS, or None."""
+    if environ is None:
+        environ = os.environ
+    m = _AUTH_RE.search(environ.get("MAKEFLAGS", ""))
+    if m is None:
+        return None
+    auth = m.group(1)
+    if auth.startswith("fifo:"):
+        try:
+            fd = os.open(auth[5:], os.O_RDWR)
+        except OSError:
+            return None
+        return JobServer(fd, fd, owner=True)
+    try:
+        read_fd, write_fd = [int(fd) for fd in auth.split(",")]
+    except ValueError:
+        return None
+    # make closes the pipe for commands not marked as recursive (+)
+    if not (_valid_fd(read_fd) and _valid_fd(write_fd)):
+        return None
+    return JobServer(read_fd, write_fd)
+
+def create(maxjobs):
+    """Create a jobserver with maxjobs slots, for our child processes."""
+    read_fd, write_fd = os.pipe()
+    os.write(write_fd, b"+" * (maxjobs - 1))
+    makeflags = "-j%d --jobserver-auth=%d,%d --jobserver-fds=%d,%d" % \
+            (maxjobs, read_fd, write_fd, read_fd, write_fd)
+    return JobServer(read_fd, write_fd, makeflags, owner=True)
+
+# Jobserver of the running build, if any
+_CURRENT = None
+
+def get_current():
+    return _CURRENT
+
+def set_current(jobserver):
+    global _CURRENT
+    _CURRENT = jobserver
@@ -0,0 +1,172 @@
+"""Run pure python task functions in a pool of worker processes.
+
+Task functions written in python (templates, 2to3 copies, user hooks) hold
+the GIL, so running them from several threads does not use more than one
+core. Tasks which set process_safe to True are sent to a process pool
+instead: only the function, the paths of the nodes and the env variables
+listed in env_vars are sent to the worker, which runs the function on a
+light copy of the task. Everything else (compilers, linkers) keeps running
+from the scheduler threads, as waiting for a subprocess does not hold the
+GIL.
+
+The function must be picklable, i.e. defined at the top level of a module,
+and must only use the task inputs, outputs, env and name.
+"""
+import sys
+import traceback
+
+if sys.version_info[0] < 3:
+    from cPickle \
+        import \
+            dumps, PicklingError
+else:
+    from pickle \
+        import \
+            dumps, PicklingError
+
+try:
+    from concurrent.futures \
+        import \
+            ProcessPoolExecutor
+except ImportError:
+    ProcessPoolExecutor = None
+
+from yaku.utils \
+    import \
+        get_exception
+from yaku.errors \
+    import \
+        TaskRunFailure
+import yaku.node
+
+_ROOT = None
+
+# Number of jobs of the running build, and the pools tools created for it
+# (see get_pool)
+_MAXJOBS = 1
+_POOLS = {}
+
+def set_maxjobs(maxjobs):
+    """Set the number of jobs of the build about to run."""
+    global _MAXJOBS
+    _MAXJOBS = maxjobs
+
+def get_pool(name):
+    """Return the ProcessPoolExecutor registered as name for the running
+    build, created on first use with one worker per build job. A task
+    waiting on it holds its job slot, so that the workers do not run more
+    jobs than allowed."""
+    pool = _POOLS.get(name, None)
+    if pool is None:
+        pool = _POOLS[name] = ProcessPoolExecutor(_MAXJOBS)
+    return pool
+
+def shutdown_pools():
+    """Shut down the pools of get_pool, at the end of the build."""
+    global _MAXJOBS
+    for name in list(_POOLS.keys()):
+        _POOLS.pop(name).shutdown()
+    _MAXJOBS = 1
+
+def _init_worker(src_dir, bld_dir):
+    global _ROOT
+    # Imported here to avoid a circular import (context imports the
+    # scheduler through the tools)
+    from yaku.context import create_top_nodes
+    src_root, bld_root = create_top_nodes(src_dir, bld_dir)
+    _ROOT = src_root
+    while _ROOT.parent:
+        _ROOT = _ROOT.parent
+
+class _RemoteTask(object):
+    """What a process safe task function sees of its task."""
+    def __init__(self, name, inputs, outputs, deps, env):
+        self.name = name
+        self.inputs = [_ROOT.make_node(p) for p in inputs]
+        self.outputs = [_ROOT.make_node(p) for p in outputs]
+        self.deps = [_ROOT.make_node(p) for p in deps]
+        self.env = env
+        self.executed_commands = []
+
+def _run_in_worker(roots, func, name, inputs, outputs, deps, env):
+    """Run func in the worker. Return None on success, and (cmd, explain)
+    on failure."""
+    # Initialized by the first task, as the initializer argument of
+    # ProcessPoolExecutor is not available before python 3.7
+    if _ROOT is None:
+        _init_worker(*roots)
+    try:
+        func(_RemoteTask(name, inputs, outputs, deps, env))
+    except TaskRunFailure:
+        e = get_exception()
+        return (e.cmd, e.explain)
+    except Exception:
+        return ([], "".join(traceback.format_exception(*sys.exc_info())))
+    return None
+
+def _run_parts_in_worker(roots, func, name, parts, deps, env):
+    """Run func on each (input, output) of parts, stopping at the first
+    failure (see _run_in_worker)."""
+    for input, output in parts:
+        failure = _run_in_worker(roots, func, name, [input], [output], deps,
+                                 env)
+        if failure is not None:
+            return failure
+    return None
+
+def is_process_safe(task):
+    if not getattr(task, "process_safe", False) or task.func is None:
+        return False
+    try:
+        dumps(task.func)
+    except (PicklingError, TypeError, AttributeError):
+        return False
+    return True
+
+class ProcessPool(object):
+    def __init__(self, maxjobs):
+        root = yaku.node.Node.ctx
+        self.roots = (root.srcnode.abspath(), root.bldnode.abspath())
+        self.maxjobs = maxjobs
+        self.executor = ProcessPoolExecutor(maxjobs)
+
+    def _env(self, task):
+        env = {}
+        for k in task.env_vars:
+            env[k] = task.env[k]
+        return env
+
+    def run(self, task):
+        """Run the given task in a worker process, and wait for it. The
+        parts of a micro task are spread over the workers."""
+        if getattr(task, "stale_parts", None) is not None:
+            task.run(self._run_parts)
+            return
+        task.executed_commands = []
+        future = self.executor.submit(_run_in_worker, self.roots, task.func,
+                task.name,
+                [n.abspath() for n in task.inputs],
+                [n.abspath() for n in task.outputs],
+                [n.abspath() for n in task.deps], self._env(task))
+        failure = future.result()
+        if failure is not None:
+            raise TaskRunFailure(failure[0], failure[1])
+
+    def _run_parts(self, parts):
+        task = parts[0].task
+        env = self._env(task)
+        deps = [n.abspath() for n in task.deps]
+        size = max(1, -(-len(parts) // self.maxjobs))
+        futures = []
+        for i in range(0, len(parts), size):
+            futures.append(self.executor.submit(_run_parts_in_worker,
+                    self.roots, task.func, task.name,
+                    [(p.inputs[0].abspath(), p.outputs[0].abspath()) \
+                     for p in parts[i:i+size]], deps, env))
+        failures = [f.result() for f in futures]
+        for failure in failures:
+            if failure is not None:
+                raise TaskRunFailure(failure[0], failure[1])
+
+    def shutdown(self):
+        self.executor.shutdown()
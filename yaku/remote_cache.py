@@ -0,0 +1,236 @@
+"""Remote artifact cache, shared by several machines over HTTP.
+
+The protocol is deliberately minimal, so that any HTTP server able to store
+blobs can be used::
+
+    GET /<key>      200 and the blob, or 404 if unknown
+    PUT /<key>      store the blob (any 2xx status means success)
+
+where key is the artifact cache key of a task (see yaku.artifact_cache). A
+blob is the concatenation of frames (name length, data length, name, data),
+lengths being big-endian unsigned 32 bits integers. It contains one frame per
+file of the local cache entry.
+
+The remote cache is only a second level below the local cache: downloaded
+entries are unpacked in the local cache, and uploads happen in a background
+thread. Any error or timeout is treated as a miss, and the task is run
+locally.
+
+A reference server is included, for testing::
+
+    python -m yaku.remote_cache [-p PORT] DIRECTORY
+"""
+import os
+import re
+import sys
+import struct
+import socket
+import threading
+import tempfile
+
+if sys.version_info[0] < 3:
+    import httplib
+    import urlparse
+    import Queue as queue
+    import BaseHTTPServer as http_server
+    import SocketServer as socketserver
+else:
+    import http.client as httplib
+    import urllib.parse as urlparse
+    import queue
+    import http.server as http_server
+    import socketserver
+
+from yaku.utils \
+    import \
+        join_bytes
+
+# Timeout (in seconds) of each request to the remote cache
+DEFAULT_TIMEOUT = 5
+
+# After that many consecutive failures (server down, timeout), the remote
+# cache is not used anymore for the rest of the build
+MAX_FAILURES = 3
+
+_FRAME_HEADER = struct.Struct(">II")
+
+_KEY_RE = re.compile(r"^[0-9a-f]{32}$")
+
+def pack(members):
+    """Pack a list of (name, data) pairs in a blob."""
+    frames = []
+    for name, data in members:
+        name = name.encode("utf-8")
+        frames.append(_FRAME_HEADER.pack(len(name), len(data)))
+        frames.append(name)
+        frames.append(data)
+    return join_bytes(frames)
+
+def unpack(blob):
+    """Unpack a blob created by pack. Raise ValueError if the blob is
+    truncated or corrupted."""
+    members = []
+    offset = 0
+    while offset < len(blob):
+        if offset + _FRAME_HEADER.size > len(blob):
+            raise ValueError("Truncated frame header at offset %d" % offset)
+        name_size, data_size = _FRAME_HEADER.unpack_from(blob, offset)
+        offset += _FRAME_HEADER.size
+        if offset + name_size + data_size > len(blob):
+            raise ValueError("Truncated frame at offset %d" % offset)
+        name = blob[offset:offset+name_size].decode("utf-8")
+        offset += name_size
+        members.append((name, blob[offset:offset+data_size]))
+        offset += data_size
+    return members
+
+class RemoteCache(object):
+    def __init__(self, url, timeout=DEFAULT_TIMEOUT):
+        parsed = urlparse.urlparse(url)
+        if parsed.scheme != "http":
+            raise ValueError("Unsupported remote cache url: %r" % url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.prefix = parsed.path.rstrip("/")
+        self.timeout = timeout
+
+        self.failures = 0
+        self._uploads = queue.Queue()
+        self._uploader = None
+        self._lock = threading.Lock()
+
+    def _request(self, method, key, body=None):
+        conn = httplib.HTTPConnection(self.host, self.port,
+                                      timeout=self.timeout)
+        try:
+            conn.request(method, "%s/%s" % (self.prefix, key), body)
+            response = conn.getresponse()
+            return response.status, response.read()
+        finally:
+            conn.close()
+
+    def _failed(self):
+        self.failures += 1
+
+    def enabled(self):
+        return self.failures < MAX_FAILURES
+
+    def get(self, key):
+        """Return the blob stored under key, or None on miss or error."""
+        if not self.enabled():
+            return None
+        try:
+            status, data = self._request("GET", key)
+        except (socket.error, httplib.HTTPException):
+            self._failed()
+            return None
+        self.failures = 0
+        if status != 200:
+            return None
+        return data
+
+    def put(self, key, blob):
+        """Queue the upload of blob under key, and return immediately."""
+        if not self.enabled():
+            return
+        self._lock.acquire()
+        try:
+            if self._uploader is None:
+                self._uploader = threading.Thread(target=self._upload_loop)
+                self._uploader.daemon = True
+                self._uploader.start()
+        finally:
+            self._lock.release()
+        self._uploads.put((key, blob))
+
+    def _upload_loop(self):
+        while True:
+            key, blob = self._uploads.get()
+            try:
+                if self.enabled():
+                    try:
+                        status, data = self._request("PUT", key, blob)
+                        if status // 100 != 2:
+                            self._failed()
+                    except (socket.error, httplib.HTTPException):
+                        self._failed()
+            finally:
+                self._uploads.task_done()
+
+    def flush(self):
+        """Wait for all the queued uploads to be done."""
+        self._uploads.join()
+
+class _CacheRequestHandler(http_server.BaseHTTPRequestHandler):
+    def _path(self):
+        key = self.path.rstrip("/").split("/")[-1]
+        if not _KEY_RE.match(key):
+            return None
+        return os.path.join(self.server.directory, key)
+
+    def do_GET(self):
+        path = self._path()
+        if path is None or not os.path.exists(path):
+            self.send_error(404)
+            return
+        fid = open(path, "rb")
+        try:
+            data = fid.read()
+        finally:
+            fid.close()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_PUT(self):
+        path = self._path()
+        if path is None:
+            self.send_error(400)
+            return
+        size = int(self.headers.get("Content-Length", 0))
+        data = self.rfile.read(size)
+        fd, tmp = tempfile.mkstemp(dir=self.server.directory)
+        fid = os.fdopen(fd, "wb")
+        try:
+            fid.write(data)
+        finally:
+            fid.close()
+        os.rename(tmp, path)
+        self.send_response(201)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+class CacheServer(socketserver.ThreadingMixIn, http_server.HTTPServer):
+    """Reference implementation of the remote cache protocol, storing blobs
+    as files in directory."""
+    daemon_threads = True
+
+    def __init__(self, directory, address=("localhost", 0)):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        http_server.HTTPServer.__init__(self, address, _CacheRequestHandler)
+
+    def url(self):
+        return "http://%s:%d" % self.server_address[:2]
+
+if __name__ == "__main__":
+    from optparse import OptionParser
+
+    parser = OptionParser(usage="%prog [options] DIRECTORY")
+    parser.add_option("-p", "--port", type="int", default=8080)
+    parser.add_option("--host", default="localhost")
+    opts, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("DIRECTORY is required")
+
+    server = CacheServer(args[0], (opts.host, opts.port))
+    print("Serving yaku remote cache on %s" % server.url())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -12,100 +12,335 @@ from yaku.task_manager \
 from yaku.utils \
     import \
         get_exception
+from yaku.process_pool \
+    import \
+        ProcessPool, ProcessPoolExecutor, is_process_safe, set_maxjobs, \
+        shutdown_pools
+from yaku.batch \
+    import \
+        make_batches, run_batch
 import yaku.errors
+import yaku.jobserver
 
-def run_tasks(ctx, tasks=None):
+if sys.version_info >= (3, 5):
+    from yaku._scheduler_py3 \
+        import \
+            run_tasks_async
+
+def run_tasks(ctx, tasks=None, keep_going=False, max_batch=1):
+    """Run tasks one after the other. With keep_going, a failure does not
+    stop the build: every task not depending on a failed one is run, and
+    TaskRunFailures is raised at the end (see SerialRunner). If max_batch
+    is greater than 1, up to max_batch compile tasks are run by a single
+    compiler invocation (see yaku.batch)."""
     if tasks is None:
         tasks = ctx.tasks
     task_manager = TaskManager(tasks)
-    s = SerialRunner(ctx, task_manager)
+    s = SerialRunner(ctx, task_manager, keep_going, max_batch)
     s.start()
     s.run()
 
-def run_tasks_parallel(ctx, tasks=None, maxjobs=1):
+# Seconds between two checks of the load and memory when ready tasks are
+# held back by the throttle
+THROTTLE_POLL_INTERVAL = 0.5
+
+def run_tasks_parallel(ctx, tasks=None, maxjobs=1, throttle=None,
+                       keep_going=False, max_batch=1):
+    """Run tasks on maxjobs threads. If throttle is given (see
+    yaku.throttle.Throttle), maxjobs is only an upper bound, tasks being
+    started according to the load and available memory. See run_tasks for
+    keep_going and max_batch."""
     if tasks is None:
         tasks = ctx.tasks
-    task_manager = TaskManager(tasks)
-    r = ParallelRunner(ctx, task_manager, maxjobs)
+    task_manager = TaskManager(tasks, getattr(ctx, "durations", None))
+    r = ParallelRunner(ctx, task_manager, maxjobs, throttle, keep_going,
+                       max_batch)
     r.start()
     r.run()
 
+def _set_error(task):
+    """Store the exception being handled in task.error_cmd and
+    task.error_msg."""
+    e = get_exception()
+    if isinstance(e, yaku.errors.TaskRunFailure):
+        task.error_msg = e.explain
+        task.error_cmd = e.cmd
+    else:
+        exc_type, exc_value, tb = sys.exc_info()
+        lines = traceback.format_exception(exc_type, exc_value, tb)
+        task.error_msg = "".join(lines)
+        task.error_cmd = []
+
+def _raise_failures(failed_tasks, skipped):
+    failures = [(t.error_cmd, t.error_msg) for t in failed_tasks]
+    raise yaku.errors.TaskRunFailures(failures, len(skipped))
+
 class SerialRunner(object):
-    def __init__(self, ctx, task_manager):
+    """Run tasks one after the other.
+
+    The first failure stops the build, unless keep_going is True: the tasks
+    depending on a failed task are then skipped, every other task is run,
+    and TaskRunFailures, listing every failure, is raised at the end. The
+    signatures of the tasks which succeeded are recorded in either case,
+    so that storing the context afterwards makes the next build only redo
+    the failed and skipped tasks.
+
+    Compile tasks ready at the same time are batched by groups of up to
+    max_batch tasks (see yaku.batch)."""
+    def __init__(self, ctx, task_manager, keep_going=False, max_batch=1):
         self.ctx = ctx
         self.task_manager = task_manager
+        self.keep_going = keep_going
+        self.max_batch = max_batch
 
     def start(self):
-        # Dummy to give same interface as ParallelRunner
-        pass
+        set_maxjobs(1)
+
+    def _run(self, item):
+        """Run a task or a batch of tasks, and return the list of (task,
+        failed)."""
+        if isinstance(item, list):
+            ret = []
+            for task, failure in run_batch(self.ctx, item):
+                if failure is not None:
+                    if not self.keep_going:
+                        raise failure
+                    task.error_msg = failure.explain
+                    task.error_cmd = failure.cmd
+                ret.append((task, failure is not None))
+            return ret
+        try:
+            run_task(self.ctx, item)
+        except Exception:
+            if not self.keep_going:
+                raise
+            _set_error(item)
+            return [(item, True)]
+        return [(item, False)]
 
     def run(self):
-        grp = self.task_manager.next_set()
-        while grp:
-            for task in grp:
-                run_task(self.ctx, task)
-            grp = self.task_manager.next_set()
+        failed_tasks = []
+        skipped = set()
+        # Tasks are run by sets of tasks ready at the same time
+        ready = self.task_manager.ready_tasks()
+        try:
+            while ready:
+                items = make_batches(ready, self.max_batch)
+                ready = []
+                for item in items:
+                    for task, failed in self._run(item):
+                        if failed:
+                            failed_tasks.append(task)
+                            skipped.update(
+                                    self.task_manager.task_failed(task))
+                        else:
+                            ready.extend(self.task_manager.task_done(task))
+        finally:
+            shutdown_pools()
+        if failed_tasks:
+            _raise_failures(failed_tasks, skipped)
 
 class ParallelRunner(object):
-    def __init__(self, ctx, task_manager, maxjobs=1):
+    """Run tasks in parallel on maxjobs worker threads.
+
+    A task is sent to the workers as soon as all its predecessors are done,
+    instead of waiting for whole groups of tasks to finish. Process safe
+    tasks are run in a pool of processes, the worker thread only waiting
+    for them.
+
+    Ready tasks are started by decreasing priority (see TaskManager), so
+    that tasks on the critical path start first.
+
+    A worker holds a jobserver token while running a task: the one of make
+    when run from make, or one of our own jobserver otherwise, shared with
+    the commands run by the tasks (see yaku.jobserver).
+
+    With a throttle, ready tasks are only sent to the workers when the
+    throttle admits them (see yaku.throttle), up to maxjobs at a time.
+
+    The runner only sleeps on queues: it uses no CPU while waiting, except
+    for polling the load and memory while the throttle holds tasks back.
+    When a task fails, the commands of the running tasks are terminated and
+    the queued tasks are not started, unless keep_going is True (see
+    SerialRunner)."""
+    def __init__(self, ctx, task_manager, maxjobs=1, throttle=None,
+                 keep_going=False, max_batch=1):
         self.njobs = maxjobs
         self.task_manager = task_manager
         self.ctx = ctx
+        self.throttle = throttle
+        self.keep_going = keep_going
+        self.max_batch = max_batch
 
-        self.worker_queue = queue.Queue()
-        self.error_out = queue.Queue()
-        self.failure_lock = threading.Lock()
+        self.worker_queue = queue.PriorityQueue()
+        # Insertion counter, to keep the queue FIFO between equal priorities
+        self._count = 0
+        self.done_queue = queue.Queue()
         self.stop = False
+        self.process_pool = None
+        self.jobserver = None
+
+    def _queue(self, item):
+        # item is a task, a batch of tasks, or None
+        self._count += 1
+        if item is None:
+            # Sentinels after any remaining task
+            priority = float("inf")
+        elif isinstance(item, list):
+            priority = -max([self.task_manager.priority(t) for t in item])
+        else:
+            priority = -self.task_manager.priority(item)
+        self.worker_queue.put((priority, self._count, item))
+
+    def _dispatch(self, tasks, ready, running):
+        """Send the newly ready tasks to the workers, holding back in ready
+        the ones the throttle does not admit yet."""
+        if self.throttle is None:
+            admitted = tasks
+        else:
+            ready.extend(tasks)
+            ready.sort(key=self.task_manager.priority, reverse=True)
+            admitted = []
+            held = []
+            for task in ready:
+                if len(running) + len(admitted) < self.njobs \
+                        and self.throttle.admit(task,
+                                running.union(admitted)):
+                    admitted.append(task)
+                else:
+                    held.append(task)
+            ready[:] = held
+
+        # Batches are kept small enough for every worker to get some work
+        size = min(self.max_batch, -(-len(admitted) // self.njobs))
+        for item in make_batches(admitted, size):
+            self._queue(item)
+            if isinstance(item, list):
+                running.update(item)
+            else:
+                running.add(item)
+
+    def _run_batch(self, tasks):
+        results = []
+        try:
+            run_batch(self.ctx, tasks, self.jobserver, results)
+        except Exception:
+            # Only the tasks not done yet failed
+            done = set([t for t, failure in results])
+            for task in tasks:
+                if not task in done:
+                    _set_error(task)
+                    self.done_queue.put((task, True))
+        for task, failure in results:
+            if failure is not None:
+                task.error_msg = failure.explain
+                task.error_cmd = failure.cmd
+            self.done_queue.put((task, failure is not None))
+
+    def _run(self, task):
+        if self.process_pool is not None and is_process_safe(task):
+            self.process_pool.run(task)
+        else:
+            task.run()
 
     def start(self):
+        self.jobserver = yaku.jobserver.from_environ()
+        if self.jobserver is None and self.njobs > 1 \
+                and sys.platform != "win32":
+            self.jobserver = yaku.jobserver.create(self.njobs)
+        yaku.jobserver.set_current(self.jobserver)
+        set_maxjobs(self.njobs)
+
+        if self.throttle is not None:
+            self.throttle.setup(self.ctx, self.task_manager.tasks)
+
+        if ProcessPoolExecutor is not None and self.njobs > 1:
+            for task in self.task_manager.tasks:
+                if is_process_safe(task):
+                    self.process_pool = ProcessPool(self.njobs)
+                    break
+
         def _worker():
-            # XXX: this whole thing is an hack - find a better way to
-            # notify task execution failure to all worker threads
-            while not self.stop:
-                task = self.worker_queue.get()
+            while True:
+                task = self.worker_queue.get()[2]
+                if task is None:
+                    break
+                if self.stop:
+                    # Cancelled before being started
+                    if isinstance(task, list):
+                        for t in task:
+                            self.done_queue.put((t, False))
+                    else:
+                        self.done_queue.put((task, False))
+                    continue
+                if isinstance(task, list):
+                    self._run_batch(task)
+                    continue
+                failed = True
                 try:
-                    run_task(self.ctx, task)
-                except yaku.errors.TaskRunFailure:
-                    e = get_exception()
-                    self.failure_lock.acquire()
-                    self.stop = True
-                    self.failure_lock.release()
-                    task.error_msg = e.explain
-                    task.error_cmd = e.cmd
-                    self.error_out.put(task)
+                    run_task(self.ctx, task, self._run, self.jobserver)
+                    failed = False
                 except Exception:
-                    e = get_exception()
-                    exc_type, exc_value, tb = sys.exc_info()
-                    lines = traceback.format_exception(exc_type, exc_value, tb)
-                    self.failure_lock.acquire()
-                    self.stop = True
-                    self.failure_lock.release()
-                    task.error_msg = "".join(lines)
-                    task.error_cmd = []
-                    self.error_out.put(task)
-                self.worker_queue.task_done()
+                    _set_error(task)
+                self.done_queue.put((task, failed))
 
         for i in range(self.njobs):
             t = threading.Thread(target=_worker)
-            t.setDaemon(True)
+            t.daemon = True
             t.start()
 
     def run(self):
-        grp = self.task_manager.next_set()
-        while grp:
-            for task in grp:
-                self.worker_queue.put(task)
-            # XXX: we only join once we detect the worker queue to be empty, to
-            # avoid blocking for a long time. This is naive, and will break if
-            # the worker_queue is filled after this point
-            while not self.stop:
-                if self.worker_queue.empty():
-                    self.worker_queue.join()
-                    break
-            if not self.error_out.empty():
-                task = self.error_out.get()
-                msg = task.error_msg
-                cmd = task.error_cmd
-                raise yaku.errors.TaskRunFailure(cmd, msg)
+        failed_tasks = []
+        # Tasks depending on a failed task (keep_going only)
+        skipped = set()
+        # Tasks sent to the workers, and not reported done yet
+        running = set()
+        # Ready tasks held back by the throttle
+        ready = []
+        try:
+            self._dispatch(self.task_manager.ready_tasks(), ready, running)
+
+            while running:
+                if ready:
+                    # Load and memory change without any task finishing
+                    try:
+                        task, failed = self.done_queue.get(True,
+                                THROTTLE_POLL_INTERVAL)
+                    except queue.Empty:
+                        if not self.stop:
+                            self._dispatch([], ready, running)
+                        continue
+                else:
+                    task, failed = self.done_queue.get()
+                running.remove(task)
+                if self.throttle is not None:
+                    self.throttle.task_done(task)
+                if failed:
+                    failed_tasks.append(task)
+                    if self.keep_going:
+                        skipped.update(self.task_manager.task_failed(task))
+                        # Start the tasks the throttle held for this one
+                        self._dispatch([], ready, running)
+                    elif not self.stop:
+                        self.stop = True
+                        for t in running:
+                            t.terminate()
+                elif not self.stop:
+                    self._dispatch(self.task_manager.task_done(task), ready,
+                                   running)
+        finally:
+            for i in range(self.njobs):
+                self._queue(None)
+            if self.process_pool is not None:
+                self.process_pool.shutdown()
+            shutdown_pools()
+            if self.jobserver is not None:
+                yaku.jobserver.set_current(None)
+                self.jobserver.close()
 
-            grp = self.task_manager.next_set()
+        if self.keep_going and failed_tasks:
+            _raise_failures(failed_tasks, skipped)
+        elif failed_tasks:
+            failed_task = failed_tasks[0]
+            raise yaku.errors.TaskRunFailure(failed_task.error_cmd,
+                                             failed_task.error_msg)
@@ -20,10 +20,19 @@ from yaku.pprint \
         pprint
 from yaku.utils \
     import \
-        get_exception, is_string, function_code
+        get_exception, is_string, function_code, parse_depfile
 from yaku.errors \
     import \
         TaskRunFailure, WindowsError
+from yaku.hash_cache \
+    import \
+        node_hash
+from yaku.jobserver \
+    import \
+        get_current as get_jobserver
+from yaku.throttle \
+    import \
+        wait_process
 
 # TODO:
 #   - factory for tasks, so that tasks can be created from strings
@@ -41,16 +50,49 @@ def task_factory(name):
     try:
         klass = _CLASSES[name]
     except KeyError:
-        klass = _TaskFakeMetaclass('%sTask' % name, (_Task,), {})
+        # Each class needs its own before/after lists, otherwise appending
+        # to them would modify the constraints of every task class
+        klass = _TaskFakeMetaclass('%sTask' % name, (_Task,),
+                                   {"before": [], "after": []})
         klass.name = name
         _CLASSES[name] = klass
     return klass
 
+_MICRO_CLASSES = {}
+def micro_task_factory(name):
+    """Same as task_factory, for micro tasks (see _MicroTask)."""
+    try:
+        klass = _MICRO_CLASSES[name]
+    except KeyError:
+        klass = _TaskFakeMetaclass('%sTask' % name, (_MicroTask,),
+                                   {"before": [], "after": []})
+        klass.name = name
+        _MICRO_CLASSES[name] = klass
+    return klass
+
+def coalesce_tasks(name, tasks):
+    """Return a micro task doing the work of the given tasks, which must
+    have one input and one output each, and share their function, env and
+    env_vars."""
+    task = tasks[0]
+    micro = micro_task_factory(name)([(t.inputs[0], t.outputs[0]) \
+            for t in tasks], func=task.func, env=task.env,
+            env_vars=task.env_vars)
+    if hasattr(task, "gen"):
+        micro.gen = task.gen
+    micro.disable_output = task.disable_output
+    micro.process_safe = task.process_safe
+    micro.log = task.log
+    return micro
+
 base = _TaskFakeMetaclass('__task_base', (object,), {})
 
 class _Task(object):
     before = []
     after = []
+    # True if func only uses the task inputs, outputs, env and name, and may
+    # be run in another process (see yaku.process_pool)
+    process_safe = False
     def __init__(self, outputs, inputs, func=None, deps=None, env=None, env_vars=None):
         if is_string(inputs):
             self.inputs = [inputs]
@@ -70,6 +112,26 @@ class _Task(object):
         self.env = env
         self.env_vars = env_vars
         self.scan = None
+        # dependency file written by the task command (e.g. gcc -MD), and
+        # the dependencies found in it during the previous run
+        self.depfile = None
+        self.implicit_deps = []
+        # Compiled function running the command of several tasks of the same
+        # kind at once, if supported (see yaku.batch)
+        self.batch_func = None
+        # (cmd, cwd, env) of the compiled function, see expand_command
+        self.command = None
+        self.executed_commands = []
+        # Implicit dependencies of outputs restored from the artifact cache
+        self.restored_deps = None
+        # Process of the command being executed, if any, and whether the
+        # task has been cancelled (see terminate)
+        self.process = None
+        self.cancelled = False
+        # Duration of the last run, in seconds, and peak RSS of its
+        # commands in bytes (None if unknown)
+        self.duration = None
+        self.peak_rss = None
         self.disable_output = False
         self.log = None
 
@@ -97,52 +159,117 @@ class _Task(object):
         m = md5()
 
         self._sig_explicit_deps(m)
-        for k in self.env_vars:
-            m.update(dumps(self.env[k]))
+        self._sig_implicit_deps(m)
+        self._sig_vars(m)
+        self._sig_command(m)
+        return m.digest()
+
+    def content_signature(self):
+        """Signature of the content of the task inputs and dependencies, and
+        of its function, i.e. what does not depend on where the tree is
+        nor on previous runs of the task."""
+        m = md5()
+        self._sig_explicit_deps(m)
         if self.func:
             m.update(function_code(self.func).co_code)
         return m.digest()
 
+    def _sig_command(self, m):
+        # Tasks whose command lines differ never share a signature
+        if getattr(self.func, "expand", None) is not None:
+            cmd, cwd, env = self.expand_command()
+            m.update(dumps(([str(c) for c in cmd], cwd)))
+        return m.digest()
+
     def _sig_explicit_deps(self, m):
         for s in self.inputs + self.deps:
-            #if os.path.exists(s):
-            #    m.update(open(s).read())
-            m.update(s.read(flags="rb"))
+            m.update(node_hash(s))
+        return m.digest()
+
+    def _sig_implicit_deps(self, m):
+        for s in self.implicit_deps:
+            m.update(node_hash(s))
+        return m.digest()
+
+    def _sig_vars(self, m):
+        memoized_digest = getattr(self.env, "memoized_digest", None)
+        if memoized_digest is None:
+            m.update(self._vars_digest())
+        else:
+            # Computed once for all the tasks sharing the environment (e.g.
+            # the tasks of a task generator)
+            m.update(memoized_digest((tuple(self.env_vars), self.func),
+                                     self.env_vars, self._vars_digest))
+        return m.digest()
+
+    def _vars_digest(self):
+        m = md5()
+        for k in self.env_vars:
+            m.update(dumps(self.env[k]))
+        if self.func:
+            m.update(function_code(self.func).co_code)
         return m.digest()
-        
+
+    def read_depfile(self):
+        """Return the absolute paths of the dependencies listed in the task
+        dependency file, the task inputs excluded."""
+        cwd = getattr(self, "cwd", None)
+        if cwd is None:
+            cwd = self.gen.bld.bld_root.abspath()
+        inputs = set([i.abspath() for i in self.inputs])
+        ret = []
+        for dep in parse_depfile(self.depfile.read()):
+            dep = os.path.normpath(os.path.join(cwd, dep))
+            if not dep in inputs:
+                ret.append(dep)
+        return ret
+
     # execution
     #----------
+    def expand_command(self):
+        """Return the (cmd, cwd, env) of the compiled function of the task.
+        The command line is expanded once, and shared by the signature, the
+        caches and the execution."""
+        if self.command is None:
+            self.command = self.func.expand(self)
+        return self.command
+
     def run(self):
+        # (cmd, stdout) of every command actually executed by this run
+        self.executed_commands = []
+        self.restored_deps = None
+        self.peak_rss = None
         self.func(self)
 
     def exec_command(self, cmd, cwd, env=None):
-        if cwd is None:
-            cwd = self.gen.bld.bld_root.abspath()
+        cwd, done = self.pre_exec_command(cmd, cwd)
+        if done:
+            return
+        self.spawn_command(cmd, cwd, env)
+
+    def spawn_command(self, cmd, cwd, env=None):
+        """Run cmd in a subprocess, once pre_exec_command has prepared it."""
         kw = {}
         if env is not None:
             kw["env"] = env
-        if not self.disable_output:
-            if self.env["VERBOSE"]:
-                pprint('GREEN', " ".join([str(c) for c in cmd]))
-            else:
-                pprint('GREEN', "%-16s%s" % (self.name.upper(), " ".join([i.bldpath() for i in self.inputs])))
+        jobserver = get_jobserver()
+        if jobserver is not None:
+            kw.update(jobserver.child_kw(env))
 
-        self.gen.bld.set_cmd_cache(self, cmd)
         try:
             p = subprocess.Popen(cmd, stdout=subprocess.PIPE,
                     stderr=subprocess.STDOUT, cwd=cwd, **kw)
-            stdout = p.communicate()[0].decode("utf-8")
-            if p.returncode:
-                raise TaskRunFailure(cmd, stdout)
-            if sys.version_info >= (3,):
-                stdout = stdout
-            else:
-                stdout = stdout.encode("utf-8")
-            if self.disable_output:
-                self.log.write(stdout)
-            else:
-                sys.stderr.write(stdout)
-            self.gen.bld.set_stdout_cache(self, stdout)
+            self.process = p
+            try:
+                # terminate may have been called before self.process was set
+                if self.cancelled:
+                    p.terminate()
+                output, returncode, peak_rss = wait_process(p)
+            finally:
+                self.process = None
+            if peak_rss is not None and peak_rss > (self.peak_rss or 0):
+                self.peak_rss = peak_rss
+            self.post_exec_command(cmd, returncode, output)
         except OSError:
             e = get_exception()
             raise TaskRunFailure(cmd, str(e))
@@ -150,7 +277,132 @@ class _Task(object):
             e = get_exception()
             raise TaskRunFailure(cmd, str(e))
 
+    # exec_command is split in two halves around the actual process
+    # execution, so that other runners (see yaku._scheduler_py3) can launch
+    # the command themselves
+    def pre_exec_command(self, cmd, cwd):
+        """Prepare the execution of cmd. Return the working directory, and
+        True if the command does not need to be executed (outputs restored
+        from the artifact cache)."""
+        if self.cancelled:
+            raise TaskRunFailure(cmd, "Cancelled")
+        if cwd is None:
+            cwd = self.gen.bld.bld_root.abspath()
+        if not self.disable_output:
+            if self.env["VERBOSE"]:
+                pprint('GREEN', " ".join([str(c) for c in cmd]))
+            else:
+                pprint('GREEN', "%-16s%s" % (self.name.upper(), " ".join([i.bldpath() for i in self.inputs])))
+
+        self.gen.bld.set_cmd_cache(self, cmd)
+        artifact_cache = getattr(self.gen.bld, "artifact_cache", None)
+        if artifact_cache is not None:
+            stdout = artifact_cache.restore(self, cmd)
+            if stdout is not None:
+                self._write_stdout(stdout)
+                return cwd, True
+        return cwd, False
+
+    def post_exec_command(self, cmd, returncode, output):
+        """Process the result of cmd: returncode and combined stdout/stderr
+        output (bytes)."""
+        stdout = output.decode("utf-8")
+        if returncode:
+            raise TaskRunFailure(cmd, stdout)
+        if sys.version_info >= (3,):
+            stdout = stdout
+        else:
+            stdout = stdout.encode("utf-8")
+        self._write_stdout(stdout)
+        self.executed_commands.append((cmd, stdout))
+
+    def terminate(self):
+        """Cancel the task: kill the command it is running, if any, and make
+        any later command fail. May be called from another thread."""
+        self.cancelled = True
+        p = self.process
+        if p is not None and p.returncode is None:
+            try:
+                p.terminate()
+            except OSError:
+                # Already finished
+                pass
+
+    def _write_stdout(self, stdout):
+        if self.disable_output:
+            self.log.write(stdout)
+        else:
+            sys.stderr.write(stdout)
+        self.gen.bld.set_stdout_cache(self, stdout)
+
     def __repr__(self):
         ins = ",".join([i.name for i in self.inputs])
         outs = ",".join([i.name for i in self.outputs])
         return "'%s: %s -> %s'" % (self.name, ins, outs)
+
+class _Part(object):
+    """What the function of a micro task sees of one of its parts: the part
+    input and output, everything else being the micro task ones."""
+    def __init__(self, task, input, output):
+        self.task = task
+        self.inputs = [input]
+        self.outputs = [output]
+        self.uid = None
+
+    def __getattr__(self, name):
+        return getattr(self.task, name)
+
+    def get_uid(self):
+        if self.uid is None:
+            m = md5()
+            m.update(self.task.__class__.__name__.encode())
+            for x in self.inputs + self.outputs:
+                m.update(x.abspath().encode())
+            self.uid = m.digest()
+        return self.uid
+
+class _MicroTask(_Task):
+    """Many light file tasks (copies, templates) scheduled as one task.
+
+    Scheduling, signing and printing a task costs more than copying a small
+    file: a micro task does it once for all its parts, a part being an
+    (input, output) pair processed by func. Parts are still signed
+    separately, and only the ones whose input, output, function or env
+    variables changed are run again (see task_needs_run).
+
+    func must only use the inputs, outputs and env of the part it is given.
+    When parts_func is set, it is called once with the list of parts to run
+    instead, for work which is cheaper on many files at once. The parts of
+    a process safe micro task are spread over the process pool workers (see
+    yaku.process_pool).
+    """
+    parts_func = None
+
+    def __init__(self, parts, func=None, deps=None, env=None, env_vars=None):
+        _Task.__init__(self, [p[1] for p in parts], [p[0] for p in parts],
+                       func=func, deps=deps, env=env, env_vars=env_vars)
+        self.parts = [_Part(self, i, o) for i, o in parts]
+        # Parts to run, set by task_needs_run
+        self.stale_parts = self.parts
+
+    def part_signature(self, part):
+        m = md5()
+        for s in part.inputs + self.deps:
+            m.update(node_hash(s))
+        self._sig_vars(m)
+        return m.digest()
+
+    def run(self, parts_func=None):
+        self.executed_commands = []
+        self.restored_deps = None
+        self.peak_rss = None
+        if not self.disable_output:
+            pprint('GREEN', "%-16s%d file(s)" % (self.name.upper(),
+                                                 len(self.stale_parts)))
+        if parts_func is None:
+            parts_func = self.parts_func
+        if parts_func is not None:
+            parts_func(self.stale_parts)
+            return
+        for part in self.stale_parts:
+            self.func(part)
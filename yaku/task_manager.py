@@ -1,8 +1,19 @@
 import os
+import time
+
+from array \
+    import \
+        array
 
 from yaku.environment \
     import \
         Environment
+from yaku.errors \
+    import \
+        CyclicDependency
+from yaku.hash_cache \
+    import \
+        update_nodes
 
 RULES_REGISTRY = {}
 FILES_REGISTRY = {}
@@ -38,128 +49,398 @@ def set_file_hook(ctx, source, hook):
 class NoHookException(Exception):
     pass
 
-def hash_task(t):
-    # FIXME: ext_in and ext_out should not be computed from the files
-    ext_in = [os.path.splitext(s.name)[1] for s in t.inputs]
-    ext_out = [os.path.splitext(s.name)[1] for s in t.outputs]
-    tup = tuple(ext_in + ext_out + t.before + t.after)
-    return hash((t.__class__.__name__, tup))
+class _Barrier(object):
+    """Pseudo task standing for 'every task of a given class is done', used
+    to express the class-level before/after constraints without adding one
+    edge per pair of tasks."""
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return "'barrier: %s'" % self.name
+
+# Estimated duration of a task per byte of input, used for tasks without
+# duration history when no other task can calibrate it
+DEFAULT_SECONDS_PER_BYTE = 1e-5
+
+def _input_size(task):
+    size = 0
+    for n in task.inputs:
+        try:
+            size += os.path.getsize(n.abspath())
+        except OSError:
+            pass
+    return size
 
 class TaskManager(object):
-    def __init__(self, tasks):
+    """Dependency graph between tasks.
+
+    A task depends on the tasks producing its inputs and dependencies
+    (task.inputs and task.deps). Tasks of class A also depend on every task
+    whose class name is in A.before, and every task whose class name is in
+    A.after depends on the tasks of class A.
+
+    Tasks are indexed once, and the graph is stored as compact arrays
+    (successors in CSR layout + indegree counters), so that building and
+    walking the graph is linear in the number of tasks and edges.
+
+    If durations (task uid -> duration of its last run) is given, ready
+    tasks are returned by decreasing priority, the priority of a task being
+    the duration of the longest path from it to the end of the build
+    (critical path first)."""
+    def __init__(self, tasks, durations=None):
         self.tasks = tasks
 
-        self.groups = {}
-        self.order = {}
-        self.make_groups()
-        self.make_order()
-
-    def set_order(self, a, b):
-        if not a in self.order:
-            self.order[a] = set()
-        self.order[a].add(b)
-
-    def make_order(self):
-        keys = list(self.groups.keys())
-        max = len(keys)
-        for i in range(max):
-            t1 = self.groups[keys[i]][0]
-            for j in range(i + 1, max):
-                t2 = self.groups[keys[j]][0]
-
-                if t2.__class__.__name__ in t1.before:
-                    self.set_order(keys[j], keys[i])
-                elif t1.__class__.__name__ in t2.before:
-                    self.set_order(keys[i], keys[j])
-                else:
-                    # add the constraints based on the comparisons
-                    val = self.compare_exts(t1, t2)
-                    if val > 0:
-                        self.set_order(keys[i], keys[j])
-                    elif val < 0:
-                        self.set_order(keys[j], keys[i])
-
-    def make_groups(self):
-        # XXX: we assume tasks with same input/output suffix can run
-        # in // (naive emulation of csr-like scheduler in waf)
-        groups = self.groups
-        for t in self.tasks:
-            h = hash_task(t)
-            if h in groups:
-                groups[h].append(t)
-            else:
-                groups[h] = [t]
-
-    def next_set(self):
-        keys = self.groups.keys()
+        # index -> task (or barrier), and task -> index
+        self._nodes = []
+        self._index = {}
+        self.make_graph()
+        order = self.check_cycles()
 
-        unconnected = []
-        remainder = []
+        if durations is None:
+            self._priority = None
+        else:
+            self._priority = self._compute_priorities(order, durations)
 
-        for u in keys:
-            for k in self.order.values():
-                if u in k:
-                    remainder.append(u)
-                    break
-            else:
-                unconnected.append(u)
+        indegree = self._indegree
+        self._initial = [i for i in range(len(self._nodes)) \
+                         if indegree[i] == 0]
+        self._next = None
 
-        toreturn = []
-        for y in unconnected:
-            toreturn.extend(self.groups[y])
+    def _add_node(self, t):
+        self._index[t] = len(self._nodes)
+        self._nodes.append(t)
 
-        # remove stuff only after
-        for y in unconnected:
+    def make_graph(self):
+        index = self._index
+        tasks = []
+        for t in self.tasks:
+            if not t in index:
+                self._add_node(t)
+                tasks.append(t)
+
+        # Edges are first accumulated as (src, dst) arrays, and then sorted
+        # by source in CSR layout (counting sort). Duplicated edges are
+        # harmless as indegree counts them as many times as they appear.
+        src = array("l")
+        dst = array("l")
+
+        producers = {}
+        for t in tasks:
+            i = index[t]
+            for o in t.outputs:
                 try:
-                    self.order.__delitem__(y)
+                    producers[o].append(i)
                 except KeyError:
-                    pass
-                self.groups.__delitem__(y)
-
-        if not toreturn and remainder:
-            raise Exception("circular order constraint detected %r" % remainder)
-
-        return toreturn
-
-
-    def compare_exts(self, t1, t2):
-        "extension production"
-        def _get_in(t):
-            return [os.path.splitext(s.name)[1] for s in t.inputs]
-        def _get_out(t):
-            return [os.path.splitext(s.name)[1] for s in t.outputs]
-
-        in_ = _get_in(t1)
-        out_ = _get_out(t2)
-        for k in in_:
-            if k in out_:
-                return -1
-        in_ = _get_in(t2)
-        out_ = _get_out(t1)
-        for k in in_:
-            if k in out_:
-                return 1
-        return 0
-
-def run_task(ctx, task):
-    def _run(t):
-        t.run()
-        ctx.cache[tuid] = t.signature()
+                    producers[o] = [i]
+
+        for t in tasks:
+            i = index[t]
+            for n in t.inputs + t.deps + t.implicit_deps:
+                for p in producers.get(n, ()):
+                    if p != i:
+                        src.append(p)
+                        dst.append(i)
+
+        by_class = {}
+        for t in tasks:
+            try:
+                by_class[t.__class__.__name__].append(index[t])
+            except KeyError:
+                by_class[t.__class__.__name__] = [index[t]]
 
-    tuid = task.get_uid()
+        barriers = {}
+        def _barrier(name):
+            try:
+                return barriers[name]
+            except KeyError:
+                self._add_node(_Barrier(name))
+                b = barriers[name] = len(self._nodes) - 1
+                for i in by_class[name]:
+                    src.append(i)
+                    dst.append(b)
+                return b
+
+        for name, klass_tasks in by_class.items():
+            klass = self._nodes[klass_tasks[0]].__class__
+            for n in klass.before:
+                if n != name and n in by_class:
+                    b = _barrier(n)
+                    for i in klass_tasks:
+                        src.append(b)
+                        dst.append(i)
+            for n in klass.after:
+                if n != name and n in by_class:
+                    b = _barrier(name)
+                    for i in by_class[n]:
+                        src.append(b)
+                        dst.append(i)
+
+        nnodes = len(self._nodes)
+        start = array("l", [0]) * (nnodes + 1)
+        indegree = array("l", [0]) * nnodes
+        for k in src:
+            start[k + 1] += 1
+        for k in dst:
+            indegree[k] += 1
+        for k in range(nnodes):
+            start[k + 1] += start[k]
+        succ = array("l", [0]) * len(src)
+        pos = start[:-1]
+        for k in range(len(src)):
+            s = src[k]
+            succ[pos[s]] = dst[k]
+            pos[s] += 1
+
+        self._succ_start = start
+        self._succ = succ
+        self._indegree = indegree
+
+    def check_cycles(self):
+        # Kahn's algorithm: any node never reaching zero predecessors is
+        # part of (or downstream of) a cycle
+        indegree = self._indegree[:]
+        start, succ = self._succ_start, self._succ
+        stack = [i for i in range(len(indegree)) if indegree[i] == 0]
+        order = array("l")
+        while stack:
+            i = stack.pop()
+            order.append(i)
+            for k in range(start[i], start[i+1]):
+                s = succ[k]
+                indegree[s] -= 1
+                if indegree[s] == 0:
+                    stack.append(s)
+        if len(order) < len(indegree):
+            remaining = [i for i in range(len(indegree)) if indegree[i] > 0]
+            raise CyclicDependency(self._find_cycle(remaining))
+        return order
+
+    def _compute_priorities(self, order, durations):
+        nodes = self._nodes
+        cost = array("d", [0.0]) * len(nodes)
+        unknown = []
+        for i in range(len(nodes)):
+            t = nodes[i]
+            if not isinstance(t, _Barrier):
+                d = durations.get(t.get_uid(), None)
+                if d is None:
+                    unknown.append(i)
+                else:
+                    cost[i] = d
+
+        if unknown:
+            # Estimate from the input size, at the rate observed for the
+            # tasks of the same class with a history
+            known = {}
+            for i in range(len(nodes)):
+                t = nodes[i]
+                if cost[i] > 0:
+                    d, size = known.get(t.__class__, (0.0, 0))
+                    known[t.__class__] = (d + cost[i], size + _input_size(t))
+            for i in unknown:
+                t = nodes[i]
+                d, size = known.get(t.__class__, (0.0, 0))
+                if size > 0:
+                    rate = d / size
+                else:
+                    rate = DEFAULT_SECONDS_PER_BYTE
+                cost[i] = rate * _input_size(t)
+
+        # Longest path to the end of the build, successors first
+        start, succ = self._succ_start, self._succ
+        priority = array("d", [0.0]) * len(nodes)
+        for k in range(len(order) - 1, -1, -1):
+            i = order[k]
+            longest = 0.0
+            for j in range(start[i], start[i+1]):
+                if priority[succ[j]] > longest:
+                    longest = priority[succ[j]]
+            priority[i] = cost[i] + longest
+        return priority
+
+    def priority(self, task):
+        """Estimated duration of the longest path from task to the end of
+        the build (0 without durations)."""
+        if self._priority is None:
+            return 0.0
+        return self._priority[self._index[task]]
+
+    def _sorted(self, indices):
+        nodes = self._nodes
+        if self._priority is not None:
+            priority = self._priority
+            indices.sort(key=lambda i: -priority[i])
+        return [nodes[i] for i in indices]
+
+    def _find_cycle(self, remaining):
+        # Walk backwards from any remaining node: every remaining node has
+        # at least one remaining predecessor, so we must loop at some point
+        start, succ = self._succ_start, self._succ
+        in_remaining = set(remaining)
+        predecessor = {}
+        for i in remaining:
+            for k in range(start[i], start[i+1]):
+                if succ[k] in in_remaining:
+                    predecessor[succ[k]] = i
+        cur = remaining[0]
+        seen = {}
+        path = []
+        while not cur in seen:
+            seen[cur] = len(path)
+            path.append(cur)
+            cur = predecessor[cur]
+        cycle = [self._nodes[i] for i in path[seen[cur]:]]
+        cycle.reverse()
+        return cycle
+
+    def _done(self, i):
+        # Decrement the indegree of i successors, and return the indices of
+        # the tasks which became ready, walking through barriers
+        start, succ, indegree = self._succ_start, self._succ, self._indegree
+        ret = []
+        stack = [i]
+        while stack:
+            i = stack.pop()
+            for k in range(start[i], start[i+1]):
+                s = succ[k]
+                indegree[s] -= 1
+                if indegree[s] == 0:
+                    if isinstance(self._nodes[s], _Barrier):
+                        stack.append(s)
+                    else:
+                        ret.append(s)
+        return ret
+
+    def ready_tasks(self):
+        """Return the list of tasks which can be started right away, i.e.
+        the tasks without any predecessor."""
+        nodes = self._nodes
+        ret = []
+        for i in self._initial:
+            if isinstance(nodes[i], _Barrier):
+                ret.extend(self._done(i))
+            else:
+                ret.append(i)
+        return self._sorted(ret)
+
+    def task_done(self, task):
+        """Mark the given task as finished, and return the list of tasks
+        which became ready because of it."""
+        return self._sorted(self._done(self._index[task]))
+
+    def task_failed(self, task):
+        """Mark the given task as failed, and return the list of the tasks
+        which depend on it, directly or not. They never become ready."""
+        start, succ, nodes = self._succ_start, self._succ, self._nodes
+        seen = set()
+        ret = []
+        stack = [self._index[task]]
+        while stack:
+            i = stack.pop()
+            for k in range(start[i], start[i+1]):
+                s = succ[k]
+                if not s in seen:
+                    seen.add(s)
+                    stack.append(s)
+                    if not isinstance(nodes[s], _Barrier):
+                        ret.append(nodes[s])
+        return ret
+
+    def next_set(self):
+        """Return the next set of tasks which can be run in parallel, or an
+        empty list once every task has been returned. Every task of a set
+        is considered done when the next set is asked for."""
+        if self._next is None:
+            grp = self.ready_tasks()
+        else:
+            grp = self._next
+        nxt = []
+        for t in grp:
+            nxt.extend(self.task_done(t))
+        self._next = nxt
+        return grp
+
+def run_task(ctx, task, run=None, jobserver=None):
+    """Run task if it is out of date. run is the callable used to execute
+    the task (task.run by default). If jobserver is given, a token is held
+    while the task runs (see yaku.jobserver)."""
+    if not task_needs_run(ctx, task):
+        return
+    # The wait for a token is not part of the task duration
+    if jobserver is not None:
+        token = jobserver.acquire()
+    try:
+        start = time.time()
+        if run is None:
+            task.run()
+        else:
+            run(task)
+        task.duration = time.time() - start
+    finally:
+        if jobserver is not None:
+            jobserver.release(token)
+    task_ran(ctx, task)
+
+def task_needs_run(ctx, task):
+    if getattr(task, "parts", None) is not None:
+        # Micro task: only its out of date parts are run
+        task.stale_parts = [p for p in task.parts \
+                            if _part_needs_run(ctx, task, p)]
+        return len(task.stale_parts) > 0
     # XXX: there may be a better way to do this without stating output
     # (we want to know if the task has already been executed in a
     # previous run)
     for o in task.outputs:
         if not os.path.exists(o.abspath()):
-            _run(task)
-            break
+            return True
+    tuid = task.get_uid()
     if not tuid in ctx.cache:
-        _run(task)
+        return True
+    return task.signature() != ctx.cache[tuid]
+
+def _part_needs_run(ctx, task, part):
+    if not os.path.exists(part.outputs[0].abspath()):
+        return True
+    return ctx.cache.get(part.get_uid(), None) != task.part_signature(part)
+
+def task_ran(ctx, t):
+    """Update the build state once t has run."""
+    if getattr(t, "parts", None) is not None:
+        # Micro task: parts are signed separately
+        update_nodes([p.outputs[0] for p in t.stale_parts])
+        for p in t.stale_parts:
+            ctx.cache[p.get_uid()] = t.part_signature(p)
     else:
-        sig = task.signature()
-        if sig != ctx.cache[tuid]:
-            _run(task)
+        # Early cutoff: signatures depend on content only, so dependents of
+        # a task whose outputs are byte-identical are up to date and will
+        # not run. Hash the outputs right away, so that dependents (and the
+        # next build) find their digests in the hash cache instead of
+        # reading them again
+        update_nodes(t.outputs)
+        if t.depfile is not None:
+            # The signature stored for next run must include the
+            # dependencies found by this run
+            if t.restored_deps is not None:
+                ctx.set_implicit_deps(t, t.restored_deps)
+            else:
+                ctx.set_implicit_deps(t, t.read_depfile())
+            t.implicit_deps = ctx.get_implicit_deps(t)
+            t.cache = None
+        ctx.cache[t.get_uid()] = t.signature()
+    durations = getattr(ctx, "durations", None)
+    if durations is not None and t.duration is not None:
+        durations[t.get_uid()] = t.duration
+    peak_rss = getattr(ctx, "peak_rss", None)
+    if peak_rss is not None and t.peak_rss is not None:
+        peak_rss[t.get_uid()] = t.peak_rss
+
+    # Only tasks made of exactly one command can be restored from the
+    # artifact cache (see _Task.exec_command)
+    artifact_cache = getattr(ctx, "artifact_cache", None)
+    if artifact_cache is not None and len(t.executed_commands) == 1:
+        cmd, stdout = t.executed_commands[0]
+        artifact_cache.store(t, cmd, stdout, t.implicit_deps)
 
 def build_dag(tasks):
     # Build dependency graph (DAG)
@@ -179,7 +460,6 @@ def build_dag(tasks):
 
 def topo_sort(task_deps):
     # Topological sort (depth-first search)
-    # XXX: cycle detection is missing
     tmp = []
     nodes = []
     for dep in task_deps.values():
@@ -188,13 +468,23 @@ def topo_sort(task_deps):
     nodes = set(nodes)
 
     visited = set()
+    # nodes on the current DFS path, in order: meeting one of them again
+    # means we found a cycle
+    path = []
+    in_path = set()
     def visit(node):
+        if node in in_path:
+            raise CyclicDependency(path[path.index(node):])
         if not node in visited:
            visited.add(node)
+           path.append(node)
+           in_path.add(node)
            deps = task_deps.get(node, None)
            if deps:
                for c in deps:
                    visit(c)
+           in_path.remove(node)
+           path.pop()
            tmp.append(node)
 
     for node in nodes:
@@ -234,6 +524,8 @@ class CompiledTaskGen(TaskGen):
         self.object_tasks = []
         self.link_task = None
         self.has_cxx = False
+        # absolute include directories, used to scan for headers
+        self.include_dirs = []
 
     def add_objects(self, tasks):
         """Add new object tasks, assuming the link task has already
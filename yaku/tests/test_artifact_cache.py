@@ -0,0 +1,106 @@
+import os
+
+from yaku.tests.test_helpers \
+    import \
+        TmpContextBase
+from yaku.context \
+    import \
+        create_top_nodes
+from yaku.task \
+    import \
+        task_factory
+from yaku.artifact_cache \
+    import \
+        ArtifactCache
+
+def copy_func(task):
+    task.outputs[0].write(task.inputs[0].read())
+
+class ArtifactCacheTest(TmpContextBase):
+    def setUp(self):
+        super(ArtifactCacheTest, self).setUp()
+        self.src_root, self.bld_root = create_top_nodes(self.d,
+                os.path.join(self.d, "build"))
+        self.cache = ArtifactCache(os.path.join(self.d, "cache"))
+
+        self.source = self.src_root.make_node("foo.c")
+        self.source.write("int foo;")
+        self.header = self.src_root.make_node("foo.h")
+        self.header.write("int bar;")
+        self.target = self.bld_root.make_node("foo.o")
+        self.task = task_factory("copy")(inputs=[self.source],
+                outputs=[self.target], func=copy_func, env={}, env_vars=[])
+        self.cmd = ["cp", self.source.abspath(), self.target.abspath()]
+
+    def _store(self):
+        self.task.run()
+        self.cache.store(self.task, self.cmd, "copied", [self.header])
+        os.remove(self.target.abspath())
+
+    def test_restore(self):
+        self._store()
+        self.assertEqual(self.cache.restore(self.task, self.cmd), "copied")
+        self.assertEqual(self.target.read(), "int foo;")
+
+    def test_entry_mode(self):
+        # Entries of a shared cache must be readable by other users
+        self._store()
+        key = self.cache.key(self.task, self.cmd)
+        entry = self.cache._variants(key)[0]
+        self.assertEqual(os.stat(entry).st_mode & int("777", 8),
+                         int("755", 8))
+
+    def test_changed_command(self):
+        self._store()
+        self.assertEqual(self.cache.restore(self.task, self.cmd + ["-O2"]),
+                         None)
+
+    def test_changed_implicit_dep(self):
+        self._store()
+        self.header.write("int baz;")
+        self.header.ctx.hash_cache.invalidate(self.header.abspath())
+        self.assertEqual(self.cache.restore(self.task, self.cmd), None)
+        self.assertFalse(os.path.exists(self.target.abspath()))
+
+    def test_header_variants(self):
+        # Both versions of the header are kept (e.g. switching branches)
+        self._store()
+        self.header.write("int baz;")
+        self.header.ctx.hash_cache.invalidate(self.header.abspath())
+        self.assertEqual(self.cache.restore(self.task, self.cmd), None)
+        self.task.run()
+        self.cache.store(self.task, self.cmd, "copied baz", [self.header])
+        self.assertEqual(self.cache.restore(self.task, self.cmd),
+                         "copied baz")
+
+        self.header.write("int bar;")
+        self.header.ctx.hash_cache.invalidate(self.header.abspath())
+        self.assertEqual(self.cache.restore(self.task, self.cmd), "copied")
+        key = self.cache.key(self.task, self.cmd)
+        self.assertEqual(len(self.cache._variants(key)), 2)
+
+    def test_relocated_tree(self):
+        # Same sources and command, in a tree checked out elsewhere
+        self._store()
+        key = self.cache.key(self.task, self.cmd)
+        other = os.path.join(self.d, "other")
+        os.makedirs(other)
+        src_root, bld_root = create_top_nodes(other,
+                os.path.join(other, "build"))
+        source = src_root.make_node("foo.c")
+        source.write("int foo;")
+        src_root.make_node("foo.h").write("int bar;")
+        target = bld_root.make_node("foo.o")
+        task = task_factory("copy")(inputs=[source], outputs=[target],
+                                    func=copy_func, env={}, env_vars=[])
+        cmd = ["cp", source.abspath(), target.abspath()]
+
+        self.assertEqual(self.cache.key(task, cmd), key)
+        self.assertEqual(self.cache.restore(task, cmd), "copied")
+        self.assertEqual(target.read(), "int foo;")
+
+    def test_trim(self):
+        self._store()
+        self.cache.max_size = 0
+        self.cache.trim()
+        self.assertEqual(self.cache.restore(self.task, self.cmd), None)
@@ -0,0 +1,99 @@
+import os
+import sys
+
+from yaku.tests.test_helpers \
+    import \
+        TmpContextBase, FakeContext, FakeBuildContext, FakeTaskGen
+from yaku.context \
+    import \
+        create_top_nodes
+from yaku.task \
+    import \
+        task_factory
+from yaku.batch \
+    import \
+        make_batches, run_batch
+import yaku.errors
+
+# Fake compiler: writes <stem>.o in the working directory for every source,
+# and fails for sources containing "error"
+COMPILER = """
+import os, sys
+ret = 0
+for src in sys.argv[1:]:
+    content = open(src).read()
+    if "error" in content:
+        sys.stdout.write("%s: error\\n" % src)
+        ret = 1
+    else:
+        stem = os.path.splitext(os.path.basename(src))[0]
+        open(stem + ".o", "w").write(content.upper())
+sys.exit(ret)
+"""
+
+def compile_func(task):
+    content = task.inputs[0].read()
+    if "error" in content:
+        raise yaku.errors.TaskRunFailure(["compile"], "error")
+    task.outputs[0].write(content.upper())
+
+def _expand(batch):
+    cmd = [sys.executable, "-c", COMPILER]
+    cmd.extend([i.abspath() for i in batch.inputs])
+    return cmd, None, None
+
+def batch_func(batch):
+    pass
+batch_func.expand = _expand
+
+class BatchTest(TmpContextBase):
+    def setUp(self):
+        super(BatchTest, self).setUp()
+        self.src_root, self.bld_root = create_top_nodes(self.d,
+                os.path.join(self.d, "build"))
+        self.ctx = FakeContext()
+        self.gen = FakeTaskGen(FakeBuildContext(self.bld_root))
+
+    def _tasks(self, names):
+        tasks = []
+        for name in names:
+            source = self.src_root.make_node(name)
+            source.write(name)
+            target = self.bld_root.make_node("%s.%d.o" % (name, len(tasks)))
+            task = task_factory("cc")(inputs=[source], outputs=[target],
+                    func=compile_func, env={"VERBOSE": False}, env_vars=[])
+            task.gen = self.gen
+            task.batch_func = batch_func
+            task.disable_output = True
+            task.log = sys.stderr
+            tasks.append(task)
+        return tasks
+
+    def test_make_batches(self):
+        tasks = self._tasks(["a.c", "b.c", "c.c", "d.c"])
+        other = task_factory("cc")(inputs=[], outputs=[], func=compile_func)
+        items = make_batches([other] + tasks, 3)
+        self.assertEqual(items, [other, tasks[:3], tasks[3]])
+
+    def test_same_name(self):
+        # Both objects would be written as a.o
+        tasks = self._tasks(["a.c", "a.c"])
+        self.assertEqual(make_batches(tasks, 4), tasks)
+
+    def test_run_batch(self):
+        tasks = self._tasks(["a.c", "b.c", "c.c"])
+        results = run_batch(self.ctx, tasks)
+        self.assertEqual(results, [(t, None) for t in tasks])
+        for t in tasks:
+            self.assertEqual(t.outputs[0].read(), t.inputs[0].name.upper())
+        self.assertEqual(len(self.ctx.cache), 3)
+        self.assertFalse(os.path.exists(os.path.join(self.bld_root.abspath(),
+                                                     "a.o")))
+
+    def test_bisect(self):
+        tasks = self._tasks(["a.c", "b.c", "error.c", "d.c"])
+        results = run_batch(self.ctx, tasks)
+        failed = [t for t, failure in results if failure is not None]
+        self.assertEqual(failed, [tasks[2]])
+        self.assertEqual(tasks[3].outputs[0].read(), "D.C")
+        self.assertEqual(len(self.ctx.cache), 3)
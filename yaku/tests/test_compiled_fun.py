@@ -0,0 +1,62 @@
+import os
+
+from yaku.tests.test_helpers \
+    import \
+        TmpContextBase, FakeBuildContext, FakeTaskGen
+from yaku.context \
+    import \
+        create_top_nodes
+from yaku.task \
+    import \
+        task_factory
+from yaku.compiled_fun \
+    import \
+        compile_fun
+from yaku.environment \
+    import \
+        Environment
+
+LINE = "${CC} ${CFLAGS} -o ${TGT[0].abspath()} ${SRC}"
+
+class CompileFunTest(TmpContextBase):
+    def setUp(self):
+        super(CompileFunTest, self).setUp()
+        self.src_root, self.bld_root = create_top_nodes(self.d,
+                os.path.join(self.d, "build"))
+        self.gen = FakeTaskGen(FakeBuildContext(self.bld_root))
+
+    def _task(self, env):
+        source = self.src_root.make_node("foo.c")
+        source.write("foo")
+        task = task_factory("cc")(inputs=[source],
+                outputs=[self.bld_root.make_node("foo.o")],
+                func=compile_fun("cc", LINE, False)[0], env=env,
+                env_vars=["CC"])
+        task.gen = self.gen
+        return task
+
+    def test_memoized(self):
+        self.assertTrue(compile_fun("cc", LINE, False)[0] is \
+                        compile_fun("cc", LINE, False)[0])
+
+    def test_expand_once(self):
+        env = Environment()
+        env["CC"] = ["gcc"]
+        env["CFLAGS"] = ["-O2"]
+        env["ENV"] = {}
+        task = self._task(env)
+        cmd, cwd, _ = task.expand_command()
+        self.assertEqual(cmd, ["gcc", "-O2", "-o",
+                self.bld_root.find_node("foo.o").abspath(), "../foo.c"])
+        self.assertTrue(task.expand_command()[0] is cmd)
+
+    def test_signature(self):
+        # CFLAGS is not in env_vars, but is part of the command line
+        sigs = []
+        for cflags in [["-O2"], ["-O0"]]:
+            env = Environment()
+            env["CC"] = ["gcc"]
+            env["CFLAGS"] = cflags
+            env["ENV"] = {}
+            sigs.append(self._task(env).signature())
+        self.assertNotEqual(sigs[0], sigs[1])
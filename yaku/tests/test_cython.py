@@ -0,0 +1,197 @@
+import os
+import sys
+import unittest
+
+from yaku.tests.test_helpers \
+    import \
+        TmpContextBase, FakeContext, FakeBuildContext, FakeTaskGen
+from yaku.context \
+    import \
+        create_top_nodes
+from yaku.task \
+    import \
+        task_factory
+from yaku.compiled_fun \
+    import \
+        compile_fun
+from yaku.scheduler \
+    import \
+        run_tasks
+from yaku.process_pool \
+    import \
+        shutdown_pools
+import yaku.tools.cython
+import yaku.errors
+
+# Fake Cython compiler API: "compiles" a .pyx by upper casing it, and fails
+# for sources containing "error"
+FAKE_MAIN = """
+import sys
+
+from Cython.Compiler import Options
+
+class Result(object):
+    num_errors = 0
+
+def compile(sources, options):
+    result = Result()
+    for source in sources:
+        content = open(source).read()
+        if "error" in content:
+            sys.stderr.write("%s: error\\n" % source)
+            result.num_errors += 1
+        else:
+            sys.stdout.write("compiling %s\\n" % source)
+            if Options.annotate:
+                content += " annotated"
+            open(options.output_file, "w").write(content.upper())
+    return result
+"""
+
+FAKE_CMDLINE = """
+from Cython.Compiler import Options as GlobalOptions
+
+class Options(object):
+    output_file = None
+
+def parse_command_line(args):
+    options = Options()
+    sources = []
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        if arg == "-o":
+            options.output_file = args.pop(0)
+        elif arg == "-a":
+            GlobalOptions.annotate = True
+        else:
+            sources.append(arg)
+    return options, sources
+"""
+
+skip_no_pool = unittest.skipIf(yaku.tools.cython.ProcessPoolExecutor is None,
+                               "concurrent.futures is not available")
+
+class CythonPoolTest(TmpContextBase):
+    def setUp(self):
+        super(CythonPoolTest, self).setUp()
+        self.src_root, self.bld_root = create_top_nodes(self.d,
+                os.path.join(self.d, "build"))
+        self.fake = os.path.join(self.d, "fake")
+        compiler = os.path.join(self.fake, "Cython", "Compiler")
+        os.makedirs(compiler)
+        for filename, content in [
+                (os.path.join("Cython", "__init__.py"), ""),
+                (os.path.join("Cython", "Compiler", "__init__.py"), ""),
+                (os.path.join("Cython", "Compiler", "Main.py"), FAKE_MAIN),
+                (os.path.join("Cython", "Compiler", "CmdLine.py"),
+                 FAKE_CMDLINE),
+                (os.path.join("Cython", "Compiler", "Options.py"),
+                 "annotate = False\n")]:
+            fid = open(os.path.join(self.fake, filename), "w")
+            try:
+                fid.write(content)
+            finally:
+                fid.close()
+        self.gen = FakeTaskGen(FakeBuildContext(self.bld_root))
+
+    def tearDown(self):
+        shutdown_pools()
+        super(CythonPoolTest, self).tearDown()
+
+    def _task(self, name, content, flags=""):
+        source = self.src_root.make_node(name)
+        source.write(content)
+        target = self.bld_root.make_node(name.replace(".pyx", ".c"))
+        env = {"CYTHON": [sys.executable, "-m", "cython"],
+               "CYTHON_INCPATH": [], "VERBOSE": False,
+               "ENV": {"PYTHONPATH": self.fake}}
+        task = task_factory("cython")(inputs=[source], outputs=[target],
+                env=env, env_vars=[])
+        task.func = yaku.tools.cython.pool_fun(compile_fun("cython",
+                "${CYTHON} %s${SRC} -o ${TGT} ${CYTHON_INCPATH}" % flags,
+                False)[0])
+        task.gen = self.gen
+        return task
+
+    @skip_no_pool
+    def test_compile(self):
+        tasks = [self._task("foo.pyx", "foo"), self._task("bar.pyx", "bar")]
+        run_tasks(FakeContext(), tasks)
+        self.assertEqual(tasks[0].outputs[0].read(), "FOO")
+        self.assertEqual(tasks[1].outputs[0].read(), "BAR")
+        # The compiler output is the one of the task
+        cmd, stdout = tasks[0].executed_commands[0]
+        self.assertEqual(stdout, "compiling ../foo.pyx\n")
+
+    @skip_no_pool
+    def test_options_reset(self):
+        # Both files are compiled by the same worker
+        tasks = [self._task("foo.pyx", "foo", "-a "),
+                 self._task("bar.pyx", "bar")]
+        run_tasks(FakeContext(), tasks)
+        self.assertEqual(tasks[0].outputs[0].read(), "FOO ANNOTATED")
+        self.assertEqual(tasks[1].outputs[0].read(), "BAR")
+
+    @skip_no_pool
+    def test_error(self):
+        task = self._task("foo.pyx", "error")
+        try:
+            run_tasks(FakeContext(), [task])
+            self.fail("cython error not reported")
+        except yaku.errors.TaskRunFailure:
+            e = sys.exc_info()[1]
+            self.assertEqual(e.explain, "../foo.pyx: error\n")
+
+    def test_pool_fun(self):
+        # One wrapper per compiled function, for the signature memo
+        fun = compile_fun("cython", "${CYTHON} ${SRC} -o ${TGT}", False)[0]
+        self.assertTrue(yaku.tools.cython.pool_fun(fun) is
+                        yaku.tools.cython.pool_fun(fun))
+
+    def test_no_api(self):
+        # Without the compiler API, the command is run in a subprocess
+        if not yaku.tools.cython.has_compiler_api():
+            self.assertEqual(yaku.tools.cython._cython_compile([], self.d),
+                             None)
+
+class CythonScanTest(TmpContextBase):
+    def setUp(self):
+        super(CythonScanTest, self).setUp()
+        self.src_root, self.bld_root = create_top_nodes(self.d,
+                os.path.join(self.d, "build"))
+        self.gen = FakeTaskGen(FakeBuildContext(self.bld_root))
+
+    def _write(self, name, content):
+        node = self.src_root.make_node(name)
+        node.parent.mkdir()
+        node.write(content)
+        return node
+
+    def test_scan(self):
+        source = self._write("pkg/a.pyx", """\
+cimport b, numpy as np
+from pkg.c cimport foo
+from . cimport (d,
+    e)
+# cimport commented
+include "a.pxi"
+""")
+        self._write("pkg/a.pxd", "from f cimport *\n")
+        self._write("pkg/b.pxd", "")
+        self._write("pkg/c.pxd", "")
+        self._write("pkg/__init__.pxd", "")
+        self._write("pkg/d.pxd", "include 'inc/d.pxi'\n")
+        self._write("pkg/e.pxd", "")
+        self._write("pkg/commented.pxd", "")
+        self._write("pkg/a.pxi", "")
+        self._write("pkg/inc/d.pxi", "")
+        self._write("include/f.pxd", "")
+
+        task = task_factory("cython")(inputs=[source], outputs=[],
+                env={"CYTHON_CPPPATH": ["../include"]}, env_vars=[])
+        task.gen = self.gen
+        deps = [n.srcpath() for n in yaku.tools.cython.scan_cython(task)]
+        self.assertEqual(sorted(deps), sorted(["pkg/a.pxd", "pkg/b.pxd",
+                "pkg/c.pxd", "pkg/d.pxd", "pkg/e.pxd", "pkg/a.pxi",
+                "pkg/inc/d.pxi", "include/f.pxd"]))
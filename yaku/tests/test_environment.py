@@ -0,0 +1,135 @@
+import os
+import copy
+import pickle
+from unittest \
+    import \
+        TestCase
+
+from yaku.tests.test_helpers \
+    import \
+        TmpContextBase
+from yaku.environment \
+    import \
+        Environment
+from yaku.context \
+    import \
+        create_top_nodes
+from yaku.task \
+    import \
+        task_factory
+import yaku.environment
+
+class EnvironmentTest(TestCase):
+    def _env(self):
+        env = Environment()
+        env["CC"] = ["gcc"]
+        env["CFLAGS"] = ["-O2"]
+        env["ENV"] = {"PATH": "/bin"}
+        env["VERBOSE"] = False
+        return env
+
+    def test_copy_on_write(self):
+        env = self._env()
+        child = copy.deepcopy(env)
+        child["CFLAGS"].append("-g")
+        child.append("CC", "-m64")
+        child["ENV"]["PATH"] = "/usr/bin"
+        child["VERBOSE"] = True
+        self.assertEqual(env["CFLAGS"], ["-O2"])
+        self.assertEqual(env["CC"], ["gcc"])
+        self.assertEqual(env["ENV"], {"PATH": "/bin"})
+        self.assertEqual(env["VERBOSE"], False)
+        self.assertEqual(child["CFLAGS"], ["-O2", "-g"])
+        self.assertEqual(child["ENV"], {"PATH": "/usr/bin"})
+
+    def test_snapshot(self):
+        # Variables set in the original after the copy are not seen by it
+        env = self._env()
+        child = env.derive()
+        env["CC"] = ["clang"]
+        env["CFLAGS"].append("-g")
+        env["LIBS"] = ["m"]
+        self.assertEqual(child["CC"], ["gcc"])
+        self.assertEqual(child["CFLAGS"], ["-O2"])
+        self.assertFalse("LIBS" in child)
+
+    def test_dict_api(self):
+        env = self._env()
+        child = env.derive()
+        child["LIBS"] = []
+        del child["VERBOSE"]
+        self.assertFalse("VERBOSE" in child)
+        self.assertTrue("VERBOSE" in env)
+        self.assertEqual(sorted(child.keys()), ["CC", "CFLAGS", "ENV", "LIBS"])
+        self.assertEqual(len(child), 4)
+        self.assertEqual(dict(child), {"CC": ["gcc"], "CFLAGS": ["-O2"],
+                "ENV": {"PATH": "/bin"}, "LIBS": []})
+        self.assertEqual(child.get("VERBOSE", 1), 1)
+        self.assertEqual(pickle.loads(pickle.dumps(child)), child)
+
+    def test_depth(self):
+        env = self._env()
+        for i in range(3 * yaku.environment.MAX_DEPTH):
+            env["X%d" % i] = i
+            env = env.derive()
+        self.assertTrue(env._depth <= yaku.environment.MAX_DEPTH)
+        self.assertEqual(env["X0"], 0)
+        self.assertEqual(env["CC"], ["gcc"])
+
+    def test_memoized_digest(self):
+        env = self._env()
+        calls = []
+        def compute():
+            calls.append(1)
+            return len(calls)
+        names = ["CC", "CFLAGS"]
+        self.assertEqual(env.memoized_digest("a", names, compute), 1)
+        self.assertEqual(env.memoized_digest("a", names, compute), 1)
+        env.append("CFLAGS", "-g")
+        self.assertEqual(env.memoized_digest("a", names, compute), 2)
+        env["CC"] = ["clang"]
+        self.assertEqual(env.memoized_digest("a", names, compute), 3)
+        # Modified in place
+        env["CC"].append("-m32")
+        self.assertEqual(env.memoized_digest("a", names, compute), 4)
+        # Copies do not share digests
+        child = env.derive()
+        self.assertEqual(child.memoized_digest("a", names, compute), 5)
+        self.assertEqual(env.memoized_digest("a", names, compute), 4)
+
+class EnvironmentStoreTest(TmpContextBase):
+    def test_store(self):
+        env = Environment()
+        env["CC"] = ["gcc"]
+        child = env.derive()
+        child["CFLAGS"] = ["-O2"]
+        filename = os.path.join(self.d, "default.env.py")
+        child.store(filename)
+
+        loaded = Environment()
+        loaded.load(filename)
+        self.assertEqual(loaded, {"CC": ["gcc"], "CFLAGS": ["-O2"]})
+
+class TaskSignatureTest(TmpContextBase):
+    def test_shared_env(self):
+        src_root, bld_root = create_top_nodes(self.d,
+                os.path.join(self.d, "build"))
+        env = Environment()
+        env["CFLAGS"] = ["-O2"]
+        def func(task):
+            pass
+        tasks = []
+        for name in ["a", "b"]:
+            source = src_root.make_node(name + ".c")
+            source.write(name)
+            tasks.append(task_factory("cc")(inputs=[source],
+                    outputs=[bld_root.make_node(name + ".o")], func=func,
+                    env=env, env_vars=["CFLAGS"]))
+        sigs = [t.signature() for t in tasks]
+        self.assertNotEqual(sigs[0], sigs[1])
+
+        env.append("CFLAGS", "-g")
+        for t in tasks:
+            t.cache = None
+        self.assertNotEqual(tasks[0].signature(), sigs[0])
+        self.assertNotEqual(tasks[1].signature(), sigs[1])
@@ -0,0 +1,75 @@
+import os
+
+from yaku.tests.test_helpers \
+    import \
+        TmpContextBase
+from yaku.hash_cache \
+    import \
+        FileHashCache, hash_file
+import yaku.hash_cache
+
+class FileHashCacheTest(TmpContextBase):
+    def setUp(self):
+        super(FileHashCacheTest, self).setUp()
+        self.filename = os.path.join(self.d, "foo.h")
+        self._write("int foo(void);\n")
+        # Make the file old enough to be stored
+        os.utime(self.filename, (1000000000, 1000000000))
+
+        self.nhashed = 0
+        self._hash_file = yaku.hash_cache.hash_file
+        def _counting_hash_file(filename):
+            self.nhashed += 1
+            return self._hash_file(filename)
+        yaku.hash_cache.hash_file = _counting_hash_file
+
+    def tearDown(self):
+        yaku.hash_cache.hash_file = self._hash_file
+        super(FileHashCacheTest, self).tearDown()
+
+    def _write(self, content):
+        fid = open(self.filename, "w")
+        try:
+            fid.write(content)
+        finally:
+            fid.close()
+
+    def test_hash_once(self):
+        cache = FileHashCache()
+        digest = cache.get(self.filename)
+        self.assertEqual(digest, hash_file(self.filename))
+        for i in range(10):
+            cache.get(self.filename)
+        self.assertEqual(self.nhashed, 1)
+
+    def test_persistent(self):
+        cache = FileHashCache()
+        digest = cache.get(self.filename)
+        cache.store(os.path.join(self.d, "hashes.pck"))
+
+        cache = FileHashCache()
+        cache.load(os.path.join(self.d, "hashes.pck"))
+        self.assertEqual(cache.get(self.filename), digest)
+        self.assertEqual(self.nhashed, 1)
+
+    def test_modified(self):
+        cache = FileHashCache()
+        digest = cache.get(self.filename)
+        self._write("int foo(int);\n")
+        os.utime(self.filename, (1000000010, 1000000010))
+
+        cache.invalidate(self.filename)
+        self.assertNotEqual(cache.get(self.filename), digest)
+        self.assertEqual(self.nhashed, 2)
+
+    def test_update_recent(self):
+        # A file just written by a task is stored despite its recent mtime
+        self._write("int foo(int);\n")
+        cache = FileHashCache()
+        digest = cache.update(self.filename)
+        cache.store(os.path.join(self.d, "hashes.pck"))
+
+        cache = FileHashCache()
+        cache.load(os.path.join(self.d, "hashes.pck"))
+        self.assertEqual(cache.get(self.filename), digest)
+        self.assertEqual(self.nhashed, 1)
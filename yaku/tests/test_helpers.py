@@ -12,3 +12,23 @@ class TmpContextBase(TestCase):
     def tearDown(self):
         shutil.rmtree(self.d)
         os.chdir(self.cwd)
+
+class FakeContext(object):
+    """Build context of tasks run directly by a runner."""
+    def __init__(self):
+        self.cache = {}
+        self.peak_rss = {}
+
+class FakeBuildContext(object):
+    def __init__(self, bld_root):
+        self.bld_root = bld_root
+
+    def set_cmd_cache(self, task, cmd):
+        pass
+
+    def set_stdout_cache(self, task, stdout):
+        pass
+
+class FakeTaskGen(object):
+    def __init__(self, bld):
+        self.bld = bld
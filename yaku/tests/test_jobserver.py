@@ -0,0 +1,110 @@
+import os
+import time
+import threading
+
+from yaku.tests.test_helpers \
+    import \
+        TmpContextBase, FakeContext
+from yaku.context \
+    import \
+        create_top_nodes
+from yaku.task \
+    import \
+        task_factory
+from yaku.scheduler \
+    import \
+        run_tasks_parallel
+import yaku.jobserver
+
+_lock = threading.Lock()
+_running = [0, 0]
+
+def counting_func(task):
+    # Track the maximum number of tasks running at the same time
+    _lock.acquire()
+    try:
+        _running[0] += 1
+        _running[1] = max(_running)
+    finally:
+        _lock.release()
+    time.sleep(0.05)
+    _lock.acquire()
+    try:
+        _running[0] -= 1
+    finally:
+        _lock.release()
+    task.outputs[0].write("")
+
+class JobServerTest(TmpContextBase):
+    def setUp(self):
+        super(JobServerTest, self).setUp()
+        self.makeflags = os.environ.get("MAKEFLAGS", None)
+        self.fds = os.pipe()
+
+    def tearDown(self):
+        if self.makeflags is None:
+            os.environ.pop("MAKEFLAGS", None)
+        else:
+            os.environ["MAKEFLAGS"] = self.makeflags
+        for fd in self.fds:
+            os.close(fd)
+        super(JobServerTest, self).tearDown()
+
+    def test_from_environ(self):
+        r, w = self.fds
+        jobserver = yaku.jobserver.from_environ(
+                {"MAKEFLAGS": " -j4 --jobserver-auth=%d,%d" % (r, w)})
+        self.assertEqual(jobserver.fds(), (r, w))
+        self.assertEqual(yaku.jobserver.from_environ({"MAKEFLAGS": "-k"}),
+                         None)
+
+    def test_closed_fds(self):
+        # make did not pass the pipe (command not marked recursive)
+        r, w = os.pipe()
+        os.close(r)
+        os.close(w)
+        self.assertEqual(yaku.jobserver.from_environ(
+                {"MAKEFLAGS": "-j4 --jobserver-auth=%d,%d" % (r, w)}), None)
+
+    def test_tokens(self):
+        jobserver = yaku.jobserver.create(2)
+        try:
+            # The implicit slot, then the one token of the pipe
+            implicit = jobserver.acquire()
+            token = jobserver.acquire()
+            self.assertEqual(token, b"+")
+            jobserver.release(token)
+            jobserver.release(implicit)
+            self.assertEqual(jobserver.acquire(), None)
+        finally:
+            jobserver.close()
+
+    def test_try_acquire(self):
+        jobserver = yaku.jobserver.create(2)
+        try:
+            self.assertEqual(jobserver.try_acquire(), (True, None))
+            self.assertEqual(jobserver.try_acquire(), (True, b"+"))
+            # No slot left
+            self.assertEqual(jobserver.try_acquire(), (False, None))
+            jobserver.release(b"+")
+            self.assertEqual(jobserver.try_acquire(), (True, b"+"))
+        finally:
+            jobserver.close()
+
+    def test_inherited_limit(self):
+        # make gave us no token besides the implicit one: tasks run one at
+        # a time, whatever maxjobs is
+        r, w = self.fds
+        os.environ["MAKEFLAGS"] = "-j --jobserver-auth=%d,%d" % (r, w)
+        src_root, bld_root = create_top_nodes(self.d,
+                os.path.join(self.d, "build"))
+        tasks = []
+        for i in range(4):
+            source = src_root.make_node("foo%d" % i)
+            source.write("")
+            tasks.append(task_factory("count")(inputs=[source],
+                    outputs=[bld_root.make_node("foo%d" % i)],
+                    func=counting_func, env={}, env_vars=[]))
+        _running[:] = [0, 0]
+        run_tasks_parallel(FakeContext(), tasks, 4)
+        self.assertEqual(_running[1], 1)
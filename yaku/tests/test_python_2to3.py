@@ -0,0 +1,98 @@
+import os
+import unittest
+
+from yaku.tests.test_helpers \
+    import \
+        TmpContextBase, FakeContext
+from yaku.context \
+    import \
+        create_top_nodes
+from yaku.task \
+    import \
+        micro_task_factory
+from yaku.scheduler \
+    import \
+        run_tasks, run_tasks_parallel
+from yaku.tools.python_2to3 \
+    import \
+        Py3kConverter, convert_func, parse_flags
+
+try:
+    import lib2to3
+except ImportError:
+    lib2to3 = None
+
+class Py3kConverterTest(TmpContextBase):
+    def setUp(self):
+        super(Py3kConverterTest, self).setUp()
+        self.src_root, self.bld_root = create_top_nodes(self.d,
+                os.path.join(self.d, "build"))
+        self.top = self.src_root.make_node("py2")
+        self.out = self.bld_root.make_node("py3k")
+        self.sources = {
+            "foo/a.py": "print 'a'\n",
+            "foo/setup.py": "print 'setup'\n",
+            "foo/b.py": "d = {}\nif d.has_key(1): pass\n",
+            "foo/skipped.py": "print 'skipped'\n",
+        }
+        for name, content in self.sources.items():
+            node = self.top.make_node(name)
+            node.parent.mkdir()
+            node.write(content)
+
+    def _run(self, env, njobs=1):
+        converter = Py3kConverter(self.top,
+                self.bld_root.make_node("_py3k_cache"), njobs)
+        parts = []
+        for name in sorted(self.sources):
+            parts.append((self.top.find_node(name), self.out.make_node(name)))
+        task = micro_task_factory("2to3")(parts, func=convert_func, env=env,
+                                          env_vars=[])
+        task.converter = converter
+        task.parts_func = converter.convert_parts
+        if njobs > 1:
+            run_tasks_parallel(FakeContext(), [task], njobs)
+        else:
+            run_tasks(FakeContext(), [task])
+        return converter
+
+    def _read(self, name):
+        return self.out.find_node(name).read()
+
+    def test_parse_flags(self):
+        self.assertEqual(parse_flags("-x import --nofix=print"),
+                         ("import", "print"))
+        self.assertRaises(ValueError, parse_flags, "-j 4")
+
+    if lib2to3 is not None:
+        def test_convert(self):
+            env = {"2TO3_EXTRA_FLAGS": {"*/setup.py": "-x print",
+                                        "foo/skipped.py": "skip"}}
+            self._run(env)
+            self.assertEqual(self._read("foo/a.py"), "print('a')\n")
+            self.assertEqual(self._read("foo/b.py"),
+                             "d = {}\nif 1 in d: pass\n")
+            self.assertEqual(self._read("foo/setup.py"), "print 'setup'\n")
+            self.assertEqual(self._read("foo/skipped.py"), "print 'skipped'\n")
+
+        def test_pool(self):
+            # The pool only lives for the conversion
+            converter = self._run({}, 2)
+            self.assertEqual(converter.executor, None)
+            self.assertEqual(self._read("foo/a.py"), "print('a')\n")
+            self.assertEqual(self._read("foo/setup.py"), "print('setup')\n")
+
+        def test_cache(self):
+            self._run({})
+            cache = self.bld_root.find_node("_py3k_cache").abspath()
+            self.assertEqual(len(os.listdir(cache)), 4)
+
+            # Cached conversions are used as is
+            for entry in os.listdir(cache):
+                fid = open(os.path.join(cache, entry), "w")
+                try:
+                    fid.write("cached\n")
+                finally:
+                    fid.close()
+            self._run({})
+            self.assertEqual(self._read("foo/a.py"), "cached\n")
@@ -0,0 +1,90 @@
+import os
+import socket
+import threading
+
+from yaku.tests.test_helpers \
+    import \
+        TmpContextBase
+from yaku.context \
+    import \
+        create_top_nodes
+from yaku.task \
+    import \
+        task_factory
+from yaku.artifact_cache \
+    import \
+        ArtifactCache
+from yaku.remote_cache \
+    import \
+        RemoteCache, CacheServer, pack, unpack
+
+def copy_func(task):
+    task.outputs[0].write(task.inputs[0].read())
+
+class PackTest(TmpContextBase):
+    def test_roundtrip(self):
+        members = [("0", b"\0\1\2"), ("stdout", b""), ("deps", b"abc")]
+        self.assertEqual(unpack(pack(members)), members)
+
+    def test_truncated(self):
+        blob = pack([("0", b"foo")])
+        self.assertRaises(ValueError, lambda: unpack(blob[:-1]))
+
+class RemoteCacheTest(TmpContextBase):
+    def setUp(self):
+        super(RemoteCacheTest, self).setUp()
+        self.server = CacheServer(os.path.join(self.d, "server"))
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+        self.src_root, self.bld_root = create_top_nodes(self.d,
+                os.path.join(self.d, "build"))
+        self.source = self.src_root.make_node("foo.c")
+        self.source.write("int foo;")
+        self.target = self.bld_root.make_node("foo.o")
+        self.task = task_factory("copy")(inputs=[self.source],
+                outputs=[self.target], func=copy_func, env={}, env_vars=[])
+        self.cmd = ["cp", self.source.abspath(), self.target.abspath()]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        super(RemoteCacheTest, self).tearDown()
+
+    def _cache(self, name, url=None):
+        if url is None:
+            url = self.server.url()
+        return ArtifactCache(os.path.join(self.d, name),
+                             remote=RemoteCache(url, timeout=1))
+
+    def test_shared(self):
+        # Two machines with their own local cache, sharing the remote one
+        first = self._cache("first")
+        self.task.run()
+        first.store(self.task, self.cmd, "copied")
+        first.flush()
+        os.remove(self.target.abspath())
+
+        second = self._cache("second")
+        self.assertEqual(second.restore(self.task, self.cmd), "copied")
+        self.assertEqual(self.target.read(), "int foo;")
+
+    def test_miss(self):
+        cache = self._cache("first")
+        self.assertEqual(cache.restore(self.task, self.cmd), None)
+        self.assertEqual(cache.remote.failures, 0)
+
+    def test_unreachable(self):
+        s = socket.socket()
+        s.bind(("localhost", 0))
+        url = "http://localhost:%d" % s.getsockname()[1]
+        s.close()
+
+        cache = self._cache("first", url)
+        for i in range(5):
+            self.assertEqual(cache.restore(self.task, self.cmd), None)
+        self.assertFalse(cache.remote.enabled())
+        self.task.run()
+        cache.store(self.task, self.cmd, "copied")
+        cache.flush()
@@ -0,0 +1,239 @@
+import os
+import sys
+import time
+
+from yaku.tests.test_helpers \
+    import \
+        TmpContextBase, FakeContext, FakeBuildContext, FakeTaskGen
+from yaku.context \
+    import \
+        create_top_nodes
+from yaku.task \
+    import \
+        task_factory, micro_task_factory
+from yaku.scheduler \
+    import \
+        run_tasks, run_tasks_parallel
+import yaku.errors
+
+def copy_func(task):
+    task.outputs[0].write(task.inputs[0].read())
+
+def pid_func(task):
+    task.outputs[0].write("%s %d" % (task.inputs[0].read(), os.getpid()))
+
+def sleep_func(task):
+    time.sleep(0.2)
+    copy_func(task)
+
+def sleep_command_func(task):
+    task.exec_command(["sleep", "30"], cwd=None)
+
+def fail_func(task):
+    raise yaku.errors.TaskRunFailure(["fail"], "failed on purpose")
+
+class SchedulerTest(TmpContextBase):
+    def setUp(self):
+        super(SchedulerTest, self).setUp()
+        self.src_root, self.bld_root = create_top_nodes(self.d,
+                os.path.join(self.d, "build"))
+        self.ctx = FakeContext()
+
+    def _copy_chain(self, name, n):
+        # name.0 -> name.1 -> ... -> name.n
+        source = self.src_root.make_node("%s.0" % name)
+        source.write(name)
+        tasks = []
+        for i in range(1, n + 1):
+            target = self.bld_root.make_node("%s.%d" % (name, i))
+            task = task_factory("copy")(inputs=[source], outputs=[target],
+                                        func=copy_func, env={}, env_vars=[])
+            tasks.append(task)
+            source = target
+        return tasks
+
+    def test_serial(self):
+        tasks = self._copy_chain("foo", 3)
+        run_tasks(self.ctx, tasks)
+        self.assertEqual(tasks[-1].outputs[0].read(), "foo")
+        self.assertEqual(len(self.ctx.cache), 3)
+
+    def test_early_cutoff(self):
+        # foo.0 -> foo.1 (first line only) -> foo.2
+        def head_func(task):
+            task.outputs[0].write(task.inputs[0].read().splitlines()[0])
+        tasks = self._copy_chain("foo", 2)
+        tasks[0].func = head_func
+        run_tasks(self.ctx, tasks)
+
+        # foo.1 is regenerated identically: foo.2 is up to date, and is not
+        # written again
+        tasks[1].outputs[0].write("untouched")
+        source = tasks[0].inputs[0]
+        source.write("foo\nbar")
+        source.ctx.hash_cache.invalidate(source.abspath())
+        tasks[0].cache = tasks[1].cache = None
+        run_tasks(self.ctx, tasks)
+        self.assertEqual(tasks[1].outputs[0].read(), "untouched")
+
+    def test_parallel(self):
+        tasks = self._copy_chain("foo", 5) + self._copy_chain("bar", 2)
+        run_tasks_parallel(self.ctx, tasks, 4)
+        self.assertEqual(tasks[4].outputs[0].read(), "foo")
+        self.assertEqual(tasks[-1].outputs[0].read(), "bar")
+        self.assertEqual(len(self.ctx.cache), 7)
+
+    def test_process_pool(self):
+        tasks = self._copy_chain("foo", 2) + self._copy_chain("bar", 1)
+        for t in tasks:
+            t.func = pid_func
+            t.process_safe = True
+        run_tasks_parallel(self.ctx, tasks, 2)
+        content, pid = tasks[-1].outputs[0].read().split()
+        self.assertEqual(content, "bar")
+        self.assertNotEqual(int(pid), os.getpid())
+        self.assertEqual(tasks[1].outputs[0].read().split()[0], "foo")
+
+    def test_process_pool_failure(self):
+        tasks = self._copy_chain("foo", 2)
+        for t in tasks:
+            t.process_safe = True
+        tasks[0].func = fail_func
+        self.assertRaises(yaku.errors.TaskRunFailure,
+                          run_tasks_parallel, self.ctx, tasks, 2)
+        self.assertFalse(os.path.exists(tasks[1].outputs[0].abspath()))
+
+    def _run_async(self, tasks, maxjobs):
+        import asyncio
+        from yaku.scheduler import run_tasks_async
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(run_tasks_async(self.ctx, tasks, maxjobs))
+        finally:
+            loop.close()
+
+    def test_async(self):
+        if sys.version_info < (3, 5):
+            return
+        tasks = self._copy_chain("foo", 3) + self._copy_chain("bar", 2)
+        self._run_async(tasks, 2)
+        self.assertEqual(tasks[2].outputs[0].read(), "foo")
+        self.assertEqual(tasks[-1].outputs[0].read(), "bar")
+        self.assertEqual(len(self.ctx.cache), 5)
+
+    def test_async_failure(self):
+        if sys.version_info < (3, 5):
+            return
+        tasks = self._copy_chain("foo", 2)
+        tasks[0].func = fail_func
+        self.assertRaises(yaku.errors.TaskRunFailure,
+                          self._run_async, tasks, 2)
+        self.assertFalse(os.path.exists(tasks[1].outputs[0].abspath()))
+
+    def test_idle_cpu(self):
+        # The runner must sleep while waiting for tasks
+        if not hasattr(time, "process_time"):
+            return
+        tasks = []
+        for i in range(4):
+            tasks.extend(self._copy_chain("foo%d" % i, 2))
+        for t in tasks:
+            t.func = sleep_func
+        start = time.process_time()
+        run_tasks_parallel(self.ctx, tasks, 4)
+        self.assertTrue(time.process_time() - start < 0.2)
+        self.assertEqual(tasks[-1].outputs[0].read(), "foo3")
+
+    def test_terminate_on_failure(self):
+        tasks = self._copy_chain("foo", 1) + self._copy_chain("bar", 1)
+        tasks[0].func = sleep_command_func
+        tasks[0].gen = FakeTaskGen(FakeBuildContext(self.bld_root))
+        tasks[0].env = {"VERBOSE": False}
+        tasks[0].disable_output = True
+        tasks[0].log = sys.stderr
+        tasks[1].func = fail_func
+
+        start = time.time()
+        self.assertRaises(yaku.errors.TaskRunFailure,
+                          run_tasks_parallel, self.ctx, tasks, 2)
+        self.assertTrue(time.time() - start < 10)
+
+    def test_async_cancel_queued(self):
+        if sys.version_info < (3, 5):
+            return
+        tasks = self._copy_chain("foo", 1)
+        for name in ["bar", "fubar", "baz"]:
+            tasks.extend(self._copy_chain(name, 1))
+        tasks[0].func = fail_func
+        self.assertRaises(yaku.errors.TaskRunFailure,
+                          self._run_async, tasks, 1)
+        for t in tasks[1:]:
+            self.assertFalse(os.path.exists(t.outputs[0].abspath()))
+
+    def test_parallel_failure(self):
+        tasks = self._copy_chain("foo", 2)
+        tasks[0].func = fail_func
+        self.assertRaises(yaku.errors.TaskRunFailure,
+                          run_tasks_parallel, self.ctx, tasks, 2)
+        self.assertFalse(os.path.exists(tasks[1].outputs[0].abspath()))
+
+    def _keep_going(self, run):
+        # foo.1 fails: foo.2 is skipped, bar is built anyway
+        tasks = self._copy_chain("foo", 2) + self._copy_chain("bar", 2)
+        tasks[0].func = fail_func
+        try:
+            run(tasks)
+            self.fail("TaskRunFailures not raised")
+        except yaku.errors.TaskRunFailures:
+            e = sys.exc_info()[1]
+            self.assertEqual(e.failures, [(["fail"], "failed on purpose")])
+            self.assertEqual(e.skipped, 1)
+        self.assertFalse(os.path.exists(tasks[1].outputs[0].abspath()))
+        self.assertEqual(tasks[-1].outputs[0].read(), "bar")
+        self.assertEqual(len(self.ctx.cache), 2)
+
+    def test_keep_going(self):
+        self._keep_going(lambda tasks: run_tasks(self.ctx, tasks,
+                                                 keep_going=True))
+
+    def test_parallel_keep_going(self):
+        self._keep_going(lambda tasks: run_tasks_parallel(self.ctx, tasks, 2,
+                                                          keep_going=True))
+
+    def test_micro_task(self):
+        parts = []
+        for name in ["foo", "bar", "fubar"]:
+            source = self.src_root.make_node(name)
+            source.write(name)
+            parts.append((source, self.bld_root.make_node(name)))
+        task = micro_task_factory("copy")(parts, func=copy_func, env={},
+                                          env_vars=[])
+        task.disable_output = True
+        run_tasks(self.ctx, [task])
+        self.assertEqual(parts[2][1].read(), "fubar")
+
+        # Only the part whose input changed is run again
+        for source, target in parts:
+            target.write("untouched")
+        source = parts[2][0]
+        source.write("baz")
+        source.ctx.hash_cache.invalidate(source.abspath())
+        run_tasks(self.ctx, [task])
+        self.assertEqual(parts[0][1].read(), "untouched")
+        self.assertEqual(parts[2][1].read(), "baz")
+
+    def test_micro_task_process_pool(self):
+        parts = []
+        for name in ["foo", "bar", "fubar"]:
+            source = self.src_root.make_node(name)
+            source.write(name)
+            parts.append((source, self.bld_root.make_node(name)))
+        task = micro_task_factory("copy")(parts, func=pid_func, env={},
+                                          env_vars=[])
+        task.disable_output = True
+        task.process_safe = True
+        run_tasks_parallel(self.ctx, [task], 2)
+        for source, target in parts:
+            content, pid = target.read().split()
+            self.assertEqual(content, source.name)
+            self.assertNotEqual(int(pid), os.getpid())
@@ -0,0 +1,99 @@
+import os
+
+from yaku.tests.test_helpers \
+    import \
+        TmpContextBase
+from yaku.context \
+    import \
+        create_top_nodes
+from yaku.task \
+    import \
+        task_factory
+from yaku.task_manager \
+    import \
+        TaskManager, build_dag, topo_sort
+from yaku.errors \
+    import \
+        CyclicDependency
+from yaku.utils \
+    import \
+        get_exception
+
+class TaskManagerTest(TmpContextBase):
+    def setUp(self):
+        super(TaskManagerTest, self).setUp()
+        self.src_root, self.bld_root = create_top_nodes(self.d,
+                os.path.join(self.d, "build"))
+
+    def _task(self, name, inputs, outputs):
+        return task_factory(name)(
+                inputs=[self.bld_root.make_node(i) for i in inputs],
+                outputs=[self.bld_root.make_node(o) for o in outputs])
+
+    def test_independent_chains(self):
+        # Same suffixes, but no file in common: everything but the second
+        # step of each chain can run right away
+        t1 = self._task("cc", ["a.c"], ["a.o"])
+        t2 = self._task("cc", ["b.c"], ["b.o"])
+        t3 = self._task("link", ["a.o"], ["a.so"])
+        t4 = self._task("link", ["b.o"], ["b.so"])
+        manager = TaskManager([t1, t2, t3, t4])
+
+        self.assertEqual(set(manager.ready_tasks()), set([t1, t2]))
+        self.assertEqual(manager.task_done(t2), [t4])
+        self.assertEqual(manager.task_done(t1), [t3])
+
+    def test_critical_path(self):
+        # small.o is slower to compile than big.o, but big.so takes longer
+        # to link: big.c is on the critical path
+        t1 = self._task("cc", ["small.c"], ["small.o"])
+        t2 = self._task("cc", ["big.c"], ["big.o"])
+        t3 = self._task("link", ["big.o"], ["big.so"])
+        durations = {t1.get_uid(): 2.0, t2.get_uid(): 1.0,
+                     t3.get_uid(): 5.0}
+        manager = TaskManager([t1, t2, t3], durations)
+
+        self.assertEqual(manager.ready_tasks(), [t2, t1])
+        self.assertEqual(manager.priority(t2), 6.0)
+
+    def test_unknown_duration(self):
+        # Without history, the largest input is assumed to be the slowest
+        self.bld_root.make_node("a.c").write("x" * 10)
+        self.bld_root.make_node("b.c").write("x" * 1000)
+        t1 = self._task("cc", ["a.c"], ["a.o"])
+        t2 = self._task("cc", ["b.c"], ["b.o"])
+        manager = TaskManager([t1, t2], {})
+
+        self.assertEqual(manager.ready_tasks(), [t2, t1])
+
+    def test_class_order(self):
+        copy_tf = task_factory("test_copy")
+        convert_tf = task_factory("test_convert")
+        convert_tf.before.append(copy_tf.__name__)
+
+        t1 = self._task("test_copy", ["a.py"], ["tmp/a.py"])
+        t2 = self._task("test_convert", ["tmp/a.py"], ["py3k/a.py"])
+        t3 = self._task("test_copy", ["b.py"], ["tmp/b.py"])
+        manager = TaskManager([t1, t2, t3])
+
+        self.assertEqual(set(manager.next_set()), set([t1, t3]))
+        self.assertEqual(manager.next_set(), [t2])
+        self.assertEqual(manager.next_set(), [])
+
+    def test_cycle(self):
+        t1 = self._task("cc", ["a"], ["b"])
+        t2 = self._task("cc", ["b"], ["c"])
+        t3 = self._task("cc", ["c"], ["a"])
+        t4 = self._task("cc", ["a"], ["d"])
+        try:
+            TaskManager([t1, t2, t3, t4])
+            self.fail("cycle not detected")
+        except CyclicDependency:
+            e = get_exception()
+            self.assertEqual(set(e.cycle), set([t1, t2, t3]))
+
+    def test_topo_sort_cycle(self):
+        t1 = self._task("cc", ["a"], ["b"])
+        t2 = self._task("cc", ["b"], ["a"])
+        task_deps, output_to_tuid = build_dag([t1, t2])
+        self.assertRaises(CyclicDependency, topo_sort, task_deps)
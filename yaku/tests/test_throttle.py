@@ -0,0 +1,125 @@
+import os
+import sys
+import time
+import subprocess
+import threading
+
+from yaku.tests.test_helpers \
+    import \
+        TmpContextBase, FakeContext
+from yaku.context \
+    import \
+        create_top_nodes
+from yaku.task \
+    import \
+        task_factory
+from yaku.scheduler \
+    import \
+        run_tasks_parallel
+from yaku.throttle \
+    import \
+        Throttle, wait_process
+import yaku.throttle
+import yaku.errors
+
+class ThrottleTest(TmpContextBase):
+    def setUp(self):
+        super(ThrottleTest, self).setUp()
+        self.src_root, self.bld_root = create_top_nodes(self.d,
+                os.path.join(self.d, "build"))
+        self._available_memory = yaku.throttle.available_memory
+        self._load_average = yaku.throttle.load_average
+        yaku.throttle.load_average = lambda: 0.0
+
+    def tearDown(self):
+        yaku.throttle.available_memory = self._available_memory
+        yaku.throttle.load_average = self._load_average
+        super(ThrottleTest, self).tearDown()
+
+    def _tasks(self, name, n, func=None):
+        tasks = []
+        for i in range(n):
+            source = self.src_root.make_node("%s%d.in" % (name, i))
+            source.write(name)
+            target = self.bld_root.make_node("%s%d.out" % (name, i))
+            tasks.append(task_factory(name)(inputs=[source],
+                    outputs=[target], func=func, env={}, env_vars=[]))
+        return tasks
+
+    def test_class_limit(self):
+        state = {"running": 0, "max": 0}
+        lock = threading.Lock()
+        def link_func(task):
+            lock.acquire()
+            state["running"] += 1
+            state["max"] = max(state["max"], state["running"])
+            lock.release()
+            time.sleep(0.1)
+            lock.acquire()
+            state["running"] -= 1
+            lock.release()
+            task.outputs[0].write("linked")
+
+        tasks = self._tasks("pylink", 4, link_func)
+        run_tasks_parallel(FakeContext(), tasks, 4,
+                           Throttle({"pylink": 1}))
+        self.assertEqual(state["max"], 1)
+        for t in tasks:
+            self.assertEqual(t.outputs[0].read(), "linked")
+
+    def test_keep_going(self):
+        # The tasks held by the throttle are run after the failure of the
+        # only running one
+        def func(task):
+            if task.inputs[0].name == "thr0.in":
+                raise yaku.errors.TaskRunFailure(["fail"], "failed on purpose")
+            task.outputs[0].write("done")
+
+        tasks = self._tasks("thr", 4, func)
+        try:
+            run_tasks_parallel(FakeContext(), tasks, 4, Throttle({"thr": 1}),
+                               keep_going=True)
+            self.fail("TaskRunFailures not raised")
+        except yaku.errors.TaskRunFailures:
+            e = sys.exc_info()[1]
+            self.assertEqual(len(e.failures), 1)
+            self.assertEqual(e.skipped, 0)
+        for t in tasks[1:]:
+            self.assertEqual(t.outputs[0].read(), "done")
+
+    def test_memory(self):
+        # 3 tasks expected to use 1 GB each, with 2.5 GB available
+        throttle = Throttle()
+        tasks = self._tasks("cxx", 3)
+        for t in tasks:
+            throttle.peak_rss[t.get_uid()] = 2 ** 30
+        yaku.throttle.available_memory = lambda: int(2.5 * 2 ** 30)
+
+        self.assertTrue(throttle.admit(tasks[0], set()))
+        self.assertTrue(throttle.admit(tasks[1], set(tasks[:1])))
+        self.assertFalse(throttle.admit(tasks[2], set(tasks[:2])))
+
+    def test_class_rss(self):
+        # Tasks never run before are expected to use as much memory as the
+        # largest task of their class
+        throttle = Throttle()
+        tasks = self._tasks("cxx", 2)
+        tasks[0].peak_rss = 2 ** 30
+        throttle.task_done(tasks[0])
+        self.assertEqual(throttle.expected_rss(tasks[1]), 2 ** 30)
+
+    def test_load(self):
+        throttle = Throttle(max_load=4)
+        tasks = self._tasks("cc", 2)
+        yaku.throttle.load_average = lambda: 6.0
+        self.assertTrue(throttle.admit(tasks[0], set()))
+        self.assertFalse(throttle.admit(tasks[1], set(tasks[:1])))
+
+    if hasattr(os, "wait4"):
+        def test_wait_process(self):
+            p = subprocess.Popen([sys.executable, "-c",
+                    "import sys; s = 'x' * (64 * 2 ** 20); sys.exit(3)"],
+                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            output, returncode, peak_rss = wait_process(p)
+            self.assertEqual(returncode, 3)
+            self.assertTrue(peak_rss >= 64 * 2 ** 20)
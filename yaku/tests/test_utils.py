@@ -0,0 +1,89 @@
+import os
+from unittest \
+    import \
+        TestCase
+
+from yaku.tests.test_helpers \
+    import \
+        TmpContextBase
+from yaku.utils \
+    import \
+        parse_depfile, ensure_dir, IncludeScanner, copy_file
+
+class ParseDepfileTest(TestCase):
+    def test_simple(self):
+        content = "foo.o: ../src/foo.c ../src/foo.h /usr/include/bar.h\n"
+        self.assertEqual(parse_depfile(content),
+                ["../src/foo.c", "../src/foo.h", "/usr/include/bar.h"])
+
+    def test_continuation(self):
+        content = "foo.o foo.d: foo.c \\\n  foo.h \\\n  bar.h\nfoo.h:\n"
+        self.assertEqual(parse_depfile(content), ["foo.c", "foo.h", "bar.h"])
+
+    def test_escaped(self):
+        content = "foo.o: foo\\ bar.c C:/include/foo.h foo.h foo.h\n"
+        self.assertEqual(parse_depfile(content),
+                ["foo bar.c", "C:/include/foo.h", "foo.h"])
+
+class IncludeScannerTest(TmpContextBase):
+    def _write(self, filename, content):
+        ensure_dir(filename)
+        fid = open(filename, "w")
+        try:
+            fid.write(content)
+        finally:
+            fid.close()
+
+    def test_scan(self):
+        self._write("src/foo.c", '#include "foo.h"\n#include <bar.h>\n/* #include "nope.h" */\n')
+        self._write("src/foo.h", '#include "sub/common.h"\n')
+        self._write("include/bar.h", '#include <sub/common.h>\n#include <stdio.h>\n')
+        self._write("include/sub/common.h", '#include "../bar.h"\n')
+
+        scanner = IncludeScanner()
+        deps = scanner.scan(os.path.join("src", "foo.c"), ["include"])
+        self.assertEqual(set(deps), set([os.path.join("src", "foo.h"),
+                os.path.join("include", "bar.h"),
+                os.path.join("include", "sub", "common.h")]))
+        # Results are shared between sources with the same include path
+        self.assertTrue(scanner.scan(os.path.join("src", "foo.c"), ["include"]) is deps)
+
+class CopyFileTest(TmpContextBase):
+    def setUp(self):
+        super(CopyFileTest, self).setUp()
+        self.src = os.path.join(self.d, "src.bin")
+        # Binary, not valid utf-8, and larger than one read buffer
+        fid = open(self.src, "wb")
+        try:
+            fid.write(b"\xff\x00\xfe" * 500000)
+        finally:
+            fid.close()
+        os.chmod(self.src, int("755", 8))
+        self.dst = os.path.join(self.d, "dst.bin")
+
+    def _read(self, filename):
+        fid = open(filename, "rb")
+        try:
+            return fid.read()
+        finally:
+            fid.close()
+
+    def test_copy(self):
+        copy_file(self.src, self.dst)
+        self.assertEqual(self._read(self.dst), self._read(self.src))
+        self.assertEqual(os.stat(self.dst).st_mode, os.stat(self.src).st_mode)
+        self.assertNotEqual(os.stat(self.dst).st_ino,
+                            os.stat(self.src).st_ino)
+
+    def test_overwrite(self):
+        fid = open(self.dst, "wb")
+        try:
+            fid.write(b"x" * 3000000)
+        finally:
+            fid.close()
+        copy_file(self.src, self.dst)
+        self.assertEqual(self._read(self.dst), self._read(self.src))
+
+    def test_hardlink(self):
+        copy_file(self.src, self.dst, allow_hardlinks=True)
+        self.assertEqual(self._read(self.dst), self._read(self.src))
@@ -0,0 +1,164 @@
+"""Adaptive concurrency for the parallel runner.
+
+With a fixed number of jobs, a build either wastes the machine on many small
+tasks, or runs out of memory when several big ones (C++ units, links) run at
+once. With a Throttle, the ParallelRunner starts a ready task only if:
+
+    - fewer tasks of its class than the class ceiling are running (e.g.
+      {"pylink": 1, "cc_shlink": 1}),
+    - the load average is below max_load,
+    - the available memory covers the peak RSS expected for the task on
+      top of the one expected for the running tasks.
+
+The expected peak RSS of a task is the one measured (wait4 rusage) during
+its last run, or else the largest one measured for its class during this
+build. The estimate is pessimistic, as the memory already used by the
+running tasks is counted twice. A task is always started when nothing else
+runs, so that the build makes progress whatever the limits.
+
+The load average and the available memory are read from /proc on linux.
+Checks which cannot be done on the platform are skipped.
+"""
+import os
+import sys
+import errno
+
+from yaku.utils \
+    import \
+        get_exception
+
+def load_average():
+    """Return the 1 minute load average, or None if unknown."""
+    try:
+        fid = open("/proc/loadavg")
+        try:
+            return float(fid.read().split()[0])
+        finally:
+            fid.close()
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.getloadavg()[0]
+    except (AttributeError, OSError):
+        return None
+
+def available_memory():
+    """Return the memory available for new processes in bytes, or None if
+    unknown."""
+    try:
+        fid = open("/proc/meminfo")
+    except (IOError, OSError):
+        return None
+    try:
+        for line in fid:
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) * 1024
+    finally:
+        fid.close()
+    return None
+
+def cpu_count():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
+
+def wait_process(p):
+    """Read the output of the process p (started with stdout=PIPE and no
+    stdin), and wait for it to finish.
+
+    Return (output, returncode, peak_rss), where peak_rss is the maximum
+    resident set size in bytes of the process and its descendants, or None
+    if unknown."""
+    if not hasattr(os, "wait4"):
+        output = p.communicate()[0]
+        return output, p.returncode, None
+    output = p.stdout.read()
+    p.stdout.close()
+    while True:
+        try:
+            pid, status, rusage = os.wait4(p.pid, 0)
+            break
+        except OSError:
+            e = get_exception()
+            if e.errno == errno.EINTR:
+                continue
+            # Already reaped by Popen (e.g. poll called by terminate from
+            # another thread)
+            return output, p.wait(), None
+    if os.WIFSIGNALED(status):
+        returncode = -os.WTERMSIG(status)
+    else:
+        returncode = os.WEXITSTATUS(status)
+    # Keep Popen from waiting for the process again
+    p.returncode = returncode
+    if sys.platform == "darwin":
+        peak_rss = rusage.ru_maxrss
+    else:
+        peak_rss = rusage.ru_maxrss * 1024
+    return output, returncode, peak_rss
+
+class Throttle(object):
+    """Decide whether the parallel runner may start one more task.
+
+    class_limits maps task class names to the maximum number of tasks of
+    that class running at the same time. max_load defaults to the number of
+    CPUs."""
+    def __init__(self, class_limits=None, max_load=None):
+        if class_limits is None:
+            class_limits = {}
+        self.class_limits = class_limits
+        if max_load is None:
+            max_load = cpu_count()
+        self.max_load = max_load
+
+        # task uid -> peak RSS of its last run
+        self.peak_rss = {}
+        # task class name -> largest peak RSS seen in this build
+        self._class_rss = {}
+
+    def setup(self, ctx, tasks):
+        """Load the peak RSS measured in previous builds (see task_ran)."""
+        peak_rss = getattr(ctx, "peak_rss", None)
+        if peak_rss is not None:
+            self.peak_rss = peak_rss
+
+    def expected_rss(self, task):
+        rss = self.peak_rss.get(task.get_uid(), None)
+        if rss is None:
+            rss = self._class_rss.get(task.name, 0)
+        return rss
+
+    def admit(self, task, running):
+        """Return True if task may be started while the tasks in running
+        are being run."""
+        if not running:
+            return True
+
+        limit = self.class_limits.get(task.name, None)
+        if limit is not None:
+            n = len([t for t in running if t.name == task.name])
+            if n >= limit:
+                return False
+
+        load = load_average()
+        if load is not None and load >= self.max_load:
+            return False
+
+        needed = self.expected_rss(task)
+        if needed > 0:
+            available = available_memory()
+            if available is not None:
+                for t in running:
+                    available -= self.expected_rss(t)
+                if available < needed:
+                    return False
+        return True
+
+    def task_done(self, task):
+        rss = task.peak_rss
+        if rss is not None:
+            self.peak_rss[task.get_uid()] = rss
+            if rss > self._class_rss.get(task.name, 0):
+                self._class_rss[task.name] = rss
@@ -40,7 +40,7 @@ class Builder(object):
     def __init__(self, ctx):
         self.configured = False
         self.ctx = ctx
-        self.env = copy.deepcopy(ctx.env)
+        self.env = ctx.env.derive()
 
     def to_nodes(self, filenames):
         """Convert source filenames to nodes.
@@ -85,7 +85,7 @@ def try_task_maker(conf, task_maker, name, body, headers, env=None):
     sources = [create_file(conf, code, name, ".c")]
 
     task_gen = CompiledTaskGen("conf", conf, sources, name)
-    task_gen.env.update(copy.deepcopy(conf.env))
+    task_gen.env = conf.env.derive()
     task_gen.env = _merge_env(task_gen.env, env)
     task_gen.env.prepend("LIBDIR", conf.path.declare(".").abspath())
 
@@ -115,7 +115,7 @@ def _merge_env(_env, new_env):
         ret = copy.copy(_env)
         for k, v in new_env.items():
             if k in ret and hasattr(ret[k], "extend"):
-                old = copy.copy(_env[k])
+                old = copy.copy(ret[k])
                 old.extend(v)
                 ret[k] = old
             else:
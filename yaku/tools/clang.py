@@ -6,6 +6,7 @@ def setup(ctx):
     ctx.env["CC"] = ["clang"]
     ctx.env["CC_TGT_F"] = ["-c", "-o"]
     ctx.env["CC_SRC_F"] = []
+    ctx.env["CC_DEPFILE_F"] = ["-MMD", "-MF"]
     ctx.env["CFLAGS"] = []
     ctx.env["DEFINES"] = []
     ctx.env["LINK"] = ["clang"]
@@ -12,7 +12,7 @@ from yaku.task_manager \
         extension, CompiledTaskGen, set_extension_hook
 from yaku.utils \
     import \
-        find_deps, ensure_dir
+        ensure_dir
 from yaku.compiled_fun \
     import \
         compile_fun
@@ -34,6 +34,20 @@ ccompile, cc_vars = compile_fun("cc", "${CC} ${CFLAGS} ${APP_DEFINES} ${INCPATH}
 
 shccompile, sgcc_vars = compile_fun("cc", "${CC} ${CFLAGS} ${CFLAGS_SH} ${APP_DEFINES} ${INCPATH} ${CC_TGT_F}${TGT[0].abspath()} ${CC_SRC_F}${SRC}", False)
 
+# Same as above, for compilers able to write a dependency file
+ccompile_dep, cc_dep_vars = compile_fun("cc", "${CC} ${CFLAGS} ${APP_DEFINES} ${INCPATH} ${CC_TGT_F}${TGT[0].abspath()} ${CC_SRC_F}${SRC} ${CC_DEPFILE_F}${TGT[1].abspath()}", False)
+
+shccompile_dep, sgcc_dep_vars = compile_fun("cc", "${CC} ${CFLAGS} ${CFLAGS_SH} ${APP_DEFINES} ${INCPATH} ${CC_TGT_F}${TGT[0].abspath()} ${CC_SRC_F}${SRC} ${CC_DEPFILE_F}${TGT[1].abspath()}", False)
+
+# Same as above, compiling several sources at once (see yaku.batch)
+ccompile_batch, cc_batch_vars = compile_fun("cc", "${CC} ${CFLAGS} ${APP_DEFINES} ${INCPATH} ${CC_BATCH_F} ${SRC}", False)
+
+shccompile_batch, sgcc_batch_vars = compile_fun("cc", "${CC} ${CFLAGS} ${CFLAGS_SH} ${APP_DEFINES} ${INCPATH} ${CC_BATCH_F} ${SRC}", False)
+
+ccompile_batch_dep, cc_batch_dep_vars = compile_fun("cc", "${CC} ${CFLAGS} ${APP_DEFINES} ${INCPATH} ${CC_BATCH_F} ${SRC} ${CC_BATCH_DEPFILE_F}", False)
+
+shccompile_batch_dep, sgcc_batch_dep_vars = compile_fun("cc", "${CC} ${CFLAGS} ${CFLAGS_SH} ${APP_DEFINES} ${INCPATH} ${CC_BATCH_F} ${SRC} ${CC_BATCH_DEPFILE_F}", False)
+
 ccprogram, ccprogram_vars = compile_fun("ccprogram", "${LINK} ${LINK_TGT_F}${TGT[0].abspath()} ${LINK_SRC_F}${SRC} ${APP_LIBDIR} ${APP_LIBS} ${LINKFLAGS}", False)
 
 cshlink, cshlink_vars = compile_fun("cshlib", "${SHLINK} ${APP_LIBDIR} ${APP_LIBS} ${SHLINK_TGT_F}${TGT[0].abspath()} ${SHLINK_SRC_F}${SRC} ${SHLINKFLAGS}", False)
@@ -54,8 +68,61 @@ def ccompile_task(self, node):
     task = task_factory("cc")(inputs=[node], outputs=[target], func=ccompile, env=self.env)
     task.gen = self
     task.env_vars = cc_vars
+    use_depfile(task, "CC_DEPFILE_F", ccompile_dep, cc_dep_vars)
+    use_batch(task, ccompile_batch, ccompile_batch_dep)
     return [task]
 
+def use_depfile(task, flags_var, func, func_vars):
+    """Make the compile task write a dependency file next to its object if
+    the compiler can do it (flags_var set in the task env, e.g. ["-MMD",
+    "-MF"] for gcc), and add the dependencies found by the previous run to
+    the task.
+
+    func/func_vars is the compile function to use in that case: it must pass
+    ${flags_var}${TGT[1].abspath()} to the compiler."""
+    if task.env.get(flags_var):
+        target = task.outputs[0]
+        task.depfile = target.parent.declare(target.name + ".d")
+        task.outputs.append(task.depfile)
+        task.func = func
+        task.env_vars = func_vars
+        task.implicit_deps = task.gen.bld.get_implicit_deps(task)
+    elif task.env.get("SCAN_INCLUDES", False):
+        task.implicit_deps = scan_includes(task)
+
+def use_batch(task, func, dep_func):
+    """Make the compile task batchable with other ones (see yaku.batch) if
+    the compiler can compile several sources at once (CC_BATCH_F set in the
+    task env). func is the batch compile function, and dep_func the one to
+    use for tasks writing a dependency file: they must pass
+    ${CC_BATCH_F} ${SRC}, and ${CC_BATCH_DEPFILE_F} for dep_func."""
+    if task.env.get("CC_BATCH_F"):
+        if task.depfile is not None:
+            task.batch_func = dep_func
+        else:
+            task.batch_func = func
+
+def scan_includes(task):
+    """Return the nodes of the headers included by the task source, found by
+    the include scanner of the build context.
+
+    This is used instead of dependency files for compilers which cannot
+    write them, when SCAN_INCLUDES is set in the environment. As the
+    scanning happens before any task is run, headers generated during the
+    build are not taken into account."""
+    source = task.inputs[0]
+    root = source
+    while root.parent:
+        root = root.parent
+
+    scanner = task.gen.bld.include_scanner
+    nodes = []
+    for path in scanner.scan(source.abspath(), task.gen.include_dirs):
+        node = root.find_node(path)
+        if node is not None:
+            nodes.append(node)
+    return nodes
+
 def shared_c_hook(self, node):
     tasks = shared_ccompile_task(self, node)
     self.object_tasks.extend(tasks)
@@ -69,6 +136,8 @@ def shared_ccompile_task(self, node):
     task = task_factory("shcc")(inputs=[node], outputs=[target], func=shccompile, env=self.env)
     task.gen = self
     task.env_vars = cc_vars
+    use_depfile(task, "CC_DEPFILE_F", shccompile_dep, sgcc_dep_vars)
+    use_batch(task, shccompile_batch, shccompile_batch_dep)
     return [task]
 
 def shlink_task(self, name):
@@ -122,13 +191,17 @@ def apply_cpppath(task_gen):
     srcnode = task_gen.sources[0].ctx.srcnode
 
     relcpppaths = []
+    include_dirs = [s.parent.abspath() for s in task_gen.sources]
     for p in cpppaths:
         if not os.path.isabs(p):
             node = srcnode.find_node(p)
             assert node is not None, "could not find %s" % p
             relcpppaths.append(node.bldpath())
+            include_dirs.append(node.abspath())
         else:
             relcpppaths.append(p)
+            include_dirs.append(p)
+    task_gen.include_dirs = include_dirs
     cpppaths = list(implicit_paths) + relcpppaths
     task_gen.env["INCPATH"] = [
             task_gen.env["CPPPATH_FMT"] % p
@@ -167,10 +240,8 @@ class CCBuilder(yaku.tools.Builder):
         tasks = self._compile(task_gen, name)
         self.ctx.tasks.extend(tasks)
 
-        outputs = []
-        for t in tasks:
-            outputs.extend(t.outputs)
-        return outputs
+        # Only the objects: compile tasks may also output a depfile
+        return [t.outputs[0] for t in tasks]
 
     def try_compile(self, name, body, headers=None):
         return with_conf_blddir(self.ctx, name, body,
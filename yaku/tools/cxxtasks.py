@@ -12,17 +12,19 @@ from yaku.task_manager \
         extension, CompiledTaskGen
 from yaku.utils \
     import \
-        find_deps, ensure_dir, get_exception
+        ensure_dir, get_exception
 from yaku.compiled_fun \
     import \
         compile_fun
 from yaku.tools.ctasks \
     import \
-        apply_cpppath, apply_libdir, apply_libs, apply_define
+        apply_cpppath, apply_libdir, apply_libs, apply_define, use_depfile
 import yaku.tools
 
 cxxcompile, cxx_vars = compile_fun("cxx", "${CXX} ${CXXFLAGS} ${INCPATH} ${APP_DEFINES} ${CXX_TGT_F}${TGT[0].abspath()} ${CXX_SRC_F}${SRC}", False)
 
+cxxcompile_dep, cxx_dep_vars = compile_fun("cxx", "${CXX} ${CXXFLAGS} ${INCPATH} ${APP_DEFINES} ${CXX_TGT_F}${TGT[0].abspath()} ${CXX_SRC_F}${SRC} ${CXX_DEPFILE_F}${TGT[1].abspath()}", False)
+
 cxxprogram, cxxprogram_vars = compile_fun("cxxprogram", "${CXXLINK} ${CXXLINK_TGT_F}${TGT[0].abspath()} ${CXXLINK_SRC_F}${SRC} ${APP_LIBDIR} ${APP_LIBS} ${CXXLINKFLAGS}", False)
 
 @extension('.cxx')
@@ -39,11 +41,9 @@ def cxxcompile_task(self, node):
     task = task_factory("cxx")(inputs=[node], outputs=[target])
     task.gen = self
     task.env_vars = cxx_vars
-    #print find_deps("foo.c", ["."])
-    #task.scan = lambda : find_deps(node, ["."])
-    #task.deps.extend(task.scan())
     task.env = self.env
     task.func = cxxcompile
+    use_depfile(task, "CXX_DEPFILE_F", cxxcompile_dep, cxx_dep_vars)
     return [task]
 
 def cxxprogram_task(self, name):
@@ -81,10 +81,8 @@ class CXXBuilder(yaku.tools.Builder):
             t.env = task_gen.env
         self.ctx.tasks.extend(tasks)
 
-        outputs = []
-        for t in tasks:
-            outputs.extend(t.outputs)
-        return outputs
+        # Only the objects: compile tasks may also output a depfile
+        return [t.outputs[0] for t in tasks]
 
     def program(self, name, sources, env=None):
         sources = [self.ctx.src_root.find_resource(s) for s in sources]
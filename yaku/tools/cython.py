@@ -1,5 +1,24 @@
 import os
+import re
 import sys
+import copy
+import traceback
+
+if sys.version_info[0] < 3:
+    from cStringIO \
+        import \
+            StringIO
+else:
+    from io \
+        import \
+            StringIO
+
+try:
+    from concurrent.futures \
+        import \
+            ProcessPoolExecutor
+except ImportError:
+    ProcessPoolExecutor = None
 
 from yaku.task_manager \
     import \
@@ -10,11 +29,260 @@ from yaku.task \
 from yaku.compiled_fun \
     import \
         compile_fun
+from yaku.process_pool \
+    import \
+        get_pool
 from yaku.utils \
     import \
-        ensure_dir, find_program
+        ensure_dir, find_program, get_exception, is_string, IncludeScanner
 import yaku.errors
 
+RE_CIMPORT = re.compile(r"^\s*cimport\s+(.+)$")
+RE_FROM_CIMPORT = re.compile(r"^\s*from\s+(\S+)\s+cimport\s+(.+)$")
+RE_INCLUDE = re.compile(r"""^\s*include\s+["'](.+?)["']""")
+RE_CIMPORT_PARENS = re.compile(r"cimport\s*\([^)]*\)")
+
+def _join_lines(m):
+    return m.group(0).replace("\n", " ")
+
+class CythonScanner(IncludeScanner):
+    """Find the .pxd, .pxi and include files a Cython source depends on,
+    with the same caching as IncludeScanner (files are parsed once per
+    content).
+
+    cimported modules are looked up as .pxd files (or packages with an
+    __init__.pxd) next to the cimporting file, from the root of its package,
+    then in the include path.
+    As Cython does not tell whether "from a cimport b" cimports a module,
+    a/b.pxd is a dependency if it exists."""
+    def parse(self, code):
+        ret = []
+        # One statement per line
+        code = RE_CIMPORT_PARENS.sub(_join_lines, code.replace("\\\n", " "))
+        for line in code.splitlines():
+            line = line.split("#", 1)[0]
+            m = RE_CIMPORT.match(line)
+            if m:
+                for name in m.group(1).split(","):
+                    words = name.split()
+                    if words:
+                        ret.append(("cimport", words[0]))
+                continue
+            m = RE_FROM_CIMPORT.match(line)
+            if m:
+                module = m.group(1)
+                ret.append(("cimport", module))
+                if module.endswith("."):
+                    sep = ""
+                else:
+                    sep = "."
+                for name in m.group(2).replace("(", " ").replace(")", " ") \
+                                      .split(","):
+                    words = name.split()
+                    if words and words[0] != "*":
+                        ret.append(("cimport", module + sep + words[0]))
+                continue
+            m = RE_INCLUDE.match(line)
+            if m:
+                ret.append(('"', m.group(1)))
+        return ret
+
+    def resolve(self, kind, name, includer_dir, cpppaths):
+        if kind != "cimport":
+            return IncludeScanner.resolve(self, kind, name, includer_dir,
+                                          cpppaths)
+        key = (kind, name, includer_dir, cpppaths)
+        try:
+            return self._resolved[key]
+        except KeyError:
+            pass
+
+        if name.startswith("."):
+            # Relative cimport: one dot is the package of the cimporting file
+            module = name.lstrip(".")
+            d = includer_dir
+            for i in range(len(name) - len(module) - 1):
+                d = os.path.dirname(d)
+            dirs = [d]
+        else:
+            module = name
+            dirs = [includer_dir, self._package_root(includer_dir)] \
+                   + list(cpppaths)
+
+        found = None
+        if module:
+            path = module.replace(".", os.sep)
+            for d in dirs:
+                found = self._find(d, path + ".pxd")
+                if found is None:
+                    found = self._find(os.path.join(d, path), "__init__.pxd")
+                if found is not None:
+                    break
+        self._resolved[key] = found
+        return found
+
+    def _package_root(self, dirname):
+        """Return the directory containing the top package of dirname."""
+        while True:
+            entries = self._listdir(dirname)
+            if not ("__init__.pxd" in entries or "__init__.py" in entries):
+                return dirname
+            parent = os.path.dirname(dirname)
+            if parent == dirname:
+                return dirname
+            dirname = parent
+
+def _get_scanner(bld):
+    scanner = getattr(bld, "cython_scanner", None)
+    if scanner is None:
+        hash_cache = getattr(bld, "hash_cache", None)
+        if hash_cache is not None:
+            scanner = CythonScanner(hash_cache.get)
+        else:
+            scanner = CythonScanner()
+        bld.cython_scanner = scanner
+    return scanner
+
+def scan_cython(task):
+    """Return the nodes of the files the .pyx source of task depends on: its
+    own .pxd, and the .pxd, .pxi and include files it uses, directly or
+    not. Relative CYTHON_CPPPATH entries are relative to the build
+    directory, as for the -I options of the cython command."""
+    source = task.inputs[0]
+    root = source
+    while root.parent:
+        root = root.parent
+
+    bld_root = task.gen.bld.bld_root.abspath()
+    cpppaths = [os.path.join(bld_root, p) for p in task.env["CYTHON_CPPPATH"]]
+    scanner = _get_scanner(task.gen.bld)
+
+    filenames = [source.abspath()]
+    pxd = os.path.splitext(filenames[0])[0] + ".pxd"
+    if os.path.exists(pxd):
+        filenames.append(pxd)
+    paths = filenames[1:]
+    for filename in filenames:
+        for path in scanner.scan(filename, cpppaths):
+            if not path in paths:
+                paths.append(path)
+
+    nodes = []
+    for path in paths:
+        node = root.find_node(path)
+        if node is not None:
+            nodes.append(node)
+    return nodes
+
+# .pyx files are compiled with the Cython compiler API in the "cython" pool
+# of the build (see yaku.process_pool.get_pool)
+
+# Values of the Cython.Compiler.Options globals before the first file: the
+# command line parser and the compiler set them, and they would otherwise
+# carry over to the next files compiled by the worker
+_OPTIONS = None
+_OPTIONS_TYPES = (bool, int, float, str, list, tuple, dict, set, type(None))
+
+def _init_worker(pythonpath):
+    # Done for each file, as the initializer argument of ProcessPoolExecutor
+    # needs python 3.7
+    if pythonpath:
+        for path in reversed(pythonpath.split(os.pathsep)):
+            if not path in sys.path:
+                sys.path.insert(0, path)
+
+def _reset_options():
+    global _OPTIONS
+    try:
+        from Cython.Compiler \
+            import \
+                Options
+    except ImportError:
+        return
+    if _OPTIONS is None:
+        _OPTIONS = {}
+        for k, v in vars(Options).items():
+            if not k.startswith("__") and isinstance(v, _OPTIONS_TYPES):
+                _OPTIONS[k] = copy.deepcopy(v)
+    for k, v in _OPTIONS.items():
+        setattr(Options, k, copy.deepcopy(v))
+
+def _cython_compile(args, cwd, pythonpath=None):
+    """Run the cython command line args in cwd with the compiler API.
+    Return (returncode, output), or None if the API is not available."""
+    _init_worker(pythonpath)
+    try:
+        from Cython.Compiler.Main \
+            import \
+                compile as cython_compile
+        from Cython.Compiler.CmdLine \
+            import \
+                parse_command_line
+    except ImportError:
+        return None
+
+    _reset_options()
+    output = StringIO()
+    old_cwd = os.getcwd()
+    old_stdout, old_stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = output
+    try:
+        try:
+            os.chdir(cwd)
+            options, sources = parse_command_line(args)
+            result = cython_compile(sources, options)
+            if result.num_errors > 0:
+                returncode = 1
+            else:
+                returncode = 0
+        except SystemExit:
+            # Bad command line
+            e = get_exception()
+            if isinstance(e.code, int):
+                returncode = e.code
+            else:
+                returncode = 1
+        except Exception:
+            output.write("".join(traceback.format_exception(*sys.exc_info())))
+            returncode = 1
+    finally:
+        sys.stdout, sys.stderr = old_stdout, old_stderr
+        os.chdir(old_cwd)
+    return returncode, output.getvalue().encode("utf-8")
+
+# Compiled function -> its pool_fun wrapper
+_POOL_FUNS = {}
+
+def pool_fun(fun):
+    """Return a task function running the cython command of the compiled
+    function fun in a worker of the Cython pool, instead of a new python
+    process. The command is run in a subprocess if the worker cannot import
+    the Cython compiler."""
+    try:
+        return _POOL_FUNS[fun]
+    except KeyError:
+        pass
+
+    def f(task):
+        cmd, cwd, env = task.expand_command()
+        cwd, done = task.pre_exec_command(cmd, cwd)
+        if done:
+            return
+        cython = task.env["CYTHON"]
+        if is_string(cython):
+            cython = [cython]
+        args = cmd[len(cython):]
+        pythonpath = task.env["ENV"].get("PYTHONPATH", None)
+        result = get_pool("cython").submit(_cython_compile, args, cwd,
+                                           pythonpath).result()
+        if result is None:
+            task.spawn_command(cmd, cwd, env)
+        else:
+            task.post_exec_command(cmd, result[0], result[1])
+    f.expand = fun.expand
+    _POOL_FUNS[fun] = f
+    return f
+
 @extension(".pyx")
 def cython_hook(self, node):
     self.sources.append(node.change_ext(".c"))
@@ -34,6 +302,10 @@ def cython_task(self, node):
                 self.env["CYTHON_CPPPATH"]]
     task.func = compile_fun("cython", "${CYTHON} ${SRC} -o ${TGT} ${CYTHON_INCPATH}",
                             False)[0]
+    if self.env.get("CYTHON_POOL", False) and ProcessPoolExecutor is not None:
+        task.func = pool_fun(task.func)
+    # Re-cythonize when a cimported .pxd or an included file changes
+    task.deps.extend(scan_cython(task))
     return [task]
 
 class CythonBuilder(yaku.tools.Builder):
@@ -50,6 +322,9 @@ class CythonBuilder(yaku.tools.Builder):
             raise yaku.errors.ToolNotFound()
         ctx.env["CYTHON_CPPPATH"] = []
         ctx.env["CYTHON"] = [sys.executable, "-m", "cython"]
+        # Compile in a pool of python processes if the compiler API can be
+        # imported (see pool_fun)
+        ctx.env["CYTHON_POOL"] = has_compiler_api()
         ctx.env["ENV"]["PYTHONPATH"] = os.environ["PYTHONPATH"]
 
 def detect(ctx):
@@ -58,5 +333,14 @@ def detect(ctx):
     else:
         return True
 
+def has_compiler_api():
+    try:
+        from Cython.Compiler.CmdLine \
+            import \
+                parse_command_line
+        return True
+    except ImportError:
+        return False
+
 def get_builder(ctx):
     return CythonBuilder(ctx)
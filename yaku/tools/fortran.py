@@ -1,5 +1,4 @@
 import os
-import copy
 
 from yaku.task_manager \
     import \
@@ -59,7 +58,7 @@ class FortranBuilder(yaku.tools.Builder):
         sources = [create_file(conf, code, name, ".f")]
 
         task_gen = CompiledTaskGen("conf", conf, sources, name)
-        task_gen.env.update(copy.deepcopy(conf.env))
+        task_gen.env = conf.env.derive()
 
         tasks = task_maker(task_gen, name)
         self.ctx.last_task = tasks[-1]
@@ -87,7 +86,7 @@ class FortranBuilder(yaku.tools.Builder):
                                 lambda : self._try_task_maker(self._compile, name, body))
 
     def compile(self, name, sources, env=None):
-        _env = copy.deepcopy(self.env)
+        _env = self.env.derive()
         if env is not None:
             _env.update(env)
 
@@ -122,7 +121,7 @@ class FortranBuilder(yaku.tools.Builder):
                                 lambda : self._try_task_maker(self._program, name, body))
 
     def program(self, name, sources, env=None):
-        _env = copy.deepcopy(self.env)
+        _env = self.env.derive()
         if env is not None:
             _env.update(env)
 
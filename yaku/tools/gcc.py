@@ -6,6 +6,11 @@ def setup(ctx):
     ctx.env["CC"] = ["gcc"]
     ctx.env["CC_TGT_F"] = ["-c", "-o"]
     ctx.env["CC_SRC_F"] = []
+    ctx.env["CC_DEPFILE_F"] = ["-MMD", "-MF"]
+    # Flags to compile several sources at once, objects (and dependency
+    # files) being written in the working directory (see yaku.batch)
+    ctx.env["CC_BATCH_F"] = ["-c"]
+    ctx.env["CC_BATCH_DEPFILE_F"] = ["-MMD"]
     ctx.env["CFLAGS"] = ["-Wall"]
     ctx.env["CFLAGS_SH"] = ["-fPIC"]
     ctx.env["DEFINES"] = []
@@ -6,6 +6,7 @@ def setup(ctx):
     ctx.env["CXX"] = ["g++"]
     ctx.env["CXX_TGT_F"] = ["-c", "-o"]
     ctx.env["CXX_SRC_F"] = []
+    ctx.env["CXX_DEPFILE_F"] = ["-MMD", "-MF"]
     ctx.env["CXXFLAGS"] = ["-Wall"]
     ctx.env["CXXLINK"] = ["g++"]
     ctx.env["CXXLINKFLAGS"] = []
@@ -34,7 +34,7 @@ from yaku.conftests \
         check_compiler, check_header
 from yaku.tools.ctasks \
     import \
-        apply_define
+        apply_define, use_depfile
 from yaku.scheduler \
     import \
         run_tasks
@@ -55,6 +55,10 @@ pycc, pycc_vars = compile_fun("pycc", "${PYEXT_CC} ${PYEXT_CFLAGS} ${PYEXT_INCPA
 
 pycxx, pycxx_vars = compile_fun("pycxx", "${PYEXT_CXX} ${PYEXT_CXXFLAGS} ${PYEXT_INCPATH} ${PYEXT_CXX_TGT_F}${TGT[0].abspath()} ${PYEXT_CXX_SRC_F}${SRC}", False)
 
+pycc_dep, pycc_dep_vars = compile_fun("pycc", "${PYEXT_CC} ${PYEXT_CFLAGS} ${PYEXT_INCPATH} ${PYEXT_CC_TGT_F}${TGT[0].abspath()} ${PYEXT_CC_SRC_F}${SRC} ${PYEXT_CC_DEPFILE_F}${TGT[1].abspath()}", False)
+
+pycxx_dep, pycxx_dep_vars = compile_fun("pycxx", "${PYEXT_CXX} ${PYEXT_CXXFLAGS} ${PYEXT_INCPATH} ${PYEXT_CXX_TGT_F}${TGT[0].abspath()} ${PYEXT_CXX_SRC_F}${SRC} ${PYEXT_CXX_DEPFILE_F}${TGT[1].abspath()}", False)
+
 pycxxlink, pycxxlink_vars = compile_fun("pycxxlink", "${PYEXT_CXXSHLINK} ${PYEXT_LINK_TGT_F}${TGT[0].abspath()} ${PYEXT_LINK_SRC_F}${SRC} ${PYEXT_APP_LIBDIR} ${PYEXT_APP_LIBS} ${PYEXT_APP_FRAMEWORKS} ${PYEXT_SHLINKFLAGS}", False)
 
 # pyext env <-> sysconfig env conversion
@@ -154,6 +158,7 @@ def pycc_task(self, node):
     task.env_vars = pycc_vars
     task.env = self.env
     task.func = pycc
+    use_depfile(task, "PYEXT_CC_DEPFILE_F", pycc_dep, pycc_dep_vars)
     return [task]
 
 def pycxx_hook(self, node):
@@ -172,6 +177,7 @@ def pycxx_task(self, node):
     task.env_vars = pycxx_vars
     task.env = self.env
     task.func = pycxx
+    use_depfile(task, "PYEXT_CXX_DEPFILE_F", pycxx_dep, pycxx_dep_vars)
     return [task]
 
 def pylink_task(self, name):
@@ -463,6 +469,8 @@ def _setup_compiler(ctx, cc_type):
             "LINK_SRC_F"]
     for k in copied_values:
         ctx.env["PYEXT_%s" % k] = cc_env[k]
+    # Only some compilers can write dependency files
+    ctx.env["PYEXT_CC_DEPFILE_F"] = cc_env.get("CC_DEPFILE_F", [])
     ctx.env.prextend("PYEXT_CPPPATH", cc_env["CPPPATH"])
     ctx.env.prextend("PYEXT_LIBDIR", cc_env["LIBDIR"])
 
@@ -481,6 +489,7 @@ def _setup_cxxcompiler(ctx, cxx_type):
     for k in ["CXX", "CXXFLAGS", "CXX_TGT_F", "CXX_SRC_F",
               "CXXSHLINK"]:
         ctx.env["PYEXT_%s" % k] = cxx_env[k]
+    ctx.env["PYEXT_CXX_DEPFILE_F"] = cxx_env.get("CXX_DEPFILE_F", [])
 
 # FIXME: find a way to reuse this kind of code between tools
 def apply_frameworks(task_gen):
@@ -515,13 +524,17 @@ def apply_cpppath(task_gen):
     srcnode = task_gen.sources[0].ctx.srcnode
 
     relcpppaths = []
+    include_dirs = [s.parent.abspath() for s in task_gen.sources]
     for p in cpppaths:
         if not os.path.isabs(p):
             node = srcnode.find_node(p)
             assert node is not None, "could not find %s" % p
             relcpppaths.append(node.bldpath())
+            include_dirs.append(node.abspath())
         else:
             relcpppaths.append(p)
+            include_dirs.append(p)
+    task_gen.include_dirs = include_dirs
     cpppaths = list(implicit_paths) + relcpppaths
     task_gen.env["PYEXT_INCPATH"] = [
             task_gen.env["PYEXT_CPPPATH_FMT"] % p
@@ -1,53 +1,249 @@
+"""2to3 conversion of python sources.
+
+Sources are converted with lib2to3 directly instead of one 2to3 process per
+file: the fixers are loaded once per worker process, and the files to
+convert are sent to the workers in batches. Extra flags may be given per
+source pattern in the 2TO3_EXTRA_FLAGS env variable, e.g.:
+
+    {"*/setup.py": "-x import", "foo/timer.py": "skip"}
+
+"-x fixer" disables a fixer, "skip" copies the file unconverted. Converted
+sources are cached in the build directory by content, so that a source which
+changes back and forth (branch switches) is not converted again.
+"""
 import os
 import sys
-import shutil
-import subprocess
+import fnmatch
+import traceback
 
-from cStringIO \
-    import \
-        StringIO
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
 
-import lib2to3.main
+try:
+    from concurrent.futures \
+        import \
+            ProcessPoolExecutor
+except ImportError:
+    ProcessPoolExecutor = None
 
 from yaku.errors \
     import \
         TaskRunFailure
 from yaku.task \
     import \
-        task_factory
-from yaku.task_manager \
+        micro_task_factory
+from yaku.jobserver \
     import \
-        TaskGen, extension
-from yaku.pprint \
+        get_current as get_jobserver
+from yaku.throttle \
     import \
-        pprint
+        cpu_count
+from yaku.utils \
+    import \
+        copy_file, ensure_dir, rename
 
 import yaku.tools
 
-def convert_func(self):
-    if not len(self.inputs) == 1:
-        raise ValueError("convert_func needs exactly one input")
-    source, target = self.inputs[0], self.outputs[0]
+# Disabled fixers -> RefactoringTool, in the converting process
+_TOOLS = {}
+
+def _refactoring_tool(nofix):
+    tool = _TOOLS.get(nofix, None)
+    if tool is None:
+        from lib2to3.refactor \
+            import \
+                RefactoringTool, get_fixers_from_package
+        unwanted = ["lib2to3.fixes.fix_" + f for f in nofix]
+        fixers = [f for f in get_fixers_from_package("lib2to3.fixes") \
+                  if not f in unwanted]
+        tool = _TOOLS[nofix] = RefactoringTool(sorted(fixers))
+    return tool
+
+def _convert_files(nofix, filenames):
+    """Convert the given files with all the default fixers but the ones in
+    nofix. Return the list of (output, error) for each file, output being
+    the converted content (bytes), or None if the file is unchanged."""
+    tool = _refactoring_tool(nofix)
+    ret = []
+    for filename in filenames:
+        try:
+            source, encoding = tool._read_python_source(filename)
+            # The newline silences some parse errors (see refactor_file)
+            tree = tool.refactor_string(source + "\n", filename)
+            if tree.was_changed:
+                ret.append(((u"%s" % tree)[:-1].encode(encoding), None))
+            else:
+                ret.append((None, None))
+        except Exception:
+            ret.append((None, "".join(traceback.format_exception(
+                *sys.exc_info()))))
+    return ret
+
+def parse_flags(flags):
+    """Return the fixers disabled by the given 2to3 flags."""
+    nofix = []
+    args = flags.split()
+    while args:
+        arg = args.pop(0)
+        if arg in ("-x", "--nofix") and args:
+            nofix.append(args.pop(0))
+        elif arg.startswith("--nofix="):
+            nofix.append(arg[len("--nofix="):])
+        else:
+            raise ValueError("Unsupported 2to3 flag %r" % arg)
+    return tuple(sorted(nofix))
+
+def extra_flags(patterns, path):
+    """Return the extra flags of the first pattern matching path."""
+    path = path.replace(os.sep, "/")
+    for pattern in sorted(patterns):
+        if fnmatch.fnmatch(path, pattern):
+            return patterns[pattern]
+    return ""
+
+class Py3kConverter(object):
+    """Convert sources in batches, with a pool of worker processes created
+    for each conversion.
+
+    The task running the conversion holds one job slot of the build: the
+    pool gets one more worker per free slot of the build jobserver, up to
+    njobs workers. With one job, or without concurrent.futures, sources are
+    converted in the build process."""
+    def __init__(self, top, cache_dir, njobs=None):
+        # Directory of the sources to convert (their extra flags patterns
+        # are relative to it)
+        self.top = top
+        self.cache_dir = cache_dir
+        if njobs is None:
+            njobs = cpu_count()
+        self.njobs = njobs
+        self.executor = None
 
-    pprint('GREEN', "%-16s%s" % (self.name.upper(),
-           " ".join([s.srcpath() for s in self.inputs])))
-    cmd = ["2to3", "-w", "--no-diffs", "-n", source.abspath()]
-    st = subprocess.call(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    if st != 0:
-        pprint('RED', "FAILED %-16s%s" % (self.name.upper(),
-               " ".join([s.srcpath() for s in self.inputs])))
-        raise TaskRunFailure(cmd)
-    target.write(source.read())
+    def _cache_key(self, filename, data, nofix):
+        # The import fixer looks for local modules next to the source
+        m = md5()
+        m.update(data)
+        m.update(repr((nofix, sys.version_info[:2])).encode())
+        m.update(repr(sorted(os.listdir(os.path.dirname(filename)))).encode())
+        return m.hexdigest()
+
+    def _acquire_jobs(self, njobs):
+        """Take up to njobs - 1 free slots of the build jobserver. Return
+        their tokens."""
+        tokens = []
+        jobserver = get_jobserver()
+        if jobserver is None or ProcessPoolExecutor is None:
+            return tokens
+        while len(tokens) < njobs - 1:
+            ok, token = jobserver.try_acquire()
+            if not ok:
+                break
+            tokens.append(token)
+        return tokens
+
+    def _release_jobs(self, tokens):
+        jobserver = get_jobserver()
+        for token in tokens:
+            jobserver.release(token)
+
+    def _run(self, batches, njobs):
+        if njobs < 2 or len(batches) < 2:
+            return [_convert_files(nofix, filenames) \
+                    for nofix, filenames in batches]
+        # The fixers are loaded by the first batch of each worker
+        self.executor = ProcessPoolExecutor(njobs)
+        try:
+            futures = [self.executor.submit(_convert_files, nofix,
+                                            filenames) \
+                       for nofix, filenames in batches]
+            return [f.result() for f in futures]
+        finally:
+            self.executor.shutdown()
+            self.executor = None
+
+    def convert_parts(self, parts):
+        """Convert the input of each part of a 2to3 micro task into its
+        output."""
+        env = parts[0].env
+        if "2TO3_EXTRA_FLAGS" in env:
+            patterns = env["2TO3_EXTRA_FLAGS"]
+        else:
+            patterns = {}
+        todo = {}
+        for part in parts:
+            source = part.inputs[0].abspath()
+            target = part.outputs[0].abspath()
+            ensure_dir(target)
+            flags = extra_flags(patterns, part.inputs[0].path_from(self.top))
+            if flags == "skip":
+                copy_file(source, target)
+                continue
+            nofix = parse_flags(flags)
+            fid = open(source, "rb")
+            try:
+                data = fid.read()
+            finally:
+                fid.close()
+            entry = os.path.join(self.cache_dir.abspath(),
+                                 self._cache_key(source, data, nofix))
+            if os.path.exists(entry):
+                copy_file(entry, target)
+            else:
+                todo.setdefault(nofix, []).append((source, target, entry))
+
+        count = sum([len(files) for files in todo.values()])
+        tokens = self._acquire_jobs(min(self.njobs, count))
+        try:
+            njobs = len(tokens) + 1
+            batches = []
+            for nofix in sorted(todo):
+                files = todo[nofix]
+                size = max(1, -(-len(files) // njobs))
+                for i in range(0, len(files), size):
+                    batches.append((nofix, files[i:i+size]))
+            results = self._run([(nofix, [f[0] for f in files]) \
+                                 for nofix, files in batches], njobs)
+        finally:
+            self._release_jobs(tokens)
+
+        failures = []
+        for (nofix, files), result in zip(batches, results):
+            for (source, target, entry), (output, error) in zip(files, result):
+                if error is not None:
+                    failures.append((source, error))
+                    continue
+                if output is None:
+                    copy_file(source, target)
+                else:
+                    fid = open(target, "wb")
+                    try:
+                        fid.write(output)
+                    finally:
+                        fid.close()
+                self._store(target, entry)
+        if failures:
+            raise TaskRunFailure(["2to3"] + [f[0] for f in failures],
+                                 "\n".join([f[1] for f in failures]))
+
+    def _store(self, target, entry):
+        ensure_dir(entry)
+        tmp = entry + ".tmp%d" % os.getpid()
+        copy_file(target, tmp)
+        rename(tmp, entry)
+
+def convert_func(self):
+    self.converter.convert_parts([self])
 
 def copy_func(self):
     source, target = self.inputs[0], self.outputs[0]
-    pprint('YELLOW', "%-16s%s" % (self.name.upper(),
-           " ".join([s.srcpath() for s in self.inputs])))
-    target.write(source.read())
+    copy_file(source.abspath(), target.abspath())
 
 class Py3kConverterBuilder(yaku.tools.Builder):
     def __init__(self, ctx):
         super(Py3kConverterBuilder, self).__init__(ctx)
+        self.converter = None
 
     def _process_exclude(self, env):
         if "2TO3_EXCLUDE_LIST" in env:
@@ -78,9 +274,9 @@ class Py3kConverterBuilder(yaku.tools.Builder):
         # convertion. Notes:
         # - the whole tree needs to be copied before any 2to3 execution as 2to3
         # depends on the tree structure (e.g. for local vs absolute imports)
-        # - because 2to3 can only modify files in place, we need to copy things
-        # twice to avoid re-applying 2to3 several times (2to3 is not
-        # idem-potent).
+        # - sources are converted from the copies into the py3k directory, by
+        # one micro task whose parts are converted in batches (see
+        # Py3kConverter)
         # - the exclude process is particularly ugly...
         env = yaku.tools._merge_env(self.env, env)
 
@@ -89,38 +285,42 @@ class Py3kConverterBuilder(yaku.tools.Builder):
 
         files = [self.ctx.src_root.find_resource(f) for f in sources]
 
-        convert_tf = task_factory("2to3")
-        copy_tf = task_factory("2to3_prepare")
+        convert_tf = micro_task_factory("2to3")
+        copy_tf = micro_task_factory("2to3_prepare")
         convert_tf.before.append(copy_tf.__name__)
 
         py3k_tmp = self.ctx.bld_root.declare("_py3k_tmp")
         py3k_top = self.ctx.bld_root.declare("py3k")
-        tasks = []
+        if self.converter is None:
+            self.converter = Py3kConverter(py3k_tmp,
+                    self.ctx.bld_root.declare("_py3k_cache"))
+        # Copies are all done by a single micro task, and so are conversions
+        copies = []
+        conversions = []
         for f in files:
             target = py3k_tmp.declare(f.srcpath())
-            task = copy_tf(inputs=[f], outputs=[target])
-            task.func = copy_func
-            task.env_vars = {}
-            task.env = env
-            tasks.append(task)
+            copies.append((f, target))
 
             if f.name.endswith(".py") and not flter(f):
                 source = target
                 target = py3k_top.declare(source.path_from(py3k_tmp))
-                task = convert_tf(inputs=[source], outputs=[target])
-                task.func = convert_func
-                task.env_vars = {}
-                task.env = env
-                tasks.append(task)
+                conversions.append((source, target))
             else:
                 source = f
                 target = py3k_top.declare(source.srcpath())
-                task = copy_tf(inputs=[source], outputs=[target])
-                task.func = copy_func
-                task.env_vars = {}
-                task.env = env
-                tasks.append(task)
+                copies.append((source, target))
 
+        if "2TO3_EXTRA_FLAGS" in env:
+            env_vars = ["2TO3_EXTRA_FLAGS"]
+        else:
+            env_vars = []
+        tasks = [copy_tf(copies, func=copy_func, env=env, env_vars=[])]
+        if conversions:
+            task = convert_tf(conversions, func=convert_func, env=env,
+                              env_vars=env_vars)
+            task.converter = self.converter
+            task.parts_func = self.converter.convert_parts
+            tasks.append(task)
         self.ctx.tasks.extend(tasks)
 
         outputs = []
@@ -2,7 +2,7 @@ import yaku.tools
 
 from yaku.task \
     import \
-        task_factory
+        task_factory, coalesce_tasks
 from yaku.task_manager \
     import \
         extension, TaskGen
@@ -18,6 +18,7 @@ def template_task(task_gen, node):
     out = node.change_ext("")
     target = node.parent.declare(out.name)
     task = task_factory("subst")(inputs=[node], outputs=[target], func=render)
+    task.process_safe = True
     task.env_vars = ["SUBST_DICT"]
     task.env = task_gen.env
     return [task]
@@ -28,7 +29,19 @@ class TemplateBuilder(yaku.tools.Builder):
             self.env["SUBST_DICT"]  = {}
         else:
             self.env["SUBST_DICT"]  = vars
-        return self._task_gen_factory("subst", "noname", sources, None)
+        sources = self.to_nodes(sources)
+
+        task_gen = TaskGen("subst", self.ctx, sources, "noname")
+        task_gen.env = self.env
+        tasks = task_gen.process()
+        for t in tasks:
+            t.env = task_gen.env
+        if len(tasks) > 1 and len(set([t.func for t in tasks])) == 1:
+            # Rendered by a single micro task, its parts still being spread
+            # over the process pool
+            tasks = [coalesce_tasks("subst", tasks)]
+        self.ctx.tasks.extend(tasks)
+        return tasks[0].outputs[:]
 
 def get_builder(context):
     return TemplateBuilder(context)
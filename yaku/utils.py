@@ -1,6 +1,11 @@
 import sys
 import re
 import os
+import shutil
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
 
 from yaku.compat.rename \
     import \
@@ -14,6 +19,85 @@ def ensure_dir(path):
     if dirname and not os.path.exists(dirname):
         os.makedirs(dirname)
 
+# From linux/fs.h
+FICLONE = 0x40049409
+
+def _reflink(src, dst):
+    import fcntl
+    fsrc = open(src, "rb")
+    try:
+        fdst = open(dst, "wb")
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        finally:
+            fdst.close()
+    finally:
+        fsrc.close()
+
+def _copy_data(fsrc, fdst):
+    # Let the kernel copy the data when possible, without going through
+    # python buffers
+    for name in ("copy_file_range", "sendfile"):
+        kernel_copy = getattr(os, name, None)
+        if kernel_copy is None:
+            continue
+        offset = 0
+        try:
+            while True:
+                if name == "sendfile":
+                    n = kernel_copy(fdst.fileno(), fsrc.fileno(), offset,
+                                    2 ** 30)
+                else:
+                    n = kernel_copy(fsrc.fileno(), fdst.fileno(), 2 ** 30,
+                                    offset)
+                if n == 0:
+                    return
+                offset += n
+        except OSError:
+            # Not supported between those files
+            if offset > 0:
+                raise
+    while True:
+        data = fsrc.read(2 ** 20)
+        if not data:
+            break
+        fdst.write(data)
+
+def copy_file(src, dst, allow_hardlinks=False):
+    """Make dst a copy of src, with the same permission bits, using the
+    cheapest mean available: a reflink if the filesystem supports it, a
+    hardlink if allowed, the copy_file_range or sendfile system calls,
+    and a plain copy otherwise. The content is copied as bytes.
+
+    Hardlinks are only safe when neither src nor dst is ever modified in
+    place afterwards, as the other one would be modified as well."""
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        _reflink(src, dst)
+        shutil.copymode(src, dst)
+        return
+    except (ImportError, IOError, OSError):
+        pass
+    if allow_hardlinks and hasattr(os, "link"):
+        try:
+            if os.path.exists(dst):
+                os.remove(dst)
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    fsrc = open(src, "rb")
+    try:
+        fdst = open(dst, "wb")
+        try:
+            _copy_data(fsrc, fdst)
+        finally:
+            fdst.close()
+    finally:
+        fsrc.close()
+    shutil.copymode(src, dst)
+
 re_inc = re.compile(\
     '^[ \t]*(#|%:)[ \t]*(include)[ \t]*(.*)\r*$',
     re.IGNORECASE | re.MULTILINE)
@@ -44,48 +128,165 @@ def extract_include(txt, defs):
 
     return None, None
 
-def lines_includes(filename):
-    code = open(filename).read()
+def _code_includes(code):
     #if use_trigraphs:
     #   for (a, b) in trig_def: code = code.split(a).join(b)
     code = re_nl.sub('', code)
     code = re_cpp.sub(repl, code)
     return [(m.group(2), m.group(3)) for m in re.finditer(re_inc, code)]
 
-def find_deps(node, cpppaths=["/usr/include", "."]):
-    nodes = []
-    names = []
+def lines_includes(filename):
+    return _code_includes(open(filename).read())
 
-    def _find_deps(node):
-        lst = lines_includes(node)
+class IncludeScanner(object):
+    """Find the headers included (recursively) by C/C++ sources.
 
-        for (_, line) in lst:
-            t, filename = extract_include(line, None)
-            if t is None:
-                continue
-            if filename in names:
-                continue
+    Meant to be shared by every task of a build: the list of includes of a
+    file is parsed once per content (keyed by its md5), include directories
+    are listed once instead of stat-ing every candidate, and the headers
+    found for a given (file, include path) are computed once.
+
+    hash_func, if given, must return the md5 digest of a file content from
+    its path (e.g. FileHashCache.get), so that unchanged files do not even
+    need to be read."""
+    def __init__(self, hash_func=None):
+        self.hash_func = hash_func
+        # digest -> [(kind, name), ...]
+        self._includes = {}
+        # directory -> set of its entries
+        self._dir_index = {}
+        # (kind, name, includer directory, include path) -> path or None
+        self._resolved = {}
+        # (filename, include path) -> list of headers
+        self._deps = {}
+
+    def includes(self, filename):
+        """Return the list of (kind, name) included by filename, kind being
+        '<' or '"'."""
+        if self.hash_func is not None:
+            digest = self.hash_func(filename)
+            try:
+                return self._includes[digest]
+            except KeyError:
+                content = self._read(filename)
+        else:
+            content = self._read(filename)
+            digest = md5(content).digest()
+            try:
+                return self._includes[digest]
+            except KeyError:
+                pass
+
+        ret = self.parse(content.decode("latin-1"))
+        self._includes[digest] = ret
+        return ret
 
-            found = None
-            for n in cpppaths:
-                if found:
+    def parse(self, code):
+        """Return the list of (kind, name) included by the given code."""
+        ret = []
+        for (_, line) in _code_includes(code):
+            kind, name = extract_include(line, None)
+            if kind is not None:
+                ret.append((kind, name))
+        return ret
+
+    def _read(self, filename):
+        fid = open(filename, "rb")
+        try:
+            return fid.read()
+        finally:
+            fid.close()
+
+    def _listdir(self, dirname):
+        try:
+            return self._dir_index[dirname]
+        except KeyError:
+            try:
+                entries = set(os.listdir(dirname or "."))
+            except OSError:
+                entries = set()
+            self._dir_index[dirname] = entries
+            return entries
+
+    def _find(self, dirname, name):
+        path = os.path.join(dirname, name)
+        head, tail = os.path.split(path)
+        if tail in self._listdir(head):
+            return os.path.normpath(path)
+        return None
+
+    def resolve(self, kind, name, includer_dir, cpppaths):
+        """Return the path of the header included as name from a file in
+        includer_dir, or None if it cannot be found."""
+        if kind == '"':
+            key = (kind, name, includer_dir, cpppaths)
+        else:
+            key = (kind, name, None, cpppaths)
+        try:
+            return self._resolved[key]
+        except KeyError:
+            pass
+
+        found = None
+        if kind == '"':
+            found = self._find(includer_dir, name)
+        if found is None:
+            for d in cpppaths:
+                found = self._find(d, name)
+                if found is not None:
                     break
-                if os.path.exists(os.path.join(n, filename)):
-                    found = os.path.join(n, filename)
-                #else:
-                #    # XXX: most likely wrong
-                #    found = os.path.join(n, filename)
-                #    nodes.append(found)
-
-            if not found:
-                if not filename in names:
-                    names.append(filename)
-            elif not found in nodes:
-                nodes.append(found)
-                _find_deps(found)
-
-    _find_deps(node)
-    return nodes
+        self._resolved[key] = found
+        return found
+
+    def scan(self, filename, cpppaths):
+        """Return the list of headers included directly or indirectly by
+        filename, looked up in cpppaths."""
+        cpppaths = tuple(cpppaths)
+        key = (filename, cpppaths)
+        try:
+            return self._deps[key]
+        except KeyError:
+            pass
+
+        deps = []
+        seen = set([filename])
+        stack = [filename]
+        while stack:
+            f = stack.pop()
+            fdir = os.path.dirname(f)
+            for kind, name in self.includes(f):
+                found = self.resolve(kind, name, fdir, cpppaths)
+                if found is not None and not found in seen:
+                    seen.add(found)
+                    deps.append(found)
+                    stack.append(found)
+        self._deps[key] = deps
+        return deps
+
+def find_deps(node, cpppaths=["/usr/include", "."]):
+    return IncludeScanner().scan(node, cpppaths)
+
+RE_DEPFILE_TARGET = re.compile(r"^(.*?):(\s|$)")
+RE_DEPFILE_SEP = re.compile(r"(?<!\\)\s+")
+
+def parse_depfile(content):
+    """Parse a makefile-style dependency file, as written by gcc/clang -MD,
+    and return the list of prerequisites, in order and without duplicates."""
+    content = content.replace("\\\r\n", " ").replace("\\\n", " ")
+    deps = []
+    seen = set()
+    for line in content.splitlines():
+        m = RE_DEPFILE_TARGET.match(line)
+        if m is None:
+            continue
+        for dep in RE_DEPFILE_SEP.split(line[m.end():].strip()):
+            if not dep:
+                continue
+            dep = dep.replace("\\ ", " ").replace("$$", "$")
+            if not dep in seen:
+                seen.add(dep)
+                deps.append(dep)
+    return deps
 
 def find_program(program, path_list=None):
     if path_list is None: